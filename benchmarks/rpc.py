@@ -0,0 +1,116 @@
+"""
+Measures RPC throughput with a client and an echo service in one process,
+both as requests per second of wall time and per second of CPU time (which
+includes the zmq I/O threads), i.e. per core.
+
+The ``mock network`` numbers are for the complete request path without
+sockets: messages are packed and unpacked but handed over in memory.
+
+Usage: python benchmarks/rpc.py [--seconds=<n>] [--concurrency=<n>]
+"""
+from __future__ import print_function
+
+import lymph.monkey
+lymph.monkey.patch()
+
+import argparse
+import time
+
+import gevent
+
+import lymph
+from lymph.core.container import ServiceContainer
+from lymph.core.interfaces import Interface
+from lymph.core.messages import Message
+from lymph.core.monitoring.aggregator import Aggregator
+from lymph.core.rpc import ZmqRPCServer
+from lymph.discovery.static import StaticServiceRegistryHub
+from lymph.events.null import NullEventSystem
+from lymph.testing import MockServiceNetwork
+
+
+class Echo(Interface):
+    @lymph.rpc()
+    def echo(self, payload):
+        return payload
+
+
+def create_container(hub, interface_cls=Interface, name=None):
+    container = ServiceContainer(
+        rpc=ZmqRPCServer(),
+        registry=hub.create_registry(),
+        events=NullEventSystem(),
+        metrics=Aggregator(),
+    )
+    interface = container.install_interface(interface_cls, name=name)
+    container.start()
+    return container, interface
+
+
+def run(func, seconds, concurrency=1):
+    count = [0]
+    start, cpu_start = time.time(), time.process_time()
+    deadline = start + seconds
+
+    def loop():
+        while time.time() < deadline:
+            func()
+            count[0] += 1
+
+    gevent.joinall([gevent.spawn(loop) for i in range(concurrency)])
+    return count[0] / (time.time() - start), count[0] / (time.process_time() - cpu_start)
+
+
+def report(name, rates):
+    print('%-28s %8.0f/s %8.0f/cpu-s' % (name, rates[0], rates[1]))
+
+
+def bench_messages(seconds):
+    body = {'payload': 'x' * 64}
+
+    def roundtrip():
+        msg = Message(Message.REQ, 'echo.echo', body=body, headers={'trace_id': 'abc'})
+        frames = Message.pack_batch([msg])
+        frames.insert(0, b'tcp://127.0.0.1:1')
+        Message.unpack_batch(frames)[0].body
+
+    return run(roundtrip, seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    hub = StaticServiceRegistryHub()
+    echo_container, echo = create_container(hub, Echo, 'echo')
+    client_container, client = create_container(hub)
+    proxy = client.proxy('echo')
+    proxy.echo(payload='warmup')
+
+    def request():
+        proxy.echo(payload='x' * 64)
+
+    report('requests', run(request, args.seconds))
+    report('requests (%s greenlets)' % args.concurrency, run(request, args.seconds, args.concurrency))
+    client_container.stop()
+    echo_container.stop()
+
+    network = MockServiceNetwork()
+    network.add_service().install_interface(Echo, name='echo')
+    mock_client = network.add_service().install_interface(Interface, name='client')
+    network.start()
+    mock_proxy = mock_client.proxy('echo')
+
+    def mock_request():
+        mock_proxy.echo(payload='x' * 64)
+
+    report('mock network requests', run(mock_request, args.seconds))
+    network.stop()
+
+    report('message pack/unpack', bench_messages(args.seconds))
+
+
+if __name__ == '__main__':
+    main()
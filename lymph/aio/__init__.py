@@ -0,0 +1 @@
+from lymph.aio.client import AsyncClient, AsyncProxy  # NOQA
@@ -0,0 +1,445 @@
+"""
+An asyncio client for lymph services. It speaks the lymph wire protocol
+over :mod:`zmq.asyncio` sockets, so that asyncio applications can call
+services without running a gevent based container. Requires Python 3.5+.
+
+Registries run in a thread of their own, whose gevent hub keeps running
+between calls, so that background greenlets such as the watches of the
+ZooKeeper registry keep working.
+
+Example::
+
+    client = AsyncClient(registry)
+    await client.start()
+    echo = client.proxy('echo')
+    replies = await asyncio.gather(*[echo.upper(text=text) for text in texts])
+    await client.stop()
+
+"""
+import asyncio
+import concurrent.futures
+import errno
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+
+import gevent
+import gevent.event
+import gevent.pool
+import semantic_version
+import zmq
+import zmq.asyncio
+
+from lymph.core.components import Component
+from lymph.core.loadbalancing import get_balancer
+from lymph.core.messages import Message
+from lymph.core.services import Service, ServiceInstance
+from lymph.core.versioning import serialize_version
+from lymph.exceptions import NotConnected, Nack, RemoteError, Timeout
+from lymph.utils import MovingAverage, make_sequential_id
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncConnection(object):
+    """
+    Keeps the request statistics of an endpoint that load balancers look
+    at. The socket connection itself is managed by zmq.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.pending_requests = 0
+        self.latency = MovingAverage()
+
+    def is_alive(self):
+        return True
+
+    def is_available(self):
+        return True
+
+
+class RegistryThread(Component):
+    """
+    Runs registry calls in a thread of its own. The gevent hub of the thread
+    keeps looping between calls, calls are handed over through a threadsafe
+    queue and an async watcher that wakes the hub up. Registries that are
+    installed here get their greenlet pool from this component.
+    """
+
+    def __init__(self):
+        super(RegistryThread, self).__init__(error_hook=self._log_error)
+        self.calls = queue.Queue()
+        self.watcher = None
+        self.stopped = None
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='lymph-registry')
+        self.thread.daemon = True
+        self.thread.start()
+        self.started.wait()
+
+    @property
+    def pool(self):
+        return self._pool
+
+    def _log_error(self, exc_info):
+        logger.error('error in registry thread', exc_info=exc_info)
+
+    def _run(self):
+        hub = gevent.get_hub()
+        # `async` is a keyword since Python 3.7, newer gevent versions
+        # call the watcher `async_`.
+        watcher_factory = getattr(hub.loop, 'async_', None) or getattr(hub.loop, 'async')
+        self.watcher = watcher_factory()
+        self.watcher.start(self._process_calls)
+        self.stopped = gevent.event.Event()
+        self._pool = gevent.pool.Group()
+        self.started.set()
+        # Waiting here lets the hub run, and with it the registry.
+        self.stopped.wait()
+        self.watcher.stop()
+        self._pool.kill()
+
+    def _process_calls(self):
+        # Runs in the hub, calls are made in greenlets of their own.
+        while True:
+            try:
+                call = self.calls.get_nowait()
+            except queue.Empty:
+                return
+            if call is None:
+                self.stopped.set()
+                return
+            self._pool.spawn(self._call, *call)
+
+    def _call(self, future, func, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Calls `func` in the registry thread and returns a
+        :class:`concurrent.futures.Future` of its result.
+        """
+        future = concurrent.futures.Future()
+        self.calls.put((future, func, args, kwargs))
+        self.watcher.send()
+        return future
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls `func` in the registry thread and blocks until it returns, e.g.
+        to create a registry whose gevent objects belong to the thread.
+        """
+        return self.submit(func, *args, **kwargs).result()
+
+    def stop(self):
+        self.calls.put(None)
+        self.watcher.send()
+
+
+class AsyncClient(object):
+    """
+    Sends requests from an asyncio event loop. Services are looked up in
+    `registry` and instances are picked with the load balancing strategies
+    of :class:`lymph.core.rpc.ZmqRPCServer`. Registry calls may block, they
+    run in a :class:`RegistryThread`, and lookups are refreshed after
+    `lookup_ttl` seconds. Registries that create gevent objects, like the
+    kazoo handler of the ZooKeeper registry, have to be created in
+    `registry_thread`, as :meth:`from_config` does.
+    """
+
+    def __init__(self, registry=None, ip='127.0.0.1', port=None, load_balancing=None, connect_timeout=1, lookup_ttl=10, registry_thread=None):
+        self.registry = registry
+        self.registry_thread = registry_thread
+        if registry is not None:
+            if self.registry_thread is None:
+                self.registry_thread = RegistryThread()
+            if registry._parent_component is None:
+                registry.set_parent(self.registry_thread)
+        self.ip = ip
+        self.port = port
+        self.load_balancing = dict(load_balancing or {})
+        self.load_balancing.setdefault('default', 'random')
+        self.connect_timeout = connect_timeout
+        self.lookup_ttl = lookup_ttl
+        self.endpoint = None
+        self.zctx = zmq.asyncio.Context.instance()
+        self.send_sock = None
+        self.recv_sock = None
+        self.connections = {}
+        self.balancers = {}
+        self.services = {}
+        self.pending = {}
+        self.recv_loop_task = None
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        registry = registry_thread = None
+        if 'container.registry' in config:
+            registry_thread = RegistryThread()
+            registry = registry_thread.call(config.create_instance, 'container.registry')
+        return cls(
+            registry=registry,
+            registry_thread=registry_thread,
+            ip=config.get('container.ip', kwargs.pop('ip', None) or '127.0.0.1'),
+            port=config.get('container.port', kwargs.pop('port', None)),
+            load_balancing=config.get_raw('container.rpc.load_balancing', {}),
+            **kwargs
+        )
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def start(self):
+        self._bind()
+        if self.registry is not None:
+            await self._call_registry(self.registry.on_start)
+        self.recv_loop_task = asyncio.ensure_future(self._recv_loop())
+
+    async def stop(self):
+        if self.recv_loop_task:
+            self.recv_loop_task.cancel()
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        if self.registry is not None:
+            await self._call_registry(self.registry.on_stop)
+            self.registry_thread.stop()
+        for sock in (self.send_sock, self.recv_sock):
+            if sock:
+                sock.close(linger=0)
+
+    def _bind(self, max_retries=2):
+        self.send_sock = self.zctx.socket(zmq.ROUTER)
+        self.send_sock.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.recv_sock = self.zctx.socket(zmq.ROUTER)
+        retries = 0
+        while True:
+            port = self.port or random.randrange(35536, 65536)
+            self.endpoint = 'tcp://%s:%s' % (self.ip, port)
+            # Services send replies to the request source, which is the
+            # identity of both sockets.
+            identity = self.endpoint.encode('utf-8')
+            self.recv_sock.setsockopt(zmq.IDENTITY, identity)
+            self.send_sock.setsockopt(zmq.IDENTITY, identity)
+            try:
+                self.recv_sock.bind(self.endpoint)
+            except zmq.ZMQError as e:
+                if e.errno != errno.EADDRINUSE or retries >= max_retries:
+                    raise
+                retries += 1
+                continue
+            self.port = port
+            break
+
+    def _call_registry(self, func, *args):
+        return asyncio.wrap_future(self.registry_thread.submit(func, *args))
+
+    async def lookup(self, address, version=None):
+        if '://' in address:
+            service = Service(address, instances=[ServiceInstance(address)])
+        else:
+            try:
+                service, looked_up_at = self.services[address]
+            except KeyError:
+                service = await self._call_registry(self.registry.get, address)
+                self.services[address] = service, time.monotonic()
+            else:
+                if time.monotonic() - looked_up_at > self.lookup_ttl:
+                    self.services[address] = service, time.monotonic()
+                    await self._call_registry(self.registry.lookup, service)
+        if version:
+            service = service.match_version(version)
+        return service
+
+    def get_balancer(self, service):
+        name = getattr(service, 'name', None)
+        try:
+            return self.balancers[name]
+        except KeyError:
+            balancer = get_balancer(self.load_balancing.get(name, self.load_balancing['default']))
+            self.balancers[name] = balancer
+            return balancer
+
+    def _pick_instance(self, service, balancer=None):
+        # The registry thread updates services, they're copied before use.
+        candidates = [(instance, self.connections.get(instance.endpoint)) for instance in list(service)]
+        if not candidates:
+            raise NotConnected('service have no instance')
+        if balancer is None:
+            balancer = self.get_balancer(service)
+        return balancer.pick(candidates)
+
+    def connect(self, endpoint):
+        if endpoint not in self.connections:
+            logger.debug('connecting to %s', endpoint)
+            self.connections[endpoint] = AsyncConnection(endpoint)
+            self.send_sock.connect(endpoint)
+        return self.connections[endpoint]
+
+    async def _send(self, connection, msg):
+        frames = [connection.endpoint.encode('utf-8')] + msg.pack_frames()
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                # Without a monitor socket, a failed send is the only sign
+                # that the peer isn't connected (yet).
+                await self.send_sock.send_multipart(frames)
+                return
+            except zmq.ZMQError as e:
+                if e.errno != zmq.EHOSTUNREACH:
+                    raise
+            if time.monotonic() > deadline:
+                raise NotConnected('could not connect to %s' % connection.endpoint)
+            await asyncio.sleep(0.01)
+
+    async def request(self, address, subject, body, headers=None, timeout=1, version=None, balancer=None):
+        """
+        Sends a request to an instance of the service at `address` and
+        returns the reply message.
+        """
+        service = await self.lookup(address, version=version)
+        instance = self._pick_instance(service, balancer=balancer)
+        connection = self.connect(instance.endpoint)
+        headers = dict(headers or {})
+        headers.setdefault('trace_id', uuid.uuid4().hex)
+        headers.setdefault('deadline', time.time() + timeout)
+        headers['version'] = serialize_version(instance.version)
+        msg = Message(
+            msg_type=Message.REQ,
+            subject=subject,
+            body=body,
+            msg_id=make_sequential_id(),
+            source=self.endpoint,
+            headers=headers,
+        )
+        future = self.pending[msg.id] = asyncio.get_event_loop().create_future()
+        start = time.monotonic()
+        connection.pending_requests += 1
+        try:
+            await self._send(connection, msg)
+            reply = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise Timeout(msg)
+        finally:
+            connection.pending_requests -= 1
+            self.pending.pop(msg.id, None)
+        connection.latency.add(time.monotonic() - start)
+        if reply.type == Message.NACK:
+            raise Nack(msg)
+        elif reply.type == Message.ERROR:
+            raise RemoteError.from_reply(msg, reply)
+        return reply
+
+    def proxy(self, address, **kwargs):
+        return AsyncProxy(self, address, **kwargs)
+
+    async def _recv_loop(self):
+        while True:
+            frames = await self.recv_sock.recv_multipart()
+            try:
+                msgs = Message.unpack_batch(frames)
+            except ValueError as e:
+                logger.warning('bad message format %s: %r', e, frames)
+                continue
+            for msg in msgs:
+                self._recv_message(msg)
+
+    def _recv_message(self, msg):
+        if msg.is_request() and msg.is_idle_chatter():
+            # Services send heartbeats to the clients they got requests from.
+            asyncio.ensure_future(self._reply_to_ping(msg))
+            return
+        if not msg.is_reply():
+            # Requests and stream control messages aren't supported.
+            logger.warning('unexpected message: %s', msg)
+            return
+        future = self.pending.get(msg.subject)
+        if future is None or future.done():
+            logger.debug('reply to unknown subject: %s (msg-id=%s)', msg.subject, msg.id)
+            return
+        future.set_result(msg)
+
+    async def _reply_to_ping(self, msg):
+        # `lymph.ping` requests are answered with their payload, minimal
+        # pings with an empty body.
+        body = msg.body.get('payload') if msg.body else None
+        reply = Message(
+            msg_type=Message.REP,
+            subject=msg.id,
+            body=body,
+            source=self.endpoint,
+        )
+        try:
+            await self._send(self.connect(msg.source), reply)
+        except (NotConnected, zmq.ZMQError) as e:
+            logger.debug('cannot answer ping from %s: %s', msg.source, e)
+
+
+class AsyncProxyMethod(object):
+    def __init__(self, proxy, subject):
+        self.proxy = proxy
+        self.subject = subject
+
+    def __call__(self, **kwargs):
+        return self.proxy._call(self.subject, **kwargs)
+
+
+class AsyncProxy(object):
+    """
+    The asyncio counterpart of :class:`lymph.core.interfaces.Proxy`: calling
+    a method returns a coroutine that resolves to the reply body.
+    """
+
+    def __init__(self, client, address, timeout=1, namespace='', version=None, error_map=None, balancer=None):
+        self._client = client
+        self._address = address
+        self._timeout = timeout
+        self._namespace = namespace or address
+        if version and not isinstance(version, semantic_version.Version):
+            version = semantic_version.Version.coerce(version)
+        self._version = version
+        self._error_map = error_map or {}
+        self._balancer = get_balancer(balancer) if balancer else None
+        self._method_cache = {}
+
+    async def _call(self, __name, **kwargs):
+        try:
+            reply = await self._client.request(
+                self._address, __name, kwargs,
+                timeout=self._timeout,
+                version=self._version,
+                balancer=self._balancer,
+            )
+        except RemoteError as e:
+            error_type = str(e.__class__)
+            if error_type in self._error_map:
+                raise self._error_map[error_type]()
+            raise
+        return reply.body
+
+    def _get_subject(self, name):
+        return '%s.%s' % (self._namespace, name)
+
+    def __getattr__(self, name):
+        try:
+            return self._method_cache[name]
+        except KeyError:
+            method = AsyncProxyMethod(self, self._get_subject(name))
+            self._method_cache[name] = method
+            return method
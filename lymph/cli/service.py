@@ -5,6 +5,7 @@ import os
 from functools import partial
 import signal
 import sys
+import tempfile
 
 import gevent
 from setproctitle import setproctitle
@@ -14,6 +15,7 @@ from lymph.utils import import_object, dump_stacks
 from lymph.autoreload import set_source_change_callback
 from lymph.cli.base import Command
 from lymph.core.container import create_container, InterfaceSkipped
+from lymph.core.workers import RPCFrontend
 from lymph.core.versioning import parse_versioned_name
 from lymph.utils.sockets import get_unused_port
 
@@ -52,12 +54,16 @@ class InstanceCommand(Command):
     """
     Usage: lymph instance [--ip=<address> | --guess-external-ip | -g]
                          [--port <port> | -p <port>] [--reload] [--debug]
-                         [--interface=<cls>]... [options]
+                         [--workers=<n>] [--interface=<cls>]... [options]
 
     Runs a single service instance
 
     {INSTANCE_OPTIONS}
 
+    Worker Options:
+      --workers=<n>                Serve the instance with <n> worker processes
+                                   that share its endpoint and identity.
+
     {COMMON_OPTIONS}
     """
 
@@ -67,6 +73,10 @@ class InstanceCommand(Command):
     worker = False
 
     def run(self):
+        workers = int(self.args.get('--workers') or 1)
+        if workers > 1:
+            return self._run_workers(workers)
+
         debug = self.args.get('--debug')
         loglevel = self.args.get('--loglevel', 'ERROR')
 
@@ -90,6 +100,51 @@ class InstanceCommand(Command):
 
         self.container.join()
 
+    def _run_workers(self, count):
+        ip = self.config.get('container.rpc.ip') or self.config.get('container.ip')
+        port = self.config.get('container.rpc.port') or self.config.get('container.port') or get_unused_port()
+        endpoint = 'tcp://%s:%s' % (ip, port)
+        backend = 'ipc://%s' % os.path.join(tempfile.gettempdir(), 'lymph-workers-%s.sock' % os.getpid())
+
+        # Workers are forked before the frontend creates any zmq sockets.
+        pids = []
+        for index in range(count):
+            pid = os.fork()
+            if pid == 0:
+                self._run_worker(endpoint, backend, index)
+                sys.exit(0)
+            pids.append(pid)
+
+        frontend = RPCFrontend(
+            endpoint, backend, count,
+            connect_timeout=self.config.get('container.rpc.connection.connect_timeout', 1))
+        frontend.start()
+        setproctitle('%s (frontend: %s, workers: %s, config: %s)' % (self.proctitle, endpoint, count, self.config.source))
+        for signalnum in (signal.SIGINT, signal.SIGTERM, signal.SIGQUIT):
+            gevent.signal(signalnum, self._stop_workers, pids, signalnum)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        frontend.stop()
+
+    def _run_worker(self, endpoint, backend, index):
+        self.config.set('container.rpc.class', 'lymph.core.workers:WorkerRPCServer')
+        self.config.set('container.rpc.frontend', endpoint)
+        self.config.set('container.rpc.backend', backend)
+        self.config.set('container.rpc.index', index)
+        self.args['--workers'] = None
+        if index:
+            # All workers share the endpoint, it's registered only once.
+            self.args['--isolated'] = True
+        self.run()
+
+    def _stop_workers(self, pids, signalnum):
+        logger.info('caught %s, stopping workers', SIGNAL_NAMES.get(signalnum, signalnum))
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
     def _setup_container(self, debug, loglevel):
         self.container = create_container(self.config, worker=self.worker)
         self.container.debug = debug
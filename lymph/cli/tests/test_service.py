@@ -0,0 +1,49 @@
+import signal
+import unittest
+
+import mock
+
+from lymph.cli.service import InstanceCommand
+from lymph.config import Configuration
+
+
+class InstanceWorkersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Configuration({'container': {'ip': '127.0.0.1', 'port': 4242}})
+        self.config.source = 'test.yml'
+        self.command = InstanceCommand({'--workers': '2'}, self.config, terminal=None)
+
+    @mock.patch('os.waitpid')
+    @mock.patch('gevent.signal', create=True)
+    @mock.patch('lymph.cli.service.setproctitle')
+    @mock.patch('lymph.cli.service.RPCFrontend')
+    @mock.patch('os.fork', side_effect=[101, 102])
+    def test_run_workers(self, fork, frontend_cls, setproctitle, gevent_signal, waitpid):
+        self.command.run()
+        self.assertEqual(fork.call_count, 2)
+        frontend_cls.assert_called_once_with('tcp://127.0.0.1:4242', mock.ANY, 2, connect_timeout=1)
+        frontend = frontend_cls.return_value
+        frontend.start.assert_called_once_with()
+        self.assertEqual(gevent_signal.call_args_list, [
+            mock.call(signalnum, self.command._stop_workers, [101, 102], signalnum)
+            for signalnum in (signal.SIGINT, signal.SIGTERM, signal.SIGQUIT)
+        ])
+        self.assertEqual(waitpid.call_args_list, [mock.call(101, 0), mock.call(102, 0)])
+        frontend.stop.assert_called_once_with()
+
+    def test_run_worker(self):
+        with mock.patch.object(self.command, 'run') as run:
+            self.command._run_worker('tcp://127.0.0.1:4242', 'ipc:///tmp/workers.sock', 1)
+        run.assert_called_once_with()
+        self.assertEqual(self.config.get('container.rpc.class'), 'lymph.core.workers:WorkerRPCServer')
+        self.assertEqual(self.config.get('container.rpc.frontend'), 'tcp://127.0.0.1:4242')
+        self.assertEqual(self.config.get('container.rpc.backend'), 'ipc:///tmp/workers.sock')
+        self.assertEqual(self.config.get('container.rpc.index'), 1)
+        self.assertIsNone(self.command.args['--workers'])
+        self.assertTrue(self.command.args['--isolated'])
+
+    @mock.patch('os.kill', side_effect=[OSError, None])
+    def test_stop_workers(self, kill):
+        self.command._stop_workers([101, 102], signal.SIGINT)
+        self.assertEqual(kill.call_args_list, [mock.call(101, signal.SIGTERM), mock.call(102, signal.SIGTERM)])
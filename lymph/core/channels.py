@@ -1,46 +1,196 @@
+import logging
+import time
+
 import gevent
+import gevent.event
 import gevent.queue
 
 from lymph.exceptions import Timeout, Nack, RemoteError
 from lymph.core.messages import Message
 
 
+logger = logging.getLogger(__name__)
+
+# Values of the `stream` header of streamed replies and stream control messages.
+STREAM_MORE = 'more'
+STREAM_END = 'end'
+STREAM_CREDIT = 'credit'
+STREAM_CANCEL = 'cancel'
+STREAM_CONTROL = (STREAM_CREDIT, STREAM_CANCEL)
+STREAM_CREDIT_TIMEOUT = 60  # seconds.
+
+
 class Channel(object):
+    __slots__ = ('request', 'server')
+
     def __init__(self, request, server):
         self.request = request
         self.server = server
 
+    def on_sent(self, connection):
+        pass
+
+    def on_expired(self):
+        pass
+
 
 class RequestChannel(Channel):
-    def __init__(self, request, server):
+    __slots__ = ('result', 'connection', 'sent_at')
+
+    def __init__(self, request, server, result=None):
         super(RequestChannel, self).__init__(request, server)
+        self.result = result if result is not None else gevent.event.AsyncResult()
+        self.connection = None
+        self.sent_at = None
+
+    def on_sent(self, connection):
+        self.connection = connection
+        self.sent_at = time.monotonic()
+        connection.on_request_sent()
+
+    def _done(self, msg=None, timed_out=False):
+        if self.connection:
+            self.connection.on_request_done(time.monotonic() - self.sent_at, msg=msg, timed_out=timed_out)
+            self.connection = None
+
+    def on_expired(self):
+        # The reply didn't arrive in time, it counts as a timeout. A caller
+        # that still waits for it is woken up, the reply would be late.
+        self._done(timed_out=True)
+        if not self.result.ready():
+            self.result.set_exception(Timeout(self.request))
+
+    def recv(self, msg):
+        self._done(msg)
+        # The first reply wins if the result is shared, e.g. by hedged requests.
+        if not self.result.ready():
+            self.result.set(msg)
+
+    def get(self, timeout=1):
+        msg = None
+        try:
+            msg = self.result.wait(timeout)
+            if msg is None:
+                self._done(timed_out=True)
+                raise Timeout(self.request)
+            return self.check_reply(msg)
+        finally:
+            self.close(timed_out=msg is None)
+
+    def check_reply(self, msg):
+        if msg.type == Message.NACK:
+            raise Nack(self.request)
+        elif msg.type == Message.ERROR:
+            raise RemoteError.from_reply(self.request, msg)
+        return msg
+
+    def close(self, timed_out=False):
+        self._done()
+        self.server.channels.remove(self.request.id, timed_out=timed_out)
+
+
+class StreamChannel(RequestChannel):
+    """
+    A request channel for a reply that is streamed as a sequence of
+    messages. The server sends at most `credit` messages ahead of the
+    consumer, credit is granted again as the consumer catches up.
+    """
+    __slots__ = ('queue', 'credit', 'outstanding', 'endpoint', 'finished')
+
+    def __init__(self, request, server, credit=16):
+        super(StreamChannel, self).__init__(request, server)
         self.queue = gevent.queue.Queue()
+        self.credit = credit
+        self.outstanding = credit
+        self.endpoint = None
+        self.finished = False
+
+    def on_sent(self, connection):
+        super(StreamChannel, self).on_sent(connection)
+        self.endpoint = connection.endpoint
 
     def recv(self, msg):
+        self._done(msg)
+        self.server.channels.touch(self.request.id)
         self.queue.put(msg)
 
-    def get(self, timeout=1):
+    def _send_control(self, msg_type, body, stream):
+        if not self.endpoint:
+            return
+        msg = Message(
+            msg_type=msg_type,
+            subject=self.request.id,
+            body=body,
+            source=self.server.endpoint,
+            headers=self.server.prepare_headers(None, stream=stream),
+        )
+        self.server._send_message(self.endpoint, msg)
+
+    def iter(self, timeout=1):
+        """
+        Yields the streamed reply bodies, waiting at most `timeout` seconds
+        for each of them. Replies that the server did not stream are
+        iterated over.
+        """
+        timed_out = False
         try:
-            msg = self.queue.get(timeout=timeout)
-            if msg.type == Message.NACK:
-                raise Nack(self.request)
-            elif msg.type == Message.ERROR:
-                raise RemoteError.from_reply(self.request, msg)
-            return msg
-        except gevent.queue.Empty:
-            raise Timeout(self.request)
+            while True:
+                try:
+                    msg = self.queue.get(timeout=timeout)
+                except gevent.queue.Empty:
+                    timed_out = True
+                    self._done(timed_out=True)
+                    raise Timeout(self.request)
+                self.endpoint = msg.source
+                stream = msg.headers.get('stream')
+                self.finished = msg.type != Message.REP or stream != STREAM_MORE
+                self.check_reply(msg)
+                if stream is None:
+                    for body in msg.body or ():
+                        yield body
+                    return
+                if stream == STREAM_END:
+                    return
+                self.outstanding -= 1
+                if self.outstanding <= self.credit // 2:
+                    self._send_control(Message.ACK, self.credit - self.outstanding, STREAM_CREDIT)
+                    self.outstanding = self.credit
+                yield msg.body
         finally:
-            self.close()
+            if not self.finished:
+                self._send_control(Message.NACK, None, STREAM_CANCEL)
+            self.close(timed_out=timed_out)
+
+
+class CallbackChannel(Channel):
+    """
+    A request channel that passes its reply to `callback` as soon as it
+    arrives instead of queueing it for a waiting greenlet.
+    """
+    __slots__ = ('callback',)
+
+    def __init__(self, request, server, callback):
+        super(CallbackChannel, self).__init__(request, server)
+        self.callback = callback
+
+    def recv(self, msg):
+        self.close()
+        self.callback(self, msg)
 
     def close(self):
-        del self.server.channels[self.request.id]
+        self.server.channels.remove(self.request.id)
 
 
 class ReplyChannel(Channel):
+    __slots__ = ('_sent_reply', '_headers', '_credit', '_credit_event', '_cancelled')
+
     def __init__(self, request, server):
         super(ReplyChannel, self).__init__(request, server)
         self._sent_reply = False
         self._headers = {}
+        self._credit = 0
+        self._credit_event = None
+        self._cancelled = False
 
     def add_header(self, name, value):
         self._headers[name] = value
@@ -49,6 +199,10 @@ class ReplyChannel(Channel):
         self.server.send_reply(self.request, body, headers=self._headers)
         self._sent_reply = True
 
+    def reply_packed(self, packed_body):
+        self.server.send_reply(self.request, None, headers=self._headers, packed_body=packed_body)
+        self._sent_reply = True
+
     def ack(self, unless_reply_sent=False):
         if unless_reply_sent and self._sent_reply:
             return
@@ -64,5 +218,45 @@ class ReplyChannel(Channel):
     def error(self, **body):
         self.server.send_reply(self.request, body, msg_type=Message.ERROR, headers=self._headers)
 
+    def stream(self, iterable, credit_timeout=STREAM_CREDIT_TIMEOUT):
+        """
+        Sends the items of `iterable` as separate replies, followed by an end
+        marker. Sending blocks while the client has no credit left. Clients
+        that did not ask for a streamed reply get a single reply with a list.
+        """
+        if not self.request.headers.get('stream'):
+            self.reply(list(iterable))
+            return
+        self._credit = int(self.request.headers['stream'])
+        self._credit_event = gevent.event.Event()
+        self.server.streams[self.request.id] = self
+        headers = dict(self._headers, stream=STREAM_MORE)
+        try:
+            for item in iterable:
+                while self._credit <= 0 and not self._cancelled:
+                    self._credit_event.clear()
+                    if not self._credit_event.wait(credit_timeout):
+                        logger.warning('stream credit timeout, giving up subject=%s', self.request.subject)
+                        return
+                if self._cancelled:
+                    logger.debug('stream cancelled subject=%s', self.request.subject)
+                    return
+                self._credit -= 1
+                self.server.send_reply(self.request, item, headers=dict(headers))
+            self.server.send_reply(self.request, None, headers=dict(self._headers, stream=STREAM_END))
+            self._sent_reply = True
+        finally:
+            self.server.streams.pop(self.request.id, None)
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    def recv(self, msg):
+        # stream control messages from the client
+        if msg.type == Message.NACK:
+            self._cancelled = True
+        else:
+            self._credit += msg.body
+        self._credit_event.set()
+
     def close(self):
         pass
@@ -0,0 +1,105 @@
+from __future__ import division
+
+import collections
+import logging
+import time
+
+from lymph.core.messages import Message
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the outcomes of the last `window` requests to an endpoint. Once at
+    least `min_requests` outcomes are known and the share of failures reaches
+    `failure_rate`, the breaker opens and the endpoint is not picked for
+    requests. After `reset_timeout` seconds a single probe request is let
+    through (half-open); its outcome closes or re-opens the breaker.
+
+    Timeouts and NACKs count as failures, as do replies slower than
+    `max_latency` seconds (if given) and error replies if `remote_errors` is
+    set.
+    """
+
+    def __init__(self, endpoint, window=20, failure_rate=0.5, min_requests=10, reset_timeout=5, max_latency=None, remote_errors=False):
+        self.endpoint = endpoint
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.reset_timeout = reset_timeout
+        self.max_latency = max_latency
+        self.remote_errors = remote_errors
+        self.outcomes = collections.deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = None
+        self.probing = False
+        self.open_count = 0
+
+    @classmethod
+    def create(cls, endpoint, config):
+        if not config:
+            return None
+        if config is True:
+            config = {}
+        return cls(endpoint, **config)
+
+    def set_state(self, state):
+        if state != self.state:
+            logger.info('changing circuit breaker state to %r endpoint=%s', state, self.endpoint)
+        self.state = state
+
+    def open(self):
+        self.set_state(OPEN)
+        self.opened_at = time.monotonic()
+        self.open_count += 1
+
+    def close(self):
+        self.set_state(CLOSED)
+        self.outcomes.clear()
+
+    def is_failure(self, took, msg, timed_out):
+        if timed_out:
+            return True
+        if msg is None:
+            return False
+        if msg.type == Message.NACK:
+            return True
+        if msg.type == Message.ERROR and self.remote_errors:
+            return True
+        return bool(self.max_latency and took > self.max_latency)
+
+    def is_available(self):
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.set_state(HALF_OPEN)
+            self.probing = False
+        if self.state == HALF_OPEN:
+            return not self.probing
+        return self.state == CLOSED
+
+    def on_request_sent(self):
+        if self.state == HALF_OPEN:
+            self.probing = True
+
+    def on_request_done(self, took, msg=None, timed_out=False):
+        if msg is None and not timed_out:
+            # discarded without an outcome
+            if self.state == HALF_OPEN:
+                self.probing = False
+            return
+        failed = self.is_failure(took, msg, timed_out)
+        if self.state == HALF_OPEN:
+            if failed:
+                self.open()
+            else:
+                self.close()
+            return
+        if self.state == OPEN:
+            return
+        self.outcomes.append(failed)
+        if len(self.outcomes) >= self.min_requests and sum(self.outcomes) / len(self.outcomes) >= self.failure_rate:
+            self.open()
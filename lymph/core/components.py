@@ -44,6 +44,9 @@ class Component(object):
         return self._parent_component.metrics
 
     def spawn(self, func, *args, **kwargs):
+        return self._spawn_in(self.pool, func, *args, **kwargs)
+
+    def _spawn_in(self, pool, func, *args, **kwargs):
         def _inner():
             try:
                 return func(*args, **kwargs)
@@ -52,7 +55,7 @@ class Component(object):
             except:
                 self.error_hook(sys.exc_info())
                 raise
-        return self.pool.spawn(_inner)
+        return pool.spawn(_inner)
 
 
 class Declaration(object):
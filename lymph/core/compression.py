@@ -0,0 +1,109 @@
+import abc
+import time
+import zlib
+
+import six
+
+from lymph.exceptions import ConfigurationError
+from lymph.utils import import_object
+
+
+@six.add_metaclass(abc.ABCMeta)
+class Codec(object):
+    """
+    Compresses packed message bodies. `name` is sent in the ``encoding``
+    header of compressed messages and has to be known to the receiver.
+    """
+    name = None
+
+    @abc.abstractmethod
+    def compress(self, data):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def decompress(self, data):
+        raise NotImplementedError()
+
+
+class ZlibCodec(Codec):
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+_codecs = {}
+
+
+def register_codec(codec):
+    _codecs[codec.name] = codec
+
+
+def get_codec(name):
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise ValueError('unknown message encoding: %r' % name)
+
+
+register_codec(ZlibCodec())
+
+
+class Compression(object):
+    """
+    Compresses message bodies of at least `threshold` bytes with `codec`,
+    which may be the name of a registered codec or the import path of a
+    :class:`Codec` subclass. Keeps statistics about the compressed bodies.
+    """
+
+    def __init__(self, codec='zlib', threshold=4096, **kwargs):
+        if ':' in codec:
+            codec = import_object(codec)(**kwargs)
+            register_codec(codec)
+        elif codec == ZlibCodec.name:
+            codec = ZlibCodec(**kwargs)
+        else:
+            raise ConfigurationError('unknown compression codec: %r' % codec)
+        self.codec = codec
+        self.threshold = threshold
+        self.count = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.time = 0
+
+    @classmethod
+    def create(cls, config):
+        if not config:
+            return None
+        if config is True:
+            config = {}
+        return cls(**config)
+
+    @property
+    def ratio(self):
+        if not self.bytes_in:
+            return 1
+        return self.bytes_out / float(self.bytes_in)
+
+    def compress(self, msg):
+        if msg.headers.get('encoding'):
+            return False
+        body = msg.packed_body
+        if len(body) < self.threshold:
+            return False
+        start = time.monotonic()
+        compressed = self.codec.compress(body)
+        self.time += time.monotonic() - start
+        self.count += 1
+        self.bytes_in += len(body)
+        self.bytes_out += len(compressed)
+        if len(compressed) >= len(body):
+            return False
+        msg.set_packed_body(compressed, encoding=self.codec.name)
+        return True
@@ -2,13 +2,17 @@
 from __future__ import division, unicode_literals
 
 import gevent
+import gevent.event
+import heapq
+import itertools
 import math
 import os
 import time
 import logging
 
-from lymph.utils import SampleWindow
-from lymph.exceptions import RpcError
+from lymph.utils import SampleWindow, MovingAverage
+from lymph.core.circuitbreaker import CircuitBreaker
+from lymph.core.messages import Message
 
 logger = logging.getLogger(__name__)
 
@@ -18,17 +22,31 @@ UNRESPONSIVE = 'unresponsive'
 CLOSED = 'closed'
 IDLE = 'idle'
 
+# Peers that don't support minimal pings leave them unanswered. After this
+# many unanswered pings in a row, connections fall back to lymph.ping.
+MINIMAL_PING_ATTEMPTS = 3
+
 
 class Connection(object):
-    def __init__(self, server, endpoint, heartbeat_interval=1, timeout=3, idle_timeout=10, unresponsive_disconnect=30, idle_disconnect=60):
+    def __init__(self, server, endpoint, heartbeat_interval=1, timeout=3, idle_timeout=10, unresponsive_disconnect=None, idle_disconnect=None, circuit_breaker=None, connect_timeout=1, address=None, adaptive_heartbeat=False):
         assert heartbeat_interval < timeout < idle_timeout
         self.server = server
         self.endpoint = endpoint
+        # The socket address used to reach the endpoint, e.g. an ipc endpoint.
+        self.address = address or endpoint
         self.timeout = timeout
         self.heartbeat_interval = heartbeat_interval
         self.idle_timeout = idle_timeout
         self.unresponsive_disconnect = unresponsive_disconnect
         self.idle_disconnect = idle_disconnect
+        self.connect_timeout = connect_timeout
+        # In adaptive mode, real traffic stands in for heartbeats: requests
+        # feed the round-trip samples and pings are only sent when nothing
+        # has been received for a heartbeat interval. Pings are minimal
+        # unless the peer turns out not to support them.
+        self.adaptive_heartbeat = adaptive_heartbeat
+        self.minimal_pings = adaptive_heartbeat
+        self.unanswered_pings = 0
 
         now = time.monotonic()
         self.last_seen = 0
@@ -36,21 +54,29 @@ class Connection(object):
         self.last_message = now
         self.created_at = now
         self.heartbeat_samples = SampleWindow(100, factor=1000)  # milliseconds
+        self.latency = MovingAverage()  # seconds
+        self.pending_requests = 0
+        self.breaker = CircuitBreaker.create(endpoint, circuit_breaker)
         self.explicit_heartbeat_count = 0
+        self.skipped_heartbeat_count = 0
         self.status = UNKNOWN
 
         self.received_message_count = 0
         self.sent_message_count = 0
+        self.accepted_encodings = ()
 
-        if self.heartbeat_interval:
-            self.heartbeat_loop_greenlet = self.server.spawn(self.heartbeat_loop)
-            self.live_check_loop_greenlet = self.server.spawn(self.live_check_loop)
-        else:
-            self.heartbeat_loop_greenlet = None
-            self.live_check_loop_greenlet = None
+        self.heartbeat_channel = None
+        self.heartbeat_sent_at = None
+
+        # Set once the socket connection to the endpoint is established.
+        self.ready = gevent.event.Event()
+        self.ready_timed_out = False
 
         self.pid = os.getpid()
 
+        if self.heartbeat_interval:
+            self.server.heartbeats.add(self)
+
     def __str__(self):
         return "connection to=%s last_seen=%s" % (self.endpoint, self._dt())
 
@@ -69,27 +95,79 @@ class Connection(object):
             logger.info('changing connection status to %r endpoint=%s', status, self.endpoint)
         self.status = status
 
-    def heartbeat_loop(self):
-        while True:
-            start = time.monotonic()
-            channel = self.server.ping(self.endpoint)
-            error = False
-            try:
-                channel.get(timeout=self.heartbeat_interval)
-            except RpcError as e:
-                logger.debug('hearbeat error on %s: %r', self, e)
-                error = True
-            took = time.monotonic() - start
-            if not error:
-                self.heartbeat_samples.add(took)
-                self.explicit_heartbeat_count += 1
-            gevent.sleep(max(0, self.heartbeat_interval - took))
-
-    def live_check_loop(self):
-        while True:
-            self.update_status()
-            self.log_stats()
-            gevent.sleep(1)
+    def on_connected(self):
+        self.ready.set()
+        self.ready_timed_out = False
+        # Don't wait for the next scheduled heartbeat to find out whether
+        # the peer is responsive.
+        self.heartbeat()
+
+    def on_disconnected(self):
+        self.ready.clear()
+
+    def wait_ready(self):
+        """
+        Waits until the connection is established, at most `connect_timeout`
+        seconds. Once that timed out, messages are sent right away until the
+        connection is established.
+        """
+        if self.ready.is_set() or self.ready_timed_out:
+            return
+        if not self.ready.wait(self.connect_timeout):
+            logger.warning('connection not established after %s seconds endpoint=%s', self.connect_timeout, self.endpoint)
+            self.ready_timed_out = True
+
+    def heartbeat(self):
+        if not self.ready.is_set():
+            # The first heartbeat is sent once the connection is established.
+            return
+        now = time.monotonic()
+        if self.adaptive_heartbeat and now - self.last_seen < self.heartbeat_interval:
+            self.skipped_heartbeat_count += 1
+            return
+        if self.heartbeat_channel:
+            logger.debug('hearbeat timeout on %s', self)
+            self.heartbeat_channel.close()
+            self.heartbeat_channel = None
+            if self.minimal_pings:
+                self.unanswered_pings += 1
+                if self.unanswered_pings >= MINIMAL_PING_ATTEMPTS:
+                    logger.info('minimal pings not answered, falling back to lymph.ping endpoint=%s', self.endpoint)
+                    self.minimal_pings = False
+        self.heartbeat_sent_at = now
+        send_ping = self.server.send_ping if self.minimal_pings else self.server.ping
+        channel = send_ping(self.endpoint, callback=self.on_heartbeat)
+        if self.heartbeat_sent_at is not None:
+            # Minimal pings to a local peer are answered right away.
+            self.heartbeat_channel = channel
+
+    def on_heartbeat(self, channel, msg):
+        if self.heartbeat_channel is not None and channel is not self.heartbeat_channel:
+            return
+        self.heartbeat_channel = None
+        took = time.monotonic() - self.heartbeat_sent_at
+        self.heartbeat_sent_at = None
+        if msg.type != Message.REP:
+            logger.debug('hearbeat error on %s: %s', self, msg)
+            return
+        self.unanswered_pings = 0
+        self.heartbeat_samples.add(took)
+        self.latency.add(took)
+        self.explicit_heartbeat_count += 1
+
+    def on_request_sent(self):
+        self.pending_requests += 1
+        if self.breaker:
+            self.breaker.on_request_sent()
+
+    def on_request_done(self, took, msg=None, timed_out=False):
+        self.pending_requests -= 1
+        if msg is not None or timed_out:
+            self.latency.add(took)
+        if msg is not None and self.adaptive_heartbeat:
+            self.heartbeat_samples.add(took)
+        if self.breaker:
+            self.breaker.on_request_done(took, msg=msg, timed_out=timed_out)
 
     def update_status(self):
         if self.last_seen:
@@ -97,11 +175,31 @@ class Connection(object):
             if now - self.last_seen >= self.timeout:
                 self.set_status(UNRESPONSIVE)
             elif now - self.last_message >= self.idle_timeout:
+                if self.status != IDLE:
+                    self.idle_since = now
                 self.set_status(IDLE)
-                self.idle_since = now
             else:
                 self.set_status(RESPONSIVE)
 
+    def should_disconnect(self, now=None):
+        """
+        Returns the reason to disconnect from the peer, or None: 'unresponsive'
+        if nothing has been received for `unresponsive_disconnect` seconds,
+        'idle' if no messages other than heartbeats have been exchanged for
+        `idle_disconnect` seconds and no requests are pending. Either limit
+        may be None, which is the default. Connections to instances of
+        prewarmed services are never idle.
+        """
+        if now is None:
+            now = time.monotonic()
+        if self.unresponsive_disconnect is not None and self.status in (UNKNOWN, UNRESPONSIVE):
+            if now - max(self.last_seen, self.created_at) >= self.unresponsive_disconnect:
+                return UNRESPONSIVE
+        if self.idle_disconnect is not None and not self.pending_requests and now - self.last_message >= self.idle_disconnect:
+            if self.endpoint not in self.server.prewarmed_endpoints:
+                return IDLE
+        return None
+
     def log_stats(self):
         roundtrip_stats = 'window (mean rtt={mean:.1f} ms; stddev rtt={stddev:.1f})'.format(**self.heartbeat_samples.stats)
         roundtrip_total_stats = 'total (mean rtt={mean:.1f} ms; stddev rtt={stddev:.1f})'.format(**self.heartbeat_samples.total.stats)
@@ -119,9 +217,10 @@ class Connection(object):
         if self.status == CLOSED:
             return
         self.status = CLOSED
-        if self.heartbeat_loop_greenlet:
-            self.heartbeat_loop_greenlet.kill()
-            self.live_check_loop_greenlet.kill()
+        self.server.heartbeats.remove(self)
+        if self.heartbeat_channel:
+            self.heartbeat_channel.close()
+            self.heartbeat_channel = None
         self.server.disconnect(self.endpoint)
 
     def on_recv(self, msg):
@@ -130,6 +229,9 @@ class Connection(object):
         if not msg.is_idle_chatter():
             self.last_message = now
         self.received_message_count += 1
+        if msg.is_request() and msg.headers:
+            # Minimal pings don't carry headers.
+            self.accepted_encodings = msg.headers.get('accept_encoding') or ()
 
     def on_send(self, msg):
         if not msg.is_idle_chatter():
@@ -139,13 +241,95 @@ class Connection(object):
     def is_alive(self):
         return self.status in (RESPONSIVE, IDLE, UNKNOWN)
 
+    def is_available(self):
+        return not self.breaker or self.breaker.is_available()
+
     def stats(self):
         # FIXME: rtt and phi should be recorded as summary/histogram for all connections
         return {
             'endpoint': self.endpoint,
             'rtt': self.heartbeat_samples.stats,
             'phi': self.phi,
+            'latency': self.latency.value,
+            'pending': self.pending_requests,
+            'breaker': self.breaker.state if self.breaker else None,
             'status': self.status,
             'sent': self.sent_message_count,
             'received': self.received_message_count,
         }
+
+
+class HeartbeatScheduler(object):
+    """
+    Drives heartbeats and status checks for all connections of a server from
+    a single greenlet. Heartbeats are kept in a heap ordered by their due
+    time, status checks run for all connections every `status_interval`
+    seconds.
+    """
+
+    def __init__(self, server, status_interval=1):
+        self.server = server
+        self.status_interval = status_interval
+        self.connections = set()
+        self.heap = []
+        self.counter = itertools.count()
+        self.wakeup = gevent.event.Event()
+        self.loop_greenlet = None
+
+    def __len__(self):
+        return len(self.connections)
+
+    def add(self, connection):
+        self.connections.add(connection)
+        self.schedule(connection, time.monotonic())
+
+    def remove(self, connection):
+        # Heap entries of removed connections are skipped when they are due.
+        self.connections.discard(connection)
+
+    def schedule(self, connection, due):
+        heapq.heappush(self.heap, (due, next(self.counter), connection))
+        if self.heap[0][2] is connection:
+            self.wakeup.set()
+
+    def start(self):
+        self.loop_greenlet = self.server.spawn(self.loop)
+
+    def stop(self):
+        if self.loop_greenlet:
+            self.loop_greenlet.kill()
+
+    def run_heartbeats(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            due, _, connection = heapq.heappop(self.heap)
+            if connection not in self.connections:
+                continue
+            try:
+                connection.heartbeat()
+            except Exception:
+                logger.exception('heartbeat failed on %s', connection)
+            self.schedule(connection, max(now, due + connection.heartbeat_interval))
+
+    def update_status(self):
+        now = time.monotonic()
+        for connection in list(self.connections):
+            connection.update_status()
+            connection.log_stats()
+            reason = connection.should_disconnect(now)
+            if reason:
+                logger.info('disconnecting from %s: %s', connection.endpoint, reason)
+                self.server.reap_connection(connection, reason)
+
+    def loop(self):
+        next_status_check = time.monotonic()
+        while True:
+            now = time.monotonic()
+            self.run_heartbeats(now)
+            if now >= next_status_check:
+                self.update_status()
+                next_status_check = now + self.status_interval
+            timeout = next_status_check - now
+            if self.heap:
+                timeout = min(timeout, self.heap[0][0] - now)
+            self.wakeup.clear()
+            self.wakeup.wait(max(0, timeout))
@@ -7,13 +7,14 @@ import socket
 import six
 import semantic_version
 
-from lymph.exceptions import RegistrationFailure, SocketNotCreated, NoSharedSockets, ConfigurationError
+from lymph.exceptions import RegistrationFailure, SocketNotCreated, NoSharedSockets, ConfigurationError, LookupFailure
 from lymph.core.components import Componentized
 from lymph.core.events import Event
 from lymph.core.monitoring import metrics
 from lymph.core.monitoring.pusher import MonitorPusher
 from lymph.core.monitoring.aggregator import Aggregator
 from lymph.core.services import ServiceInstance, Service
+from lymph.core.channels import RequestChannel
 from lymph.core.rpc import ZmqRPCServer
 from lymph.core.interfaces import DefaultInterface
 from lymph.core.plugins import Hook
@@ -99,6 +100,8 @@ class ServiceContainer(Componentized):
         self.events = events
 
         self.installed_interfaces = {}
+        # (subject, version) -> (interface, method name)
+        self.routes = {}
         self.installed_plugins = []
 
         self.debug = debug
@@ -153,6 +156,7 @@ class ServiceContainer(Componentized):
         self.add_component(interface)
         versions = self.installed_interfaces.setdefault(interface.name, InterfaceVersions())
         versions.add(interface)
+        self.routes.clear()
         for plugin in self.installed_plugins:
             plugin.on_interface_installation(interface)
         return interface
@@ -195,6 +199,8 @@ class ServiceContainer(Componentized):
         description.update({
             'id': interface.id,
             'endpoint': self.endpoint,
+            'ipc_endpoint': self.server.ipc_endpoint,
+            'batching': True,
             'identity': self.identity,
             'log_endpoint': self.log_endpoint,
             'monitoring_endpoint': self.monitor.endpoint,
@@ -246,6 +252,14 @@ class ServiceContainer(Componentized):
             service = service.match_version(version)
         return service
 
+    def prewarm(self, address, version=None):
+        try:
+            service = self.lookup(address, version=version)
+        except LookupFailure as e:
+            logger.warning('cannot prewarm connections to %s: %r', address, e)
+            return
+        self.server.prewarm(service)
+
     def discover(self):
         return self.service_registry.discover()
 
@@ -255,27 +269,50 @@ class ServiceContainer(Componentized):
         event = Event(event_type, payload, source=self.identity, headers=headers)
         self.events.emit(event, **kwargs)
 
-    def send_request(self, address, subject, body, headers=None, version=None):
+    def send_request(self, address, subject, body, headers=None, version=None, balancer=None, channel_factory=RequestChannel):
         service = self.lookup(address, version=version)
-        return self.server.send_request(service, subject, body, headers=headers)
+        return self.server.send_request(service, subject, body, headers=headers, balancer=balancer, channel_factory=channel_factory)
 
-    def handle_request(self, channel):
-        interface_name, func_name = channel.request.subject.rsplit('.', 1)
-        version = channel.request.version
+    def send_requests(self, address, requests, headers=None, version=None, balancer=None):
+        service = self.lookup(address, version=version)
+        return self.server.send_requests(service, requests, headers=headers, balancer=balancer)
+
+    def route_request(self, subject, version):
+        """
+        Returns the interface and method name that handle requests for
+        `subject` with the serialized `version`, or None if there is no such
+        interface.
+        """
+        interface_name, func_name = subject.rsplit('.', 1)
         if version:
             version = semantic_version.Version(version)
         try:
             versions = self.installed_interfaces[interface_name]
         except KeyError:
             logger.warning('Unsupported interface: %s', interface_name)
-            channel.nack(True)
-            return
+            return None
         try:
             interface = versions[version]
         except KeyError:
             logger.warning('Unsupported version: %s@%s', interface_name, version)
-            channel.nack(True)
-            return
+            return None
+        return interface, func_name
+
+    def handle_request(self, channel):
+        key = (channel.request.subject, channel.request.version)
+        try:
+            interface, func_name = self.routes[key]
+        except KeyError:
+            route = self.route_request(*key)
+            if route is None:
+                channel.nack(True)
+                return
+            interface, func_name = route
+            # Only routes to existing methods are kept, the table is bounded
+            # by the installed interfaces.
+            if func_name in interface.methods:
+                self.routes[key] = route
+        interface_name = interface.name
         try:
             interface.handle_request(func_name, channel)
         except Exception:
@@ -2,10 +2,17 @@ import abc
 import collections
 import functools
 import inspect
+import weakref
 
+import gevent.event
 import six
 
+from lymph.core import trace
 from lymph.core.declarations import Declaration
+from lymph.core.monitoring import metrics
+from lymph.exceptions import Timeout
+from lymph.serializers import msgpack_serializer
+from lymph.utils.cache import LRUCache, freeze
 
 
 @six.add_metaclass(abc.ABCMeta)
@@ -76,31 +83,175 @@ class _RawRPCDecorator(RPCBase):
         return self._func(interface, channel, *args, **kwargs)
 
 
+class _Batch(object):
+    def __init__(self):
+        self.calls = []
+        self.started = False
+        self.result = gevent.event.AsyncResult()
+
+
+class _Batcher(object):
+    """
+    Collects concurrent calls of a batched RPC method on one interface. The
+    first call of a batch waits up to `max_wait` seconds for more calls, the
+    batch is run as soon as it has `max_batch` calls. The method is called in
+    the greenlet of one of the callers with the list of their kwargs and has
+    to return a list with a result for each of them. If that caller is killed
+    before the batch is done, the other callers fail with a
+    :class:`lymph.exceptions.Timeout`.
+    """
+
+    def __init__(self, func, max_batch, max_wait):
+        self.func = func
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = None
+        self.batch_count = 0
+        self.call_count = 0
+
+    def call(self, interface, kwargs):
+        batch = self.pending
+        first = batch is None
+        if first:
+            batch = self.pending = _Batch()
+        index = len(batch.calls)
+        batch.calls.append(kwargs)
+        if len(batch.calls) >= self.max_batch:
+            self.run(interface, batch)
+        elif first:
+            try:
+                batch.result.wait(self.max_wait)
+                if not batch.started:
+                    self.run(interface, batch)
+            finally:
+                if not batch.started:
+                    # Killed while waiting for more calls, the batch would
+                    # never run.
+                    self.abort(batch, 'batch was abandoned by its first caller')
+        # Callers don't wait longer than their request deadline allows.
+        remaining = trace.get_remaining_time()
+        batch.result.wait(None if remaining is None else max(0, remaining))
+        if not batch.result.ready():
+            raise Timeout(None, 'timed out waiting for batched call')
+        return batch.result.get()[index]
+
+    def abort(self, batch, reason):
+        if self.pending is batch:
+            self.pending = None
+        batch.started = True
+        batch.result.set_exception(Timeout(None, reason))
+
+    def run(self, interface, batch):
+        if self.pending is batch:
+            self.pending = None
+        batch.started = True
+        self.batch_count += 1
+        self.call_count += len(batch.calls)
+        try:
+            results = self.func(interface, batch.calls)
+            if len(results) != len(batch.calls):
+                raise ValueError('batched call returned %s results for %s calls' % (len(results), len(batch.calls)))
+        except Exception as e:
+            batch.result.set_exception(e)
+        else:
+            batch.result.set(results)
+        finally:
+            if not batch.result.ready():
+                # Cancelled, e.g. by gevent.Timeout or GreenletExit.
+                batch.result.set_exception(Timeout(None, 'batched call was cancelled'))
+
+
 class _RPCDecorator(RPCBase):
 
     def __init__(self, *args, **kwargs):
         self._raises = kwargs.pop('raises', ())
+        self._cache_ttl = kwargs.pop('cache', None)
+        self._cache_max_entries = kwargs.pop('max_entries', 1000)
+        self._caches = weakref.WeakKeyDictionary()
+        self._batch = kwargs.pop('batch', False)
+        self._max_batch = kwargs.pop('max_batch', 100)
+        self._max_wait = kwargs.pop('max_wait_ms', 5) / 1000.0
+        self._batchers = weakref.WeakKeyDictionary()
         super(_RPCDecorator, self).__init__(*args, **kwargs)
 
     @property
     def raises(self):
         return self._raises
 
+    def get_cache(self, interface):
+        try:
+            return self._caches[interface]
+        except KeyError:
+            pass
+        cache = self._caches[interface] = LRUCache(max_entries=self._cache_max_entries, ttl=self._cache_ttl)
+        tags = {'method': '%s.%s' % (interface.name, self.__name__)}
+        interface.metrics.add(metrics.Callable('rpc.cache.hits', lambda: cache.hits, tags))
+        interface.metrics.add(metrics.Callable('rpc.cache.misses', lambda: cache.misses, tags))
+        interface.metrics.add(metrics.Callable('rpc.cache.evictions', lambda: cache.evictions, tags))
+        interface.metrics.add(metrics.Callable('rpc.cache.size', lambda: len(cache), tags))
+        return cache
+
+    def get_batcher(self, interface):
+        try:
+            return self._batchers[interface]
+        except KeyError:
+            pass
+        batcher = self._batchers[interface] = _Batcher(lambda *args: self._func(*args), self._max_batch, self._max_wait)
+        tags = {'method': '%s.%s' % (interface.name, self.__name__)}
+        interface.metrics.add(metrics.Callable('rpc.batch.count', lambda: batcher.batch_count, tags))
+        interface.metrics.add(metrics.Callable('rpc.batch.calls', lambda: batcher.call_count, tags))
+        return batcher
+
+    def _call(self, interface, *args, **kwargs):
+        if not self._batch:
+            return self._func(interface, *args, **kwargs)
+        ret = self.get_batcher(interface).call(interface, kwargs)
+        if isinstance(ret, Exception):
+            # Batched methods fail single calls by returning an exception.
+            raise ret
+        return ret
+
     def rpc_call(self, interface, channel, *args, **kwargs):
+        if self._cache_ttl:
+            cache = self.get_cache(interface)
+            key = freeze(kwargs)
+            packed_body = cache.get(key)
+            if packed_body is not None:
+                channel.reply_packed(packed_body)
+                return
         try:
-            ret = self._func(interface, *args, **kwargs)
+            ret = self._call(interface, *args, **kwargs)
+            if isinstance(ret, collections.Iterator):
+                channel.stream(ret)
+                return
         except self._raises as ex:
             channel.error(type=ex.__class__.__name__, message=str(ex))
         else:
-            channel.reply(ret)
+            if self._cache_ttl:
+                packed_body = msgpack_serializer.dumps(ret)
+                cache.set(key, packed_body)
+                channel.reply_packed(packed_body)
+            else:
+                channel.reply(ret)
 
 
 def raw_rpc():
     return _RawRPCDecorator
 
 
-def rpc(raises=()):
-    return functools.partial(_RPCDecorator, raises=raises)
+def rpc(raises=(), cache=None, max_entries=1000, batch=False, max_batch=100, max_wait_ms=5):
+    """
+    Exposes a method via RPC. With `cache` set to a number of seconds, up to
+    `max_entries` replies are cached per distinct set of arguments.
+
+    With `batch`, concurrent calls are collected for up to `max_wait_ms`
+    milliseconds, or until there are `max_batch` of them, and passed to the
+    method as a single list of kwargs. The method returns a list of results
+    in the same order, an exception in the list fails the respective call.
+    """
+    return functools.partial(
+        _RPCDecorator, raises=raises, cache=cache, max_entries=max_entries,
+        batch=batch, max_batch=max_batch, max_wait_ms=max_wait_ms)
 
 
 def event_handler(cls, *args, **kwargs):
@@ -0,0 +1,133 @@
+import functools
+import logging
+import time
+
+from lymph.core.channels import RequestChannel
+from lymph.core.loadbalancing import ExcludingBalancer
+from lymph.exceptions import RpcError, Timeout
+from lymph.utils import SampleWindow
+
+
+logger = logging.getLogger(__name__)
+
+
+class HedgingPolicy(object):
+    """
+    Decides when a request is sent a second time. A request is hedged when no
+    reply has arrived after the `percentile` latency observed for its
+    subject. At most `budget` (a fraction of all requests) is hedged, and no
+    request is hedged before `min_samples` latencies have been recorded for
+    its subject.
+    """
+
+    def __init__(self, percentile=95, budget=0.05, min_samples=20, window=100):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.window = window
+        self.samples = {}
+        self.request_count = 0
+        self.hedge_count = 0
+        self.hedged_total = 0
+
+    @classmethod
+    def create(cls, hedging):
+        if not hedging:
+            return None
+        if isinstance(hedging, HedgingPolicy):
+            return hedging
+        if hedging is True:
+            return cls()
+        return cls(**hedging)
+
+    def add_sample(self, subject, took):
+        try:
+            samples = self.samples[subject]
+        except KeyError:
+            samples = self.samples[subject] = SampleWindow(self.window)
+        samples.add(took)
+
+    def get_delay(self, subject):
+        samples = self.samples.get(subject)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        values = sorted(samples.values)
+        index = min(len(values) - 1, int(len(values) * self.percentile / 100.))
+        return values[index]
+
+    def count_request(self):
+        self.request_count += 1
+        # Forget old traffic so that the budget applies to recent requests.
+        if self.request_count >= 1000:
+            self.request_count //= 2
+            self.hedge_count //= 2
+
+    def try_hedge(self):
+        if self.hedge_count + 1 > self.budget * self.request_count:
+            return False
+        self.hedge_count += 1
+        self.hedged_total += 1
+        return True
+
+
+class HedgedRequest(object):
+    """
+    Sends a request and, if the `policy` allows it, a second copy of it to
+    another instance once the first one is slow to reply. The first reply
+    wins, the channel of the other request is discarded.
+    """
+
+    def __init__(self, policy, container, address, subject, body, headers=None, version=None, balancer=None):
+        self.policy = policy
+        self.container = container
+        self.address = address
+        self.subject = subject
+        self.body = body
+        self.headers = headers or {}
+        self.version = version
+        self.balancer = balancer
+        self.start = time.monotonic()
+        policy.count_request()
+        self.channel = container.send_request(address, subject, body, headers=dict(self.headers), version=version, balancer=balancer)
+        self.channels = [self.channel]
+        connection = getattr(self.channel, 'connection', None)
+        self.endpoint = connection.endpoint if connection else None
+
+    def send_hedge(self):
+        service = self.container.lookup(self.address, version=self.version)
+        balancer = self.balancer or self.container.server.get_balancer(service)
+        if self.endpoint:
+            balancer = ExcludingBalancer(balancer, [self.endpoint])
+        channel = self.container.server.send_request(
+            service, self.subject, self.body,
+            headers=dict(self.headers),
+            balancer=balancer,
+            channel_factory=functools.partial(RequestChannel, result=self.channel.result),
+        )
+        self.channels.append(channel)
+        logger.debug('hedged request subject=%s', self.subject)
+
+    def get(self, timeout=1):
+        if not isinstance(self.channel, RequestChannel):
+            # e.g. a mocked channel in tests
+            return self.channel.get(timeout=timeout)
+        delay = self.policy.get_delay(self.subject)
+        result = self.channel.result
+        msg = None
+        try:
+            msg = result.wait(timeout if delay is None else min(delay, timeout))
+            remaining = timeout - (time.monotonic() - self.start)
+            if msg is None and delay is not None and remaining > 0:
+                if self.policy.try_hedge():
+                    try:
+                        self.send_hedge()
+                    except RpcError as e:
+                        logger.debug('cannot hedge request subject=%s: %r', self.subject, e)
+                msg = result.wait(remaining)
+            if msg is None:
+                raise Timeout(self.channel.request)
+        finally:
+            for channel in self.channels:
+                channel.close(timed_out=msg is None)
+        self.policy.add_sample(self.subject, time.monotonic() - self.start)
+        return self.channel.check_reply(msg)
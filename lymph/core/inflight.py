@@ -0,0 +1,142 @@
+import collections
+import heapq
+import time
+
+import six
+
+from lymph.utils.cache import LRUCache
+
+
+class InflightTable(object):
+    """
+    Holds the channels of sent requests by request id until their replies
+    have been consumed. Channels expire `grace` seconds after the deadline of
+    their request, or `max_age` seconds after they were added if the request
+    has no deadline. :meth:`expire` removes expired channels in bulk, so
+    that requests whose replies are never waited for don't leak.
+
+    The ids of expired and timed out requests are remembered for `max_age`
+    seconds (at most `remember` of them), replies to these requests are late.
+    """
+
+    def __init__(self, max_age=60, grace=1, interval=1, remember=10000):
+        self.max_age = max_age
+        self.grace = grace
+        self.interval = interval
+        # request id -> [expires_at, request id, channel, target], the same
+        # lists are kept in `heap`. Removed entries stay in the heap with
+        # their channel set to None until they are popped or compacted.
+        self.entries = {}
+        self.heap = []
+        self.depth = collections.Counter()
+        self.expired = LRUCache(max_entries=remember, ttl=max_age)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, request_id):
+        return request_id in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, request_id):
+        return self.entries[request_id][2]
+
+    def __setitem__(self, request_id, channel):
+        self.add(request_id, channel)
+
+    def __delitem__(self, request_id):
+        if self.remove(request_id) is None:
+            raise KeyError(request_id)
+
+    def get(self, request_id, default=None):
+        entry = self.entries.get(request_id)
+        if entry is None:
+            return default
+        return entry[2]
+
+    def pop(self, request_id, default=None):
+        channel = self.remove(request_id)
+        return default if channel is None else channel
+
+    def add(self, request_id, channel, deadline=None, target=None):
+        self.remove(request_id)
+        if deadline is None:
+            expires_at = time.time() + self.max_age
+        else:
+            expires_at = deadline + self.grace
+        entry = [expires_at, request_id, channel, target]
+        self.entries[request_id] = entry
+        heapq.heappush(self.heap, entry)
+        self.depth[target] += 1
+
+    def remove(self, request_id, timed_out=False):
+        """
+        Removes and returns the channel of `request_id`, or None if there is
+        none. If the request `timed_out`, later replies to it are late.
+        """
+        entry = self.entries.pop(request_id, None)
+        if entry is None:
+            return None
+        channel = entry[2]
+        self._release(entry)
+        if timed_out:
+            self.expired.set(request_id, entry[3])
+        return channel
+
+    def touch(self, request_id):
+        """
+        Postpones the expiry of `request_id` by `max_age` seconds, e.g. when
+        a streamed reply makes progress.
+        """
+        entry = self.entries.get(request_id)
+        if entry is None:
+            return
+        expires_at = time.time() + self.max_age
+        if expires_at <= entry[0]:
+            return
+        new_entry = [expires_at, request_id, entry[2], entry[3]]
+        entry[2] = None
+        self.entries[request_id] = new_entry
+        heapq.heappush(self.heap, new_entry)
+
+    def _release(self, entry):
+        entry[2] = None
+        target = entry[3]
+        self.depth[target] -= 1
+        if not self.depth[target]:
+            del self.depth[target]
+
+    def expire(self, now=None):
+        """
+        Removes all channels that have expired by `now` and returns a list
+        of their ``(request_id, channel, target)`` tuples.
+        """
+        if now is None:
+            now = time.time()
+        heap = self.heap
+        expired = []
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            expires_at, request_id, channel, target = entry
+            if channel is None:
+                continue
+            del self.entries[request_id]
+            self._release(entry)
+            self.expired.set(request_id, target)
+            expired.append((request_id, channel, target))
+        if len(heap) > 2 * len(self.entries) + 1000:
+            self.heap = [entry for entry in heap if entry[2] is not None]
+            heapq.heapify(self.heap)
+        return expired
+
+    def get_expired_target(self, request_id):
+        """
+        Returns the target of `request_id` if it has recently expired or
+        timed out, None otherwise.
+        """
+        return self.expired.get(request_id)
+
+    def iter_depth(self):
+        return six.iteritems(self.depth)
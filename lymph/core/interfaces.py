@@ -1,18 +1,30 @@
+import contextlib
+import copy
+import functools
 import textwrap
 import logging
+import time
+import weakref
 
 import six
 import semantic_version
 
+from lymph.core.channels import StreamChannel
 from lymph.core.components import Component, Componentized, ComponentizedBase
 from lymph.core.decorators import rpc, RPCBase
 from lymph.core.events import TaskHandler, EventHandler
+from lymph.core.hedging import HedgingPolicy, HedgedRequest
+from lymph.core.loadbalancing import get_balancer
 from lymph.core.monitoring import metrics
+from lymph.core.rpc import PRIORITY_CRITICAL, PRIORITY_BATCH
+from lymph.core import trace
 from lymph.exceptions import RemoteError, EventHandlerTimeout, Timeout, Nack
-from lymph.utils import hash_id
+from lymph.utils import hash_id, Undefined
+from lymph.utils.cache import LRUCache, freeze
 from lymph.core.versioning import serialize_version
 
 import gevent
+import gevent.event
 from gevent.event import AsyncResult
 
 
@@ -20,6 +32,20 @@ logger = logging.getLogger(__name__)
 REQUEST_TIMEOUT = 3  # seconds.
 
 
+def get_request_deadline(timeout):
+    """
+    Returns the absolute deadline of a request with the given `timeout`
+    and the number of seconds left until then. Requests sent while handling
+    another request do not outlive its deadline.
+    """
+    now = time.time()
+    deadline = now + timeout
+    inherited = trace.get_deadline()
+    if inherited is not None and inherited < deadline:
+        deadline = inherited
+    return deadline, max(0, deadline - now)
+
+
 class AsyncResultWrapper(object):
     def __init__(self, container, handler, async_result):
         self.container = container
@@ -71,14 +97,122 @@ class ProxyMethod(object):
     def __call__(self, **kwargs):
         return self.proxy._call(self.subject, **kwargs)
 
+    def stream(self, **kwargs):
+        return self.proxy._stream(self.subject, **kwargs)
+
     def defer(self, *args, **kwargs):
         result = DeferredReply(self.subject)
         self.proxy.spawn(self, *args, **kwargs).link(result)
         return result
 
 
+class BatchedCall(object):
+    def __init__(self, batch, subject, body):
+        self.batch = batch
+        self.subject = subject
+        self.body = body
+        self.channel = None
+        self.error = None
+
+    def get(self, timeout=None):
+        if self.channel is None and self.error is None:
+            self.batch.send()
+        if self.error is not None:
+            raise self.error
+        return self.batch.proxy._get_reply(self.channel, timeout=timeout)
+
+
+class BatchMethod(object):
+    def __init__(self, batch, subject):
+        self.batch = batch
+        self.subject = subject
+
+    def __call__(self, **kwargs):
+        return self.batch.add(self.subject, kwargs)
+
+
+class RequestBatch(object):
+    """
+    Collects calls made through `proxy` and sends them to a single instance
+    as one multipart message. Calls return a :class:`BatchedCall` whose
+    ``get()`` blocks for the reply; pending calls are sent when the batch is
+    left as a context manager or when a result is requested.
+
+    Example::
+
+        with RequestBatch(echo) as batch:
+            calls = [batch.upper(text=text) for text in texts]
+        results = [call.get() for call in calls]
+    """
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.pending = []
+
+    def __getattr__(self, name):
+        return BatchMethod(self, self.proxy._get_subject(name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def add(self, subject, body):
+        call = BatchedCall(self, subject, body)
+        self.pending.append(call)
+        return call
+
+    def send(self):
+        self.flush()
+
+    def flush(self):
+        calls, self.pending = self.pending, []
+        if not calls:
+            return
+        try:
+            channels = self.proxy._container.send_requests(
+                self.proxy._address,
+                [(call.subject, call.body) for call in calls],
+                headers=self.proxy._make_headers(deadline=get_request_deadline(self.proxy._timeout)[0]),
+                version=self.proxy._version,
+                balancer=self.proxy._balancer,
+            )
+        except Exception as e:
+            for call in calls:
+                call.error = e
+            return
+        for call, channel in zip(calls, channels):
+            call.channel = channel
+
+
+class WindowedRequestBatch(RequestBatch):
+    """
+    A batch that is sent by its proxy once the batch window closes. Calls
+    that request their result early wait for the window to close.
+    """
+
+    def __init__(self, proxy):
+        super(WindowedRequestBatch, self).__init__(proxy)
+        self.sent = gevent.event.Event()
+
+    def send(self):
+        self.sent.wait()
+
+    def flush(self):
+        try:
+            super(WindowedRequestBatch, self).flush()
+        finally:
+            self.sent.set()
+
+
+def _invalidate_proxy_caches(proxies, event):
+    for proxy in list(proxies):
+        proxy._invalidate_cache(event)
+
+
 class Proxy(Component):
-    def __init__(self, container, address, timeout=REQUEST_TIMEOUT, namespace='', version=None, error_map=None):
+    def __init__(self, container, address, timeout=REQUEST_TIMEOUT, namespace='', version=None, error_map=None, batch_window=None, balancer=None, hedging=None, stream_credit=16, cache=None, single_flight=False, prewarm=True, priority=None):
         super(Proxy, self).__init__()
         self._container = container
         self._address = address
@@ -89,16 +223,172 @@ class Proxy(Component):
             version = semantic_version.Version.coerce(version)
         self._version = version
         self._error_map = error_map or {}
+        self._batch_window = batch_window
+        self._window_batch = None
+        self._balancer = get_balancer(balancer) if balancer else None
+        self._hedging = HedgingPolicy.create(hedging)
+        self._stream_credit = stream_credit
+        self._cache = None
+        self._cache_invalidate_on = ()
+        self._cache_generation = 0
+        self._in_flight = {} if single_flight else None
+        self._prewarm = prewarm
+        if priority not in (None, PRIORITY_CRITICAL, PRIORITY_BATCH):
+            raise ValueError('unknown request priority: %r' % priority)
+        self._priority = priority
+        if cache:
+            cache = {} if cache is True else dict(cache)
+            self._cache_invalidate_on = tuple(cache.pop('invalidate_on', ()))
+            self._cache = LRUCache(**cache)
 
     def on_start(self):
         super(Proxy, self).on_start()
         self.timeout_counts = self.metrics.add(metrics.Counter('rpc.timeout_count', {'address': self._address}))
         self.exception_counts = self.metrics.add(metrics.TaggedCounter('rpc.exception_count', {'address': self._address}))
+        if self._prewarm:
+            self.spawn(self._container.prewarm, self._address, version=self._version)
+        if self._hedging:
+            self.metrics.add(metrics.Callable('rpc.hedge_count', lambda: self._hedging.hedged_total, {'address': self._address}))
+        if self._in_flight is not None:
+            self.coalesced_counts = self.metrics.add(metrics.Counter('rpc.coalesced_count', {'address': self._address}))
+        if self._cache is not None:
+            tags = {'address': self._address}
+            self.metrics.add(metrics.Callable('rpc.proxy_cache.hits', lambda: self._cache.hits, tags))
+            self.metrics.add(metrics.Callable('rpc.proxy_cache.misses', lambda: self._cache.misses, tags))
+            self.metrics.add(metrics.Callable('rpc.proxy_cache.evictions', lambda: self._cache.evictions, tags))
+            if self._cache_invalidate_on:
+                self._subscribe_invalidation()
+
+    def _subscribe_invalidation(self):
+        # Proxies of an interface with the same namespace and event types
+        # share one handler, proxies created per call don't subscribe again.
+        interface = self._parent_component
+        key = (self._namespace, self._cache_invalidate_on)
+        try:
+            proxies = interface._cache_invalidation_proxies[key]
+        except KeyError:
+            proxies = interface._cache_invalidation_proxies[key] = weakref.WeakSet()
+            # Every instance has to see the events, so they are broadcast.
+            handler = EventHandler(
+                interface,
+                lambda interface, event: _invalidate_proxy_caches(proxies, event),
+                self._cache_invalidate_on,
+                queue_name='%s-proxy-cache' % self._namespace,
+                broadcast=True,
+            )
+            self._container.subscribe(handler)
+        proxies.add(self)
+
+    def _invalidate_cache(self, event):
+        logger.debug('invalidating proxy cache address=%s event=%s', self._address, event)
+        self._cache.clear()
+        self._cache_generation += 1
 
     def _call(self, __name, **kwargs):
-        channel = self._container.send_request(self._address, __name, kwargs, version=self._version)
+        if self._cache is None and self._in_flight is None:
+            return self._send_call(__name, **kwargs)
+        key = (__name, freeze(kwargs))
+        if self._cache is None:
+            return self._coalesce_call(key, __name, kwargs)
+        result = self._cache.get(key, Undefined)
+        if result is Undefined:
+            generation = self._cache_generation
+            if self._in_flight is None:
+                result = self._send_call(__name, **kwargs)
+            else:
+                result = self._coalesce_call(key, __name, kwargs)
+            if generation == self._cache_generation:
+                # not invalidated while the request was in flight
+                self._cache.set(key, result)
+        # Callers must not be able to modify the cached result.
+        return copy.deepcopy(result)
+
+    def _coalesce_call(self, key, name, kwargs):
+        """
+        Sends the call unless an identical call is in flight already. In that
+        case the reply (or error) of the call in flight is shared.
+        """
         try:
-            return channel.get(timeout=self._timeout).body
+            in_flight = self._in_flight[key]
+        except KeyError:
+            pass
+        else:
+            self.coalesced_counts += 1
+            # Followers don't wait longer than their own deadline allows.
+            in_flight.wait(get_request_deadline(self._timeout)[1])
+            if not in_flight.ready():
+                self.timeout_counts += 1
+                raise Timeout(None, 'timed out waiting for in-flight call to %s' % name)
+            return copy.deepcopy(in_flight.get())
+        in_flight = self._in_flight[key] = AsyncResult()
+        try:
+            result = self._send_call(name, **kwargs)
+        except Exception as e:
+            in_flight.set_exception(e)
+            raise
+        else:
+            in_flight.set(result)
+            return result
+        finally:
+            del self._in_flight[key]
+            if not in_flight.ready():
+                # The call was cancelled, e.g. by gevent.Timeout or
+                # GreenletExit, followers must not wait for it.
+                in_flight.set_exception(Timeout(None, 'in-flight call to %s was cancelled' % name))
+
+    def _send_call(self, __name, **kwargs):
+        if self._batch_window:
+            return self._get_window_batch().add(__name, kwargs).get()
+        deadline, timeout = get_request_deadline(self._timeout)
+        if not timeout:
+            self.timeout_counts += 1
+            raise Timeout(None, 'deadline exceeded before sending %s' % __name)
+        headers = self._make_headers(deadline=deadline)
+        if self._hedging:
+            request = HedgedRequest(self._hedging, self._container, self._address, __name, kwargs, headers=headers, version=self._version, balancer=self._balancer)
+            return self._get_reply(request, timeout=timeout)
+        channel = self._container.send_request(self._address, __name, kwargs, headers=headers, version=self._version, balancer=self._balancer)
+        return self._get_reply(channel, timeout=timeout)
+
+    def _stream(self, __name, **kwargs):
+        channel = self._container.send_request(
+            self._address, __name, kwargs,
+            headers=self._make_headers(stream=self._stream_credit),
+            version=self._version,
+            balancer=self._balancer,
+            channel_factory=functools.partial(StreamChannel, credit=self._stream_credit),
+        )
+        return self._iter_stream(channel)
+
+    def _iter_stream(self, channel):
+        with self._handle_errors():
+            for body in channel.iter(timeout=self._timeout):
+                yield body
+
+    def _get_window_batch(self):
+        if self._window_batch is None:
+            self._window_batch = WindowedRequestBatch(self)
+            self.spawn(self._flush_window_batch, self._window_batch)
+        return self._window_batch
+
+    def _flush_window_batch(self, batch):
+        try:
+            gevent.sleep(self._batch_window)
+        finally:
+            if self._window_batch is batch:
+                self._window_batch = None
+            batch.flush()
+
+    def _get_reply(self, channel, timeout=None):
+        if timeout is None:
+            timeout = get_request_deadline(self._timeout)[1]
+        with self._handle_errors():
+            return channel.get(timeout=timeout).body
+
+    @contextlib.contextmanager
+    def _handle_errors(self):
+        try:
+            yield
         except RemoteError as e:
             error_type = str(e.__class__)
             self.exception_counts.incr(name=e.__class__.__name__)
@@ -112,11 +402,19 @@ class Proxy(Component):
             self.exception_counts.incr(name='nack')
             raise
 
+    def _make_headers(self, **headers):
+        if self._priority:
+            headers['priority'] = self._priority
+        return headers
+
+    def _get_subject(self, name):
+        return '%s.%s' % (self._namespace, name)
+
     def __getattr__(self, name):
         try:
             return self._method_cache[name]
         except KeyError:
-            method = ProxyMethod(self, '%s.%s' % (self._namespace, name))
+            method = ProxyMethod(self, self._get_subject(name))
             self._method_cache[name] = method
             return method
 
@@ -130,6 +428,9 @@ class Interface(Componentized):
         self.base_name = self.name
         self.builtin = builtin
         self.version = version
+        self.serialized_version = serialize_version(version)
+        self._hedging_policies = {}
+        self._cache_invalidation_proxies = {}
         if container.worker and not builtin:
             self.name = '%s.worker' % self.name
 
@@ -154,13 +455,31 @@ class Interface(Componentized):
 
     def handle_request(self, func_name, channel):
         method = self.methods[func_name]
-        channel.add_header('version', serialize_version(self.version))
+        channel.add_header('version', self.serialized_version)
         method.rpc_call(self, channel, **channel.request.body)
 
-    def request(self, address, subject, body, timeout=REQUEST_TIMEOUT, version=None):
-        channel = self.container.send_request(address, subject, body, version=version)
+    def request(self, address, subject, body, timeout=REQUEST_TIMEOUT, version=None, hedging=None):
+        deadline, timeout = get_request_deadline(timeout)
+        headers = {'deadline': deadline}
+        hedging = self._get_hedging_policy(hedging)
+        if hedging:
+            channel = HedgedRequest(hedging, self.container, address, subject, body, headers=headers, version=version)
+        else:
+            channel = self.container.send_request(address, subject, body, headers=headers, version=version)
         return channel.get(timeout=timeout)
 
+    def _get_hedging_policy(self, hedging):
+        # Policies learn latencies from the requests they hedge, so ``True``
+        # and option dicts map to one policy per interface.
+        if not hedging or isinstance(hedging, HedgingPolicy):
+            return hedging
+        key = True if hedging is True else tuple(sorted(hedging.items()))
+        try:
+            return self._hedging_policies[key]
+        except KeyError:
+            policy = self._hedging_policies[key] = HedgingPolicy.create(hedging)
+            return policy
+
     def emit(self, event_type, payload, delay=0):
         self.container.emit_event(event_type, payload, delay=delay)
 
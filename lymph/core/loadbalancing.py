@@ -0,0 +1,123 @@
+import abc
+import itertools
+import random
+
+import six
+
+from lymph.exceptions import ConfigurationError
+from lymph.utils import import_object
+
+
+@six.add_metaclass(abc.ABCMeta)
+class LoadBalancer(object):
+    """
+    Picks the instance a request is sent to. `candidates` is a non-empty
+    list of ``(instance, connection)`` pairs, where `connection` is None
+    if there is no connection to the instance yet.
+    """
+
+    @abc.abstractmethod
+    def pick(self, candidates):
+        raise NotImplementedError()
+
+
+def _pending_requests(connection):
+    return connection.pending_requests if connection else 0
+
+
+class RandomBalancer(LoadBalancer):
+    def pick(self, candidates):
+        return random.choice(candidates)[0]
+
+
+class RoundRobinBalancer(LoadBalancer):
+    def __init__(self):
+        self.counter = itertools.count()
+
+    def pick(self, candidates):
+        return candidates[next(self.counter) % len(candidates)][0]
+
+
+class LeastOutstandingBalancer(LoadBalancer):
+    """
+    Picks the instance with the fewest in-flight requests. Ties are broken
+    randomly.
+    """
+
+    def pick(self, candidates):
+        candidates = list(candidates)
+        random.shuffle(candidates)
+        return min(candidates, key=lambda c: _pending_requests(c[1]))[0]
+
+
+class PowerOfTwoBalancer(LoadBalancer):
+    """
+    Picks two random instances and sends the request to the one with fewer
+    in-flight requests.
+    """
+
+    def pick(self, candidates):
+        if len(candidates) == 1:
+            return candidates[0][0]
+        a, b = random.sample(candidates, 2)
+        if _pending_requests(b[1]) < _pending_requests(a[1]):
+            return b[0]
+        return a[0]
+
+
+class EWMABalancer(LoadBalancer):
+    """
+    Picks the instance with the lowest moving average round-trip time,
+    weighted by the number of in-flight requests. Instances without latency
+    samples are preferred so that they get measured.
+    """
+
+    def score(self, connection):
+        if not connection or connection.latency.value is None:
+            return 0
+        return connection.latency.value * (connection.pending_requests + 1)
+
+    def pick(self, candidates):
+        candidates = list(candidates)
+        random.shuffle(candidates)
+        return min(candidates, key=lambda c: self.score(c[1]))[0]
+
+
+class ExcludingBalancer(LoadBalancer):
+    """
+    Delegates to `balancer`, but avoids instances with one of the given
+    endpoints as long as there are other candidates.
+    """
+
+    def __init__(self, balancer, endpoints):
+        self.balancer = balancer
+        self.endpoints = set(endpoints)
+
+    def pick(self, candidates):
+        others = [c for c in candidates if c[0].endpoint not in self.endpoints]
+        return self.balancer.pick(others or candidates)
+
+
+BALANCERS = {
+    'random': RandomBalancer,
+    'round_robin': RoundRobinBalancer,
+    'least_outstanding': LeastOutstandingBalancer,
+    'power_of_two': PowerOfTwoBalancer,
+    'ewma': EWMABalancer,
+}
+
+
+def get_balancer(balancer):
+    """
+    Returns a new load balancer for `balancer`, which may be a balancer
+    instance, one of the names in `BALANCERS` or an import path.
+    """
+    if isinstance(balancer, LoadBalancer):
+        return balancer
+    try:
+        cls = BALANCERS[balancer]
+    except KeyError:
+        if ':' not in balancer:
+            raise ConfigurationError('unknown load balancer: %r' % balancer)
+        cls = import_object(balancer)
+    return cls()
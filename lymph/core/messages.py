@@ -1,8 +1,40 @@
+from lymph.core.compression import get_codec
 from lymph.serializers import msgpack_serializer
-from lymph.utils import make_id
+from lymph.utils import make_sequential_id
+
+
+# Request subjects and message sources are taken from small sets of method
+# names and endpoints, their encoded and decoded forms are cached. The
+# caches are cleared once they reach this size, e.g. if peers send many
+# distinct subjects.
+NAME_CACHE_SIZE = 1024
+_encoded_names = {}
+_decoded_names = {}
+
+
+def encode_name(name):
+    try:
+        return _encoded_names[name]
+    except KeyError:
+        if len(_encoded_names) >= NAME_CACHE_SIZE:
+            _encoded_names.clear()
+        encoded = _encoded_names[name] = name.encode('utf-8')
+        return encoded
+
+
+def decode_name(name):
+    try:
+        return _decoded_names[name]
+    except KeyError:
+        if len(_decoded_names) >= NAME_CACHE_SIZE:
+            _decoded_names.clear()
+        decoded = _decoded_names[name] = name.decode('utf-8')
+        return decoded
 
 
 class Message(object):
+    __slots__ = ('id', 'type', 'subject', 'source', '_headers', '_packed_headers', '_body', '_packed_body')
+
     ACK = b'ACK'
     REP = b'REP'
     REQ = b'REQ'
@@ -10,7 +42,7 @@ class Message(object):
     ERROR = b'ERROR'
 
     def __init__(self, msg_type, subject, packed_body=None, headers=None, packed_headers=None, msg_id=None, source=None, lazy=False, **kwargs):
-        self.id = msg_id if msg_id else make_id()
+        self.id = msg_id if msg_id else make_sequential_id()
         self.type = msg_type
         self.subject = subject
         self.source = source
@@ -43,7 +75,7 @@ class Message(object):
         return self.type in (self.REP, self.ACK, self.NACK, self.ERROR)
 
     def is_idle_chatter(self):
-        return not self.is_request() or self.subject == '_ping'
+        return not self.is_request() or self.subject in ('_ping', 'lymph.ping')
 
     @property
     def version(self):
@@ -52,7 +84,16 @@ class Message(object):
     @property
     def body(self):
         if not hasattr(self, '_body'):
-            self._body = msgpack_serializer.loads(self._packed_body)
+            packed_body = self._packed_body
+            encoding = self.headers.get('encoding')
+            if encoding:
+                packed_body = get_codec(encoding).decompress(packed_body)
+                del self.headers['encoding']
+                self._packed_headers = None
+            self._body = msgpack_serializer.loads(packed_body)
+            # The packed body is only kept until it has been decoded, it
+            # will be packed again if it's needed later on.
+            self._packed_body = None
         return self._body
 
     @property
@@ -61,6 +102,15 @@ class Message(object):
             self._packed_body = msgpack_serializer.dumps(self._body)
         return self._packed_body
 
+    def set_packed_body(self, packed_body, encoding=None):
+        """
+        Replaces the packed body, e.g. with a compressed version of it.
+        """
+        self._packed_body = packed_body
+        if encoding:
+            self._headers = dict(self.headers, encoding=encoding)
+            self._packed_headers = None
+
     @property
     def headers(self):
         if self._headers is None:
@@ -74,10 +124,15 @@ class Message(object):
         return self._packed_headers
 
     def pack_frames(self):
+        if self.type == self.REQ:
+            subject = encode_name(self.subject)
+        else:
+            # replies are addressed to request ids, they are never repeated
+            subject = self.subject.encode('utf-8')
         return [
             self.id.encode('utf-8'),
             self.type,
-            self.subject.encode('utf-8'),
+            subject,
             self.packed_headers,
             self.packed_body,
         ]
@@ -91,25 +146,53 @@ class Message(object):
 
         try:
             msg_id = msg_id.decode('utf-8')
-            subject = subject.decode('utf-8')
-            source = source.decode('utf-8')
+            if msg_type == Message.REQ:
+                subject = decode_name(subject)
+            else:
+                subject = subject.decode('utf-8')
+            source = decode_name(source)
         except UnicodeDecodeError:
             raise ValueError('message id, subject, and source must be utf-8 encoded.')
 
-        return Message(
+        msg = Message(
             msg_type=msg_type,
             subject=subject,
             msg_id=msg_id,
             source=source,
             packed_body=body,
             packed_headers=headers,
+            lazy=True,
         )
+        # Headers carry the trace id and version that are required to route
+        # the message. The body is decoded on first access, i.e. in the
+        # greenlet that handles the message rather than in the receive loop.
+        msg.headers
+        return msg
+
+    @classmethod
+    def pack_batch(cls, messages):
+        frames = []
+        for msg in messages:
+            frames.extend(msg.pack_frames())
+        return frames
+
+    @classmethod
+    def unpack_batch(cls, frames):
+        """
+        Unpacks a multipart message that carries one or more messages from
+        the same source, i.e. ``[source, (id, type, subject, headers, body)+]``.
+        """
+        if len(frames) < 6 or (len(frames) - 1) % 5:
+            raise ValueError('bad message frame count: got %s, expected 1 + a multiple of 5' % len(frames))
+        source = frames[0]
+        return [cls.unpack_frames([source] + frames[i:i + 5]) for i in range(1, len(frames), 5)]
 
     def __str__(self):
-        return '{type=%s subject=%s id=%s..}' % (
+        # Ids share a per process prefix, only the full id tells them apart.
+        return '{type=%s subject=%s id=%s}' % (
             self.type,
             self.subject,
-            self.id[:10],
+            self.id,
         )
 
     def __repr__(self):
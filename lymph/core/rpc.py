@@ -1,14 +1,25 @@
+import collections
+import copy
 import errno
+import functools
 import logging
+import os
 import random
+import socket
+import tempfile
 import time
 
 import gevent
+import six
 import zmq.green as zmq
+from zmq.utils.monitor import recv_monitor_message
 
-from lymph.core.channels import RequestChannel, ReplyChannel
+from lymph.core.channels import RequestChannel, ReplyChannel, CallbackChannel, STREAM_CONTROL
 from lymph.core.components import Component
-from lymph.core.connection import Connection
+from lymph.core.compression import Compression
+from lymph.core.connection import Connection, HeartbeatScheduler
+from lymph.core.inflight import InflightTable
+from lymph.core.loadbalancing import get_balancer
 from lymph.core.messages import Message
 from lymph.core.monitoring import metrics
 from lymph.core.services import InstanceSet
@@ -16,29 +27,75 @@ from lymph.core.versioning import serialize_version
 from lymph.core import services
 from lymph.core import trace
 from lymph.exceptions import NotConnected
+from lymph.utils import MovingAverage, hash_id, make_sequential_id
+from lymph.utils.gpool import RejectExcecutionError
 
 
 logger = logging.getLogger(__name__)
 
+# The socket event that signals that messages can be routed to a peer.
+CONNECTED_EVENT = getattr(zmq, 'EVENT_HANDSHAKE_SUCCEEDED', zmq.EVENT_CONNECTED)
+
+# Values of the `priority` request header. Critical requests skip admission
+# control, batch requests are shed first. Heartbeat pings run in a pool of
+# their own, `control` is only honored for them.
+PRIORITY_CONTROL = 'control'
+PRIORITY_CRITICAL = 'critical'
+PRIORITY_NORMAL = 'normal'
+PRIORITY_BATCH = 'batch'
+
+# The subject of minimal heartbeat pings. They carry neither headers nor a
+# body and are answered by the receive loop.
+PING_SUBJECT = '_ping'
+
 
 class ZmqRPCServer(Component):
-    def __init__(self, ip='127.0.0.1', port=None, pool=None, connection_config=None):
+    def __init__(self, ip='127.0.0.1', port=None, pool=None, connection_config=None, zero_copy=False, load_balancing=None, request_pool=None, compression=None, local_dispatch=None, ipc=None, inflight=None, batch_limit=0.8, max_connections=None, critical_limit=None):
         super(ZmqRPCServer, self).__init__(pool=pool)
+        if local_dispatch is True:
+            local_dispatch = {}
+        self.local_dispatch = dict(local_dispatch) if isinstance(local_dispatch, dict) else None
+        self.compression = Compression.create(compression)
+        self.request_pool = request_pool
+        self.control_pool = trace.Group()
+        # Critical requests skip admission control, at most `critical_limit`
+        # of them run at a time.
+        self.critical_pool = trace.Group(size=critical_limit) if critical_limit else None
+        self.batch_limit = batch_limit
+        self.queue_time = MovingAverage()
         self.ip = ip
         self.port = port
+        self.ipc = ipc
+        self.ipc_endpoint = None
+        self.ipc_endpoints = {}
+        self.addresses = {}
+        self.fqdn = socket.getfqdn() if ipc else None
+        self.zero_copy = zero_copy
+        self.load_balancing = dict(load_balancing or {})
+        self.load_balancing.setdefault('default', 'random')
+        self.balancers = {}
 
         self.zctx = zmq.Context.instance()
         self.endpoint = None
         self.bound = False
         self.recv_loop_greenlet = None
-        self.channels = {}
-        self.connections = {}
+        self.monitor_loop_greenlet = None
+        self.expiry_loop_greenlet = None
+        self.channels = InflightTable(**(inflight or {}))
+        self.streams = {}
+        # Ordered from the least to the most recently used connection.
+        self.connections = collections.OrderedDict()
+        self.max_connections = max_connections
+        # Endpoints of instances of prewarmed services, they stay connected.
+        self.prewarmed_endpoints = set()
         self.running = False
         self.request_handler = lambda channel: None
         self.connection_config = connection_config or {}
+        self.heartbeats = HeartbeatScheduler(self)
 
         self.recv_sock = None
         self.send_sock = None
+        self.monitor_sock = None
 
     @classmethod
     def from_config(cls, config, **kwargs):
@@ -46,17 +103,32 @@ class ZmqRPCServer(Component):
             pool = config.create_instance('pool', default_class='lymph.core.trace:Group')
         else:
             pool = None
+        if 'request_pool' in config:
+            request_pool = config.create_instance('request_pool', default_class='lymph.core.trace:AdaptiveGroup')
+        else:
+            request_pool = None
         return cls(
             ip=config.get('ip', kwargs.get('ip') or '127.0.0.1'),
             port=config.get('port', kwargs.get('port')),
             pool=pool,
             connection_config=config.get_raw('connection', {}),
+            zero_copy=config.get('zero_copy', False),
+            load_balancing=config.get_raw('load_balancing', {}),
+            request_pool=request_pool,
+            compression=config.get_raw('compression', None),
+            local_dispatch=config.get_raw('local_dispatch', None),
+            ipc=config.get('ipc', None),
+            inflight=config.get_raw('inflight', None),
+            batch_limit=config.get('batch_limit', 0.8),
+            max_connections=config.get('max_connections', None),
+            critical_limit=config.get('critical_limit', None),
         )
 
     def _bind(self, max_retries=2, retry_delay=0):
         assert not self.bound, 'already bound (endpoint=%s)' % self.endpoint
         self.send_sock = self.zctx.socket(zmq.ROUTER)
         self.recv_sock = self.zctx.socket(zmq.ROUTER)
+        self.monitor_sock = self.send_sock.get_monitor_socket(CONNECTED_EVENT | zmq.EVENT_DISCONNECTED)
         port = self.port
         retries = 0
         while True:
@@ -80,14 +152,70 @@ class ZmqRPCServer(Component):
                 self.port = port
                 self.bound = True
                 break
+        if self.ipc:
+            self._bind_ipc()
+
+    def _bind_ipc(self):
+        directory = self.ipc if isinstance(self.ipc, six.string_types) else tempfile.gettempdir()
+        self.ipc_endpoint = 'ipc://%s' % os.path.join(directory, 'lymph-%s.sock' % hash_id(self.endpoint))
+        self.recv_sock.bind(self.ipc_endpoint)
 
     def connect(self, endpoint):
-        if endpoint not in self.connections:
-            logger.debug("connecting to %s", endpoint)
-            self.connections[endpoint] = Connection(self, endpoint, **self.connection_config)
-            self.send_sock.connect(endpoint)
-            gevent.sleep(0.02)
-        return self.connections[endpoint]
+        try:
+            connection = self.connections[endpoint]
+        except KeyError:
+            connection = self.connections[endpoint] = self._create_connection(endpoint)
+            if self.max_connections and len(self.connections) > self.max_connections:
+                self._evict_connections()
+        else:
+            if self.max_connections:
+                # OrderedDict.move_to_end() doesn't exist on Python 2.
+                self.connections[endpoint] = self.connections.pop(endpoint)
+        return connection
+
+    def _create_connection(self, endpoint):
+        address = self.ipc_endpoints.get(endpoint, endpoint)
+        logger.debug("connecting to %s (address=%s)", endpoint, address)
+        connection = Connection(self, endpoint, address=address, **self.connection_config)
+        self.addresses[address] = endpoint
+        self.send_sock.connect(address)
+        return connection
+
+    def _evict_connections(self):
+        while len(self.connections) > self.max_connections:
+            endpoint = next(iter(self.connections))
+            logger.info('too many connections, disconnecting from %s', endpoint)
+            self.reap_connection(self.connections[endpoint], 'evicted')
+
+    def reap_connection(self, connection, reason):
+        """
+        Closes `connection` and its socket connection. It is created again
+        when a message is sent to or received from its endpoint.
+        """
+        self.reaped_counts.incr(reason=reason)
+        self.disconnect(connection.endpoint, socket=True)
+
+    def add_ipc_endpoint(self, endpoint, ipc_endpoint):
+        # Connections that are already established keep their transport.
+        if self.ipc_endpoint and ipc_endpoint:
+            self.ipc_endpoints.setdefault(endpoint, ipc_endpoint)
+
+    def _add_instance_ipc_endpoint(self, instance):
+        if self.fqdn and instance.info.get('fqdn') == self.fqdn:
+            self.add_ipc_endpoint(instance.endpoint, instance.info.get('ipc_endpoint'))
+
+    def prewarm(self, service):
+        """
+        Connects to all instances of `service`, and to every instance that
+        is added later on, so that requests don't wait for connections to be
+        established.
+        """
+        service.observe(services.ADDED, self._on_service_instance_added)
+        service.observe(services.REMOVED, self._on_service_instance_unavailable)
+        for instance in service:
+            self._add_instance_ipc_endpoint(instance)
+            self.prewarmed_endpoints.add(instance.endpoint)
+            self.connect(instance.endpoint)
 
     def disconnect(self, endpoint, socket=False):
         try:
@@ -95,46 +223,149 @@ class ZmqRPCServer(Component):
         except KeyError:
             return
         del self.connections[endpoint]
+        self.addresses.pop(connection.address, None)
         connection.close()
         logger.debug("disconnecting from %s", endpoint)
-        if socket:
-            self.send_sock.disconnect(endpoint)
+        if socket and self.send_sock is not None:
+            try:
+                self.send_sock.disconnect(connection.address)
+            except zmq.ZMQError as e:
+                logger.debug('cannot disconnect from %s: %s', connection.address, e)
 
     def on_start(self):
         super(ZmqRPCServer, self).on_start()
         self.metrics.add(metrics.Callable('rpc.connection_count', lambda: len(self.connections)))
+        self.reaped_counts = self.metrics.add(metrics.TaggedCounter('rpc.connections.reaped'))
         self.request_counts = self.metrics.add(metrics.TaggedCounter('rpc'))
+        self.rejected_counts = self.metrics.add(metrics.TaggedCounter('rpc.rejected'))
+        self.expired_counts = self.metrics.add(metrics.TaggedCounter('rpc.expired'))
+        self.local_counts = self.metrics.add(metrics.TaggedCounter('rpc.local'))
+        self.orphaned_counts = self.metrics.add(metrics.TaggedCounter('rpc.orphaned'))
+        self.late_reply_counts = self.metrics.add(metrics.TaggedCounter('rpc.late_replies'))
+        self.metrics.add(metrics.Generator(self._iter_inflight_metrics))
+        self.metrics.add(metrics.Callable('rpc.queue_time', lambda: self.queue_time.value or 0))
+        if hasattr(self.request_pool, 'limit'):
+            self.metrics.add(metrics.Callable('rpc.concurrency_limit', lambda: int(self.request_pool.limit)))
+            self.metrics.add(metrics.Callable('rpc.in_flight', lambda: len(self.request_pool)))
+        if self.compression:
+            compression = self.compression
+            self.metrics.add(metrics.Callable('rpc.compression.count', lambda: compression.count))
+            self.metrics.add(metrics.Callable('rpc.compression.ratio', lambda: compression.ratio))
+            self.metrics.add(metrics.Callable('rpc.compression.time', lambda: compression.time))
         self._bind()
         self.running = True
         self.recv_loop_greenlet = self.spawn(self._recv_loop)
+        self.monitor_loop_greenlet = self.spawn(self._monitor_loop)
+        self.expiry_loop_greenlet = self.spawn(self._expiry_loop)
+        self.heartbeats.start()
 
     def on_stop(self, **kwargs):
         self.running = False
+        self.heartbeats.stop()
         for connection in list(self.connections.values()):
             connection.close()
         if self.recv_loop_greenlet:
             self.recv_loop_greenlet.kill()
+        if self.monitor_loop_greenlet:
+            self.monitor_loop_greenlet.kill()
+        if self.expiry_loop_greenlet:
+            self.expiry_loop_greenlet.kill()
+        self.control_pool.kill(block=False)
+        if self.critical_pool is not None:
+            self.critical_pool.kill(block=False)
         self._close_sockets()
 
     def _close_sockets(self):
         if self.recv_sock:
             self.recv_sock.close()
+        if self.ipc_endpoint:
+            try:
+                os.remove(self.ipc_endpoint[len('ipc://'):])
+            except OSError:
+                pass
+        if self.monitor_sock:
+            self.send_sock.disable_monitor()
+            self.monitor_sock.close()
         if self.send_sock:
             self.send_sock.close()
 
     def _on_service_instance_unavailable(self, instance, action=None):
+        self.prewarmed_endpoints.discard(instance.endpoint)
         self.disconnect(instance.endpoint)
 
-    def _send_message(self, endpoint, msg):
+    def _on_service_instance_added(self, instance, action=None):
+        if self.running:
+            self._add_instance_ipc_endpoint(instance)
+            self.prewarmed_endpoints.add(instance.endpoint)
+            self.connect(instance.endpoint)
+
+    def _send_message(self, endpoint, msg, wait=True):
+        self._send_messages(endpoint, [msg], wait=wait)
+
+    def _send_messages(self, endpoint, msgs, wait=True):
+        """
+        Sends `msgs` to `endpoint` as one multipart message. Unless `wait` is
+        false, waits for the connection to be established first.
+        """
         if not self.running:
             # FIXME: This should raise an Error instead of failing silently.
-            logger.error('cannot send message (not started): %s', msg)
+            logger.error('cannot send messages (not started): %s', ', '.join(str(msg) for msg in msgs))
+            return
+        if self.is_local(endpoint):
+            for msg in msgs:
+                logger.debug('-> %s (local)', msg)
+                self._recv_local(msg)
             return
         connection = self.connect(endpoint)
+        if wait:
+            connection.wait_ready()
+        self._compress_messages(connection, msgs)
         self.send_sock.send(endpoint.encode('utf-8'), flags=zmq.SNDMORE)
-        self.send_sock.send_multipart(msg.pack_frames())
-        logger.debug('-> %s to %s', msg, endpoint)
-        connection.on_send(msg)
+        self.send_sock.send_multipart(Message.pack_batch(msgs), copy=not self.zero_copy)
+        for msg in msgs:
+            logger.debug('-> %s to %s', msg, endpoint)
+            connection.on_send(msg)
+
+    def is_local(self, endpoint):
+        return self.local_dispatch is not None and endpoint == self.endpoint
+
+    def _recv_local(self, msg):
+        # Messages to this server skip serialization and the sockets. Unless
+        # bodies are copied, sender and receiver share the body objects.
+        if self.local_dispatch.get('copy'):
+            msg = Message(
+                msg_type=msg.type,
+                subject=msg.subject,
+                body=copy.deepcopy(msg.body),
+                headers=dict(msg.headers),
+                msg_id=msg.id,
+                source=msg.source,
+                lazy=True,
+            )
+        if msg.is_request():
+            if msg.subject == PING_SUBJECT:
+                self._reply_to_ping(msg)
+                return
+            self.local_counts.incr(subject=msg.subject)
+            self.admit_request(msg, dispatch=self._dispatch_local_request)
+        else:
+            self.recv_reply(msg)
+
+    def _dispatch_local_request(self, msg, received_at=None):
+        # The request greenlet inherited the trace of the sender.
+        trace.set_id(msg.headers.get('trace_id'))
+        trace.set_deadline(msg.headers.get('deadline'))
+        self.dispatch_request(msg, received_at=received_at)
+
+    def _compress_messages(self, connection, msgs):
+        # Only peers that announced support for the codec get compressed
+        # messages, everyone else keeps receiving plain msgpack bodies.
+        if not self.compression or connection is None:
+            return
+        if self.compression.codec.name not in connection.accepted_encodings:
+            return
+        for msg in msgs:
+            self.compression.compress(msg)
 
     def prepare_headers(self, headers, **extra_headers):
         if headers:
@@ -144,66 +375,167 @@ class ZmqRPCServer(Component):
         headers.setdefault('trace_id', trace.get_id())
         return headers
 
-    def _pick_instance(self, service):
+    def get_balancer(self, service):
+        name = getattr(service, 'name', None)
+        try:
+            return self.balancers[name]
+        except KeyError:
+            balancer = get_balancer(self.load_balancing.get(name, self.load_balancing['default']))
+            self.balancers[name] = balancer
+            return balancer
+
+    def _pick_instance(self, service, balancer=None):
         service.observe(services.REMOVED, self._on_service_instance_unavailable)
-        choices = []
+        candidates = []
         count = 0
         for instance in service:
             count += 1
-            try:
-                connection = self.connections[instance.endpoint]
-            except KeyError:
-                choices.append(instance)
-                continue
-            if connection.is_alive():
-                choices.append(instance)
+            connection = self.connections.get(instance.endpoint)
+            if connection is None or connection.is_alive():
+                candidates.append((instance, connection))
         if count == 0:
             raise NotConnected('service have no instance')
-        if not choices:
+        if not candidates:
             raise NotConnected('all %d instance connection are dead' % count)
-        return random.choice(choices)
-
-    def send_request(self, service, subject, body, headers=None):
-        if isinstance(service, InstanceSet):
-            try:
-                instance = self._pick_instance(service)
-            except NotConnected as ex:
-                logger.warning('cannot send request (%s) subject=%s', ex, subject)
-                raise
-            else:
-                endpoint = instance.endpoint
-                version = instance.version
+        available = [c for c in candidates if c[1] is None or c[1].is_available()]
+        if available:
+            candidates = available
         else:
-            endpoint = service
-            version = None
+            logger.warning('all circuit breakers are open for %s, ignoring them', getattr(service, 'name', service))
+        if balancer is None:
+            balancer = self.get_balancer(service)
+        return balancer.pick(candidates)
 
+    def _resolve_endpoint(self, service, subject, balancer=None):
+        if not isinstance(service, InstanceSet):
+            return service, None
+        if self.local_dispatch is not None:
+            for instance in service:
+                if instance.endpoint == self.endpoint:
+                    return instance.endpoint, instance.version
+        try:
+            instance = self._pick_instance(service, balancer=balancer)
+        except NotConnected as ex:
+            logger.warning('cannot send request (%s) subject=%s', ex, subject)
+            raise
+        self._add_instance_ipc_endpoint(instance)
+        return instance.endpoint, instance.version
+
+    def _on_requests_sent(self, endpoint, channels):
+        connection = self.connections.get(endpoint)
+        if connection is None:
+            return
+        for channel in channels:
+            channel.on_sent(connection)
+
+    def _make_request_id(self):
+        return make_sequential_id()
+
+    def _create_request(self, subject, body, headers=None, version=None, channel_factory=RequestChannel, lazy=False, target=None):
+        headers = self.prepare_headers(headers, version=serialize_version(version))
+        deadline = trace.get_deadline()
+        if deadline is not None:
+            # Requests sent while handling a request inherit its deadline.
+            headers.setdefault('deadline', deadline)
+        if self.compression:
+            headers['accept_encoding'] = [self.compression.codec.name]
+        if self.ipc_endpoint:
+            headers['ipc_endpoint'] = self.ipc_endpoint
         msg = Message(
             msg_type=Message.REQ,
             subject=subject,
             body=body,
+            msg_id=self._make_request_id(),
             source=self.endpoint,
-            headers=self.prepare_headers(headers, version=serialize_version(version)),
+            headers=headers,
+            lazy=lazy,
         )
-        channel = RequestChannel(msg, self)
-        self.channels[msg.id] = channel
+        channel = channel_factory(msg, self)
+        self.channels.add(msg.id, channel, deadline=headers.get('deadline'), target=target)
+        return msg, channel
+
+    def send_request(self, service, subject, body, headers=None, channel_factory=RequestChannel, balancer=None):
+        endpoint, version = self._resolve_endpoint(service, subject, balancer=balancer)
+        local = self.is_local(endpoint)
+        msg, channel = self._create_request(subject, body, headers=headers, version=version, channel_factory=channel_factory, lazy=local, target=getattr(service, 'name', service))
         self._send_message(endpoint, msg)
+        if not local:
+            self._on_requests_sent(endpoint, [channel])
         return channel
 
-    def send_reply(self, msg, body, msg_type=Message.REP, headers=None):
-        reply_msg = Message(
-            msg_type=msg_type,
-            subject=msg.id,
-            body=body,
-            source=self.endpoint,
-            headers=self.prepare_headers(headers),
-        )
-        self._send_message(msg.source, reply_msg)
+    def send_requests(self, service, requests, headers=None, balancer=None):
+        """
+        Sends a batch of ``(subject, body)`` requests to a single instance of
+        `service` as one multipart message, or as separate messages if the
+        instance doesn't announce ``batching`` in its description. Returns a
+        list of request channels in the same order as `requests`.
+        """
+        requests = list(requests)
+        if not requests:
+            return []
+        endpoint, version = self._resolve_endpoint(service, requests[0][0], balancer=balancer)
+        local = self.is_local(endpoint)
+        target = getattr(service, 'name', service)
+        msgs, channels = [], []
+        for subject, body in requests:
+            msg, channel = self._create_request(subject, body, headers=dict(headers or {}), version=version, lazy=local, target=target)
+            msgs.append(msg)
+            channels.append(channel)
+        if self._accepts_batches(service, endpoint):
+            self._send_messages(endpoint, msgs)
+        else:
+            for msg in msgs:
+                self._send_message(endpoint, msg)
+        if not local:
+            self._on_requests_sent(endpoint, channels)
+        return channels
+
+    def _accepts_batches(self, service, endpoint):
+        # Older instances reject multipart messages that carry more than one
+        # request, batches only go to instances that announce support.
+        if self.is_local(endpoint):
+            return True
+        if not isinstance(service, InstanceSet):
+            return False
+        for instance in service:
+            if instance.endpoint == endpoint:
+                return bool(instance.info.get('batching'))
+        return False
+
+    def send_reply(self, msg, body, msg_type=Message.REP, headers=None, packed_body=None, wait=True):
+        if packed_body is not None:
+            reply_msg = Message(
+                msg_type=msg_type,
+                subject=msg.id,
+                packed_body=packed_body,
+                source=self.endpoint,
+                headers=self.prepare_headers(headers),
+                lazy=True,
+            )
+        else:
+            reply_msg = Message(
+                msg_type=msg_type,
+                subject=msg.id,
+                body=body,
+                source=self.endpoint,
+                headers=self.prepare_headers(headers),
+                lazy=self.is_local(msg.source),
+            )
+        self._send_message(msg.source, reply_msg, wait=wait)
         return reply_msg
 
-    def dispatch_request(self, msg):
+    def dispatch_request(self, msg, received_at=None):
         loglevel = self._get_loglevel(msg)
         logger.log(loglevel, '%s source=%s version=%s', msg.subject, msg.source, msg.version)
+        if received_at is not None:
+            self.queue_time.add(time.monotonic() - received_at)
         start = time.time()
+        deadline = msg.headers.get('deadline')
+        if deadline is not None and start >= deadline:
+            # The client has stopped waiting for a reply already.
+            logger.info('dropping expired request subject=%s source=%s (%f seconds late)', msg.subject, msg.source, start - deadline)
+            self.expired_counts.incr(subject=msg.subject)
+            return
         self.request_counts.incr(subject=msg.subject)
         channel = ReplyChannel(msg, self)
         try:
@@ -212,36 +544,167 @@ class ZmqRPCServer(Component):
             elapsed = time.time() - start
             logger.log(loglevel, 'subject=%s duration=%f (seconds)', msg.subject, elapsed)
 
+    def _get_request_pool(self, msg):
+        if msg.subject in ('lymph.ping', PING_SUBJECT):
+            # Heartbeats must not wait for (or be rejected with) business
+            # requests, or busy instances would be considered unresponsive.
+            # The header is set by clients, `control` isn't trusted for
+            # anything else.
+            return self.control_pool
+        priority = msg.headers.get('priority', PRIORITY_NORMAL)
+        if self.request_pool is None:
+            return self.pool
+        if priority == PRIORITY_CRITICAL:
+            return self.pool if self.critical_pool is None else self.critical_pool
+        if priority == PRIORITY_BATCH and self._is_busy(self.request_pool):
+            raise RejectExcecutionError('batch requests are limited to %d%% of the request pool' % (self.batch_limit * 100))
+        return self.request_pool
+
+    def _is_busy(self, pool):
+        limit = getattr(pool, 'limit', None) or getattr(pool, 'size', None)
+        return limit is not None and len(pool) >= limit * self.batch_limit
+
+    def admit_request(self, msg, dispatch=None):
+        try:
+            pool = self._get_request_pool(msg)
+            self._spawn_in(pool, dispatch or self.dispatch_request, msg, received_at=time.monotonic())
+        except RejectExcecutionError as e:
+            # Shed load before any work is done for the request, the client
+            # gets a NACK right away instead of waiting for its timeout.
+            logger.warning('rejecting request (%s) subject=%s source=%s', e, msg.subject, msg.source)
+            self.rejected_counts.incr(subject=msg.subject)
+            # Called by the receive loop, which must not block.
+            self.send_reply(msg, None, msg_type=Message.NACK, wait=False)
+
     def _get_loglevel(self, msg):
         return logging.DEBUG if msg.subject == 'lymph.ping' else logging.INFO
 
     def recv_message(self, msg):
         trace.set_id(msg.headers.get('trace_id'))
-        logger.debug('<- %s', msg)
+        trace.set_deadline(msg.headers.get('deadline'))
+        if self.ipc_endpoint and msg.source not in self.connections:
+            self._add_peer_ipc_endpoint(msg)
         connection = self.connect(msg.source)
         connection.on_recv(msg)
+        if msg.type == Message.REQ and msg.subject == PING_SUBJECT:
+            self._reply_to_ping(msg)
+            return
+        logger.debug('<- %s', msg)
         if msg.is_request():
-            self.spawn(self.dispatch_request, msg)
+            self.admit_request(msg)
         elif msg.is_reply():
-            try:
-                channel = self.channels[msg.subject]
-            except KeyError:
-                logger.debug('reply to unknown subject: %s (msg-id=%s)', msg.subject, msg.id)
-                return
-            channel.recv(msg)
+            self.recv_reply(msg)
         else:
             logger.warning('unknown message type: %s (msg-id=%s)', msg.type, msg.id)
 
+    def _reply_to_ping(self, msg):
+        reply = Message(
+            msg_type=Message.REP,
+            subject=msg.id,
+            body=None,
+            source=self.endpoint,
+            lazy=True,
+        )
+        # The receive loop must not wait for new connections, until then
+        # the reply is dropped and the peer pings again.
+        self._send_message(msg.source, reply, wait=False)
+
+    def _add_peer_ipc_endpoint(self, msg):
+        # Peers announce their ipc endpoint in request headers. It's only
+        # usable if the peer runs on this host, i.e. if its socket exists.
+        ipc_endpoint = msg.headers.get('ipc_endpoint')
+        if ipc_endpoint and os.path.exists(ipc_endpoint[len('ipc://'):]):
+            self.add_ipc_endpoint(msg.source, ipc_endpoint)
+
+    def recv_reply(self, msg):
+        channels = self.channels
+        if msg.headers.get('stream') in STREAM_CONTROL:
+            channels = self.streams
+        try:
+            channel = channels[msg.subject]
+        except KeyError:
+            target = self.channels.get_expired_target(msg.subject)
+            if target is not None:
+                logger.debug('late reply from %s: %s (msg-id=%s)', target, msg.subject, msg.id)
+                self.late_reply_counts.incr(service=target)
+            else:
+                logger.debug('reply to unknown subject: %s (msg-id=%s)', msg.subject, msg.id)
+            return
+        channel.recv(msg)
+
+    def _recv_frames(self):
+        if not self.zero_copy:
+            return self.recv_sock.recv_multipart()
+        frames = self.recv_sock.recv_multipart(copy=False)
+        # Message bodies are kept as views into the zmq frames, they are
+        # decoded from there and can be forwarded without being copied.
+        # Only the small routing frames are copied into bytes.
+        return [
+            frame.buffer if i and i % 5 == 0 else frame.bytes
+            for i, frame in enumerate(frames)
+        ]
+
     def _recv_loop(self):
         while True:
-            frames = self.recv_sock.recv_multipart()
+            frames = self._recv_frames()
             try:
-                msg = Message.unpack_frames(frames)
+                msgs = Message.unpack_batch(frames)
             except ValueError as e:
                 msg_id = frames[1] if len(frames) >= 2 else None
                 logger.warning('bad message format %s: %r (msg-id=%s)', e, (frames), msg_id)
                 continue
-            self.recv_message(msg)
+            for msg in msgs:
+                self.recv_message(msg)
+
+    def _monitor_loop(self):
+        while True:
+            event = recv_monitor_message(self.monitor_sock)
+            address = event['endpoint'].decode('utf-8')
+            connection = self.connections.get(self.addresses.get(address, address))
+            if connection is None:
+                continue
+            if event['event'] == CONNECTED_EVENT:
+                connection.on_connected()
+            elif event['event'] == zmq.EVENT_DISCONNECTED:
+                connection.on_disconnected()
+
+    def _expiry_loop(self):
+        while True:
+            gevent.sleep(self.channels.interval)
+            expired = self.channels.expire()
+            if not expired:
+                continue
+            logger.debug('expired %s in-flight requests', len(expired))
+            for request_id, channel, target in expired:
+                self.orphaned_counts.incr(service=target)
+                channel.on_expired()
+
+    def _iter_inflight_metrics(self):
+        for target, depth in self.channels.iter_depth():
+            yield 'rpc.outstanding', depth, {'service': target}
+
+    def send_ping(self, endpoint, callback):
+        """
+        Sends a minimal ping to `endpoint` and passes the reply to `callback`.
+        Unlike :meth:`ping`, it is answered by the receive loop of the peer
+        instead of the ``lymph.ping`` RPC method. Peers that don't support
+        this don't reply at all.
+        """
+        msg = Message(
+            msg_type=Message.REQ,
+            subject=PING_SUBJECT,
+            body=None,
+            msg_id=self._make_request_id(),
+            source=self.endpoint,
+            lazy=True,
+        )
+        channel = CallbackChannel(msg, self, callback=callback)
+        self.channels.add(msg.id, channel, target=endpoint)
+        self._send_message(endpoint, msg)
+        return channel
 
-    def ping(self, address):
-        return self.send_request(address, 'lymph.ping', {'payload': ''})
+    def ping(self, address, callback=None):
+        channel_factory = RequestChannel
+        if callback:
+            channel_factory = functools.partial(CallbackChannel, callback=callback)
+        return self.send_request(address, 'lymph.ping', {'payload': ''}, headers={'priority': PRIORITY_CONTROL}, channel_factory=channel_factory)
@@ -0,0 +1,99 @@
+import unittest
+
+import mock
+
+from lymph.core import circuitbreaker
+from lymph.core.circuitbreaker import CircuitBreaker
+from lymph.core.interfaces import Interface
+from lymph.core.messages import Message
+from lymph.testing import MultiServiceRPCTestCase
+
+
+def reply(msg_type=Message.REP):
+    return Message(msg_type, 'id', body=None)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('tcp://127.0.0.1:1', window=4, min_requests=4, failure_rate=0.5, reset_timeout=5)
+
+    def fail(self, n=1):
+        for i in range(n):
+            self.breaker.on_request_sent()
+            self.breaker.on_request_done(0.1, timed_out=True)
+
+    def succeed(self, n=1, **kwargs):
+        for i in range(n):
+            self.breaker.on_request_sent()
+            self.breaker.on_request_done(0.1, msg=reply(**kwargs))
+
+    def test_opens_on_failure_rate(self):
+        self.succeed(2)
+        self.fail(1)
+        self.assertTrue(self.breaker.is_available())
+        self.fail(1)
+        self.assertEqual(self.breaker.state, circuitbreaker.OPEN)
+        self.assertFalse(self.breaker.is_available())
+
+    def test_nacks_are_failures(self):
+        self.succeed(4, msg_type=Message.NACK)
+        self.assertEqual(self.breaker.state, circuitbreaker.OPEN)
+
+    def test_remote_errors_are_not_failures_by_default(self):
+        self.succeed(4, msg_type=Message.ERROR)
+        self.assertEqual(self.breaker.state, circuitbreaker.CLOSED)
+
+    def test_discarded_requests_have_no_outcome(self):
+        for i in range(4):
+            self.breaker.on_request_sent()
+            self.breaker.on_request_done(0.1)
+        self.assertEqual(len(self.breaker.outcomes), 0)
+
+    def test_half_open_probe(self):
+        self.fail(4)
+        with mock.patch('time.monotonic', return_value=self.breaker.opened_at + 5):
+            self.assertTrue(self.breaker.is_available())
+            self.assertEqual(self.breaker.state, circuitbreaker.HALF_OPEN)
+            self.breaker.on_request_sent()
+            self.assertFalse(self.breaker.is_available())
+            self.breaker.on_request_done(0.1, msg=reply())
+        self.assertEqual(self.breaker.state, circuitbreaker.CLOSED)
+        self.assertTrue(self.breaker.is_available())
+
+    def test_failed_probe_reopens(self):
+        self.fail(4)
+        with mock.patch('time.monotonic', return_value=self.breaker.opened_at + 5):
+            self.assertTrue(self.breaker.is_available())
+            self.fail(1)
+            self.assertEqual(self.breaker.state, circuitbreaker.OPEN)
+            self.assertFalse(self.breaker.is_available())
+
+
+class Echo(Interface):
+    pass
+
+
+class OutlierEjectionTest(MultiServiceRPCTestCase):
+    containers = [
+        {'echo': {'class': Echo}},
+        {'echo': {'class': Echo}},
+    ]
+
+    def test_open_breakers_are_not_picked(self):
+        container = self.client.container
+        service = container.lookup('echo')
+        endpoints = [instance.endpoint for instance in service]
+        connection = container.server.connect(endpoints[0])
+        connection.breaker = CircuitBreaker(endpoints[0])
+        connection.breaker.open()
+        for i in range(10):
+            self.assertEqual(container.server._pick_instance(service).endpoint, endpoints[1])
+
+    def test_all_breakers_open(self):
+        container = self.client.container
+        service = container.lookup('echo')
+        for instance in service:
+            connection = container.server.connect(instance.endpoint)
+            connection.breaker = CircuitBreaker(instance.endpoint)
+            connection.breaker.open()
+        self.assertIn(container.server._pick_instance(service), list(service))
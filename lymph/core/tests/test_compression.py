@@ -0,0 +1,66 @@
+import unittest
+
+import lymph
+from lymph.core.compression import Compression
+from lymph.core.interfaces import Interface
+from lymph.core.messages import Message
+from lymph.testing import MultiServiceRPCTestCase
+
+
+class CompressionTest(unittest.TestCase):
+    def test_compress(self):
+        compression = Compression(threshold=100)
+        body = {'items': [{'name': 'foo', 'value': i % 3} for i in range(100)]}
+        msg = Message(Message.REP, 'subject', body=body)
+        self.assertTrue(compression.compress(msg))
+        self.assertEqual(msg.headers['encoding'], 'zlib')
+        frames = [b'tcp://127.0.0.1:1'] + msg.pack_frames()
+        received = Message.unpack_frames(frames)
+        self.assertEqual(received.body, body)
+        self.assertNotIn('encoding', received.headers)
+        self.assertLess(compression.ratio, 0.5)
+
+    def test_small_bodies_are_not_compressed(self):
+        compression = Compression(threshold=100)
+        msg = Message(Message.REP, 'subject', body='foo')
+        self.assertFalse(compression.compress(msg))
+        self.assertNotIn('encoding', msg.headers)
+        self.assertEqual(compression.count, 0)
+
+
+class Echo(Interface):
+    @lymph.rpc()
+    def echo(self, payload):
+        return payload
+
+
+class CompressionNegotiationTest(MultiServiceRPCTestCase):
+    containers = [
+        {'echo': {'class': Echo}},
+    ]
+
+    def setUp(self):
+        super(CompressionNegotiationTest, self).setUp()
+        self.echo_server = list(self.network.service_containers.values())[0].server
+        self.client_server = self.client.container.server
+
+    def test_compression(self):
+        self.echo_server.compression = Compression(threshold=100)
+        self.client_server.compression = Compression(threshold=100)
+        payload = 'x' * 10000
+        proxy = self.client.proxy('echo')
+        # the first request tells the echo instance that the client accepts zlib
+        self.assertEqual(proxy.echo(payload=payload), payload)
+        self.assertEqual(self.echo_server.compression.count, 1)
+        self.assertEqual(self.client_server.compression.count, 0)
+        self.assertEqual(proxy.echo(payload=payload), payload)
+        self.assertEqual(self.echo_server.compression.count, 2)
+        self.assertEqual(self.client_server.compression.count, 1)
+
+    def test_peers_without_compression(self):
+        self.echo_server.compression = Compression(threshold=100)
+        payload = 'x' * 10000
+        proxy = self.client.proxy('echo')
+        for i in range(2):
+            self.assertEqual(proxy.echo(payload=payload), payload)
+        self.assertEqual(self.echo_server.compression.count, 0)
@@ -0,0 +1,136 @@
+import time
+
+import gevent
+import mock
+
+from lymph.core import connection
+from lymph.core.interfaces import Interface
+from lymph.core.messages import Message
+from lymph.testing import RPCServiceTestCase, AsyncTestsMixin
+
+
+class HeartbeatSchedulerTest(RPCServiceTestCase, AsyncTestsMixin):
+    service_class = Interface
+    service_name = 'test'
+
+    def setUp(self):
+        super(HeartbeatSchedulerTest, self).setUp()
+        self.server = self.container.server
+        self.peers = [self.network.add_service() for i in range(3)]
+        for peer in self.peers:
+            peer.start()
+
+    def test_heartbeats_share_one_greenlet(self):
+        greenlet_count = len(self.container.pool)
+        connections = [self.server.connect(peer.endpoint) for peer in self.peers]
+        self.assertEqual(len(self.container.pool), greenlet_count)
+        self.assertEqual(len(self.server.heartbeats), len(connections))
+        self.assert_eventually_true(lambda: all(len(c.heartbeat_samples) for c in connections))
+        self.assert_eventually_true(lambda: all(c.status == connection.RESPONSIVE for c in connections))
+
+    def test_closed_connections_are_not_scheduled(self):
+        conn = self.server.connect(self.peers[0].endpoint)
+        conn.close()
+        self.assertEqual(len(self.server.heartbeats), 0)
+        count = conn.explicit_heartbeat_count
+        gevent.sleep(conn.heartbeat_interval * 1.5)
+        self.assertEqual(conn.explicit_heartbeat_count, count)
+
+
+class AdaptiveHeartbeatTest(HeartbeatSchedulerTest):
+    def setUp(self):
+        super(AdaptiveHeartbeatTest, self).setUp()
+        self.server.connection_config = {'adaptive_heartbeat': True}
+
+    def test_minimal_pings(self):
+        conn = self.server.connect(self.peers[0].endpoint)
+        with mock.patch.object(self.peers[0].server, 'dispatch_request') as dispatch_request:
+            self.assert_eventually_true(lambda: conn.explicit_heartbeat_count)
+        self.assertFalse(dispatch_request.called)
+        self.assertTrue(conn.minimal_pings)
+
+    def test_pings_are_skipped_on_busy_connections(self):
+        conn = self.server.connect(self.peers[0].endpoint)
+        conn.last_seen = time.monotonic()
+        conn.heartbeat()
+        self.assertIsNone(conn.heartbeat_channel)
+        self.assertEqual(conn.skipped_heartbeat_count, 1)
+
+    def test_requests_feed_rtt_samples(self):
+        conn = self.server.connect(self.peers[0].endpoint)
+        conn.on_request_sent()
+        conn.on_request_done(0.1, msg=Message(Message.REP, 'id', body=None))
+        self.assertEqual(list(conn.heartbeat_samples.values), [100])
+
+    def test_fallback_for_peers_without_minimal_pings(self):
+        self.server.connection_config.update(heartbeat_interval=0.05, timeout=0.5, idle_timeout=1)
+        peer = self.peers[0].server
+        # Instances without minimal ping support don't answer them: the
+        # request handler fails on the '_ping' subject.
+        with mock.patch.object(peer, '_reply_to_ping', side_effect=peer.admit_request):
+            with mock.patch.object(peer, 'dispatch_request', wraps=peer.dispatch_request) as dispatch_request:
+                conn = self.server.connect(self.peers[0].endpoint)
+                self.assert_eventually_true(lambda: not conn.minimal_pings, timeout=1)
+                self.assertEqual(conn.explicit_heartbeat_count, 0)
+                self.assert_eventually_true(lambda: conn.explicit_heartbeat_count, timeout=1)
+        subjects = [c[0][0].subject for c in dispatch_request.call_args_list]
+        self.assertEqual(subjects[:connection.MINIMAL_PING_ATTEMPTS], ['_ping'] * connection.MINIMAL_PING_ATTEMPTS)
+        self.assertIn('lymph.ping', subjects)
+
+    def test_answered_pings_reset_the_fallback_count(self):
+        conn = self.server.connect(self.peers[0].endpoint)
+        conn.unanswered_pings = connection.MINIMAL_PING_ATTEMPTS - 1
+        self.assert_eventually_true(lambda: conn.explicit_heartbeat_count)
+        self.assertEqual(conn.unanswered_pings, 0)
+        self.assertTrue(conn.minimal_pings)
+
+
+class ConnectionReapingTest(HeartbeatSchedulerTest):
+    def test_idle_connections_are_reaped(self):
+        self.server.connection_config = {'idle_disconnect': 0.2}
+        conn = self.server.connect(self.peers[0].endpoint)
+        self.assert_eventually_true(lambda: conn.status == connection.CLOSED, timeout=3)
+        self.assertIsNot(self.server.connections.get(self.peers[0].endpoint), conn)
+        self.assertEqual([tags for name, count, tags in self.server.reaped_counts], [{'reason': 'idle'}])
+
+    def test_connections_with_pending_requests_are_not_idle(self):
+        conn = self.server.connect(self.peers[0].endpoint)
+        conn.idle_disconnect = 0
+        self.assertEqual(conn.should_disconnect(), connection.IDLE)
+        conn.on_request_sent()
+        self.assertIsNone(conn.should_disconnect())
+
+    def test_reaping_is_opt_in(self):
+        conn = self.server.connect(self.peers[0].endpoint)
+        self.assertIsNone(conn.idle_disconnect)
+        self.assertIsNone(conn.unresponsive_disconnect)
+        conn.last_message = conn.last_seen = time.monotonic() - 3600
+        self.assertIsNone(conn.should_disconnect())
+
+    def test_prewarmed_connections_are_not_idle(self):
+        conn = self.server.connect(self.peers[0].endpoint)
+        conn.idle_disconnect = 0
+        self.server.prewarmed_endpoints.add(self.peers[0].endpoint)
+        self.assertIsNone(conn.should_disconnect())
+
+    def test_unresponsive_connections_are_reaped(self):
+        conn = self.server.connect(self.peers[0].endpoint)
+        conn.unresponsive_disconnect = 10
+        now = time.monotonic()
+        conn.created_at = now - 20
+        conn.last_seen = now - 11
+        conn.status = connection.UNRESPONSIVE
+        self.assertEqual(conn.should_disconnect(now), connection.UNRESPONSIVE)
+        conn.unresponsive_disconnect = None
+        self.assertIsNone(conn.should_disconnect(now))
+
+    def test_max_connections(self):
+        self.server.max_connections = 2
+        first, second = [self.server.connect(peer.endpoint) for peer in self.peers[:2]]
+        # Using the first connection makes the second one the least recently used.
+        self.server.connect(self.peers[0].endpoint)
+        self.server.connect(self.peers[2].endpoint)
+        self.assertEqual(set(self.server.connections), {self.peers[0].endpoint, self.peers[2].endpoint})
+        self.assertEqual(second.status, connection.CLOSED)
+        self.assertNotEqual(first.status, connection.CLOSED)
+        self.assertEqual(list(self.server.reaped_counts), [('rpc.connections.reaped', 1, {'reason': 'evicted'})])
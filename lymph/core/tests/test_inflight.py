@@ -0,0 +1,129 @@
+import unittest
+
+import gevent
+import mock
+
+import lymph
+from lymph.core.inflight import InflightTable
+from lymph.core.interfaces import Interface
+from lymph.exceptions import Timeout
+from lymph.testing import RPCServiceTestCase
+
+
+class InflightTableTest(unittest.TestCase):
+    def setUp(self):
+        self.table = InflightTable(max_age=10, grace=1)
+
+    def test_dict_interface(self):
+        self.table['a'] = 'channel'
+        self.assertIn('a', self.table)
+        self.assertEqual(self.table['a'], 'channel')
+        self.assertEqual(len(self.table), 1)
+        del self.table['a']
+        self.assertFalse(self.table)
+        self.assertRaises(KeyError, self.table.__getitem__, 'a')
+        self.assertEqual(self.table.pop('a', 'missing'), 'missing')
+
+    def test_expiry_order(self):
+        with mock.patch('time.time', return_value=100):
+            self.table.add('a', 'channel-a', target='foo')
+            self.table.add('b', 'channel-b', deadline=103, target='bar')
+            self.table.add('c', 'channel-c', deadline=120, target='foo')
+        self.assertEqual(dict(self.table.iter_depth()), {'foo': 2, 'bar': 1})
+        self.assertEqual(self.table.expire(now=103), [])
+        self.assertEqual(self.table.expire(now=110), [('b', 'channel-b', 'bar'), ('a', 'channel-a', 'foo')])
+        self.assertEqual(list(self.table), ['c'])
+        self.assertEqual(dict(self.table.iter_depth()), {'foo': 1})
+        self.assertEqual(self.table.get_expired_target('a'), 'foo')
+        self.assertIsNone(self.table.get_expired_target('c'))
+
+    def test_removed_entries_do_not_expire(self):
+        with mock.patch('time.time', return_value=100):
+            self.table.add('a', 'channel-a', target='foo')
+            self.table.add('b', 'channel-b', target='foo')
+        self.table.remove('a')
+        self.table.remove('b', timed_out=True)
+        self.assertEqual(self.table.expire(now=200), [])
+        self.assertEqual(self.table.heap, [])
+        self.assertEqual(dict(self.table.iter_depth()), {})
+        self.assertIsNone(self.table.get_expired_target('a'))
+        self.assertEqual(self.table.get_expired_target('b'), 'foo')
+
+    def test_touch(self):
+        with mock.patch('time.time', return_value=100):
+            self.table.add('a', 'channel-a')
+        with mock.patch('time.time', return_value=105):
+            self.table.touch('a')
+        self.assertEqual(self.table.expire(now=112), [])
+        self.assertEqual([channel for _, channel, _ in self.table.expire(now=115)], ['channel-a'])
+        self.assertEqual(dict(self.table.iter_depth()), {})
+
+    def test_heap_compaction(self):
+        for i in range(2000):
+            self.table.add(i, 'channel')
+            self.table.remove(i)
+        self.table.expire()
+        self.assertEqual(self.table.heap, [])
+
+
+class Inflight(Interface):
+    @lymph.rpc()
+    def echo(self, text):
+        return text
+
+    @lymph.rpc()
+    def slow(self):
+        gevent.sleep(0.05)
+
+
+class InflightRPCTest(RPCServiceTestCase):
+    service_class = Inflight
+    service_name = 'inflight'
+
+    def test_consumed_replies_release_channels(self):
+        self.assertEqual(self.client.echo(text='foo'), 'foo')
+        self.assertFalse(self.container.server.channels)
+
+    def test_orphaned_channels_expire(self):
+        server = self.container.server
+        self.container.send_request('inflight', 'inflight.echo', {'text': 'foo'})
+        self.assertEqual(list(server._iter_inflight_metrics()), [('rpc.outstanding', 1, {'service': 'inflight'})])
+        with mock.patch('time.time', return_value=server.channels.heap[0][0]):
+            with mock.patch('gevent.sleep', side_effect=[None, StopIteration]):
+                self.assertRaises(StopIteration, server._expiry_loop)
+        self.assertFalse(server.channels)
+        self.assertEqual(list(server.orphaned_counts), [('rpc.orphaned', 1, {'service': 'inflight'})])
+        gevent.sleep(0.1)
+        self.assertEqual(list(server.late_reply_counts), [('rpc.late_replies', 1, {'service': 'inflight'})])
+
+    def test_expired_channels_release_connections(self):
+        server = self.container.server
+        for i in range(5):
+            self.container.send_request('inflight', 'inflight.slow', {})
+        connection = server.connections[self.container.endpoint]
+        self.assertEqual(connection.pending_requests, 5)
+        with mock.patch('time.time', return_value=max(entry[0] for entry in server.channels.heap)):
+            with mock.patch('gevent.sleep', side_effect=[None, StopIteration]):
+                self.assertRaises(StopIteration, server._expiry_loop)
+        self.assertEqual(connection.pending_requests, 0)
+        gevent.sleep(0.1)
+        self.assertEqual(connection.pending_requests, 0)
+
+    def test_replies_after_timeouts_are_late(self):
+        server = self.container.server
+        channel = self.container.send_request('inflight', 'inflight.slow', {})
+        self.assertRaises(Timeout, channel.get, timeout=0.01)
+        gevent.sleep(0.1)
+        self.assertEqual(list(server.late_reply_counts), [('rpc.late_replies', 1, {'service': 'inflight'})])
+
+    def test_expiry_wakes_up_waiters(self):
+        server = self.container.server
+        channel = self.container.send_request('inflight', 'inflight.slow', {})
+        waiter = gevent.spawn(channel.get, timeout=90)
+        gevent.sleep(0)
+        with mock.patch('time.time', return_value=server.channels.heap[0][0]):
+            with mock.patch('gevent.sleep', side_effect=[None, StopIteration]):
+                self.assertRaises(StopIteration, server._expiry_loop)
+        waiter.join(0.01)
+        self.assertTrue(waiter.ready())
+        self.assertIsInstance(waiter.exception, Timeout)
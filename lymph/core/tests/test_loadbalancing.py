@@ -0,0 +1,75 @@
+import unittest
+
+from lymph.core import loadbalancing
+from lymph.core.interfaces import Interface
+from lymph.exceptions import ConfigurationError
+from lymph.testing import RPCServiceTestCase
+from lymph.utils import MovingAverage
+
+
+class FakeConnection(object):
+    def __init__(self, pending_requests=0, latency=None):
+        self.pending_requests = pending_requests
+        self.latency = MovingAverage()
+        if latency is not None:
+            self.latency.add(latency)
+
+
+class LoadBalancerTest(unittest.TestCase):
+    def test_round_robin(self):
+        balancer = loadbalancing.RoundRobinBalancer()
+        candidates = [('a', None), ('b', None), ('c', None)]
+        picks = [balancer.pick(candidates) for i in range(6)]
+        self.assertEqual(picks, ['a', 'b', 'c', 'a', 'b', 'c'])
+
+    def test_least_outstanding(self):
+        balancer = loadbalancing.LeastOutstandingBalancer()
+        candidates = [('a', FakeConnection(3)), ('b', FakeConnection(1)), ('c', FakeConnection(2))]
+        for i in range(10):
+            self.assertEqual(balancer.pick(candidates), 'b')
+
+    def test_unconnected_instances_have_no_outstanding_requests(self):
+        balancer = loadbalancing.LeastOutstandingBalancer()
+        self.assertEqual(balancer.pick([('a', FakeConnection(1)), ('b', None)]), 'b')
+
+    def test_power_of_two(self):
+        balancer = loadbalancing.PowerOfTwoBalancer()
+        candidates = [('a', FakeConnection(5)), ('b', FakeConnection(0))]
+        for i in range(10):
+            self.assertEqual(balancer.pick(candidates), 'b')
+        self.assertEqual(balancer.pick([('a', None)]), 'a')
+
+    def test_ewma(self):
+        balancer = loadbalancing.EWMABalancer()
+        candidates = [('slow', FakeConnection(0, latency=0.5)), ('fast', FakeConnection(1, latency=0.01))]
+        self.assertEqual(balancer.pick(candidates), 'fast')
+        candidates.append(('new', FakeConnection()))
+        self.assertEqual(balancer.pick(candidates), 'new')
+
+    def test_get_balancer(self):
+        self.assertIsInstance(loadbalancing.get_balancer('ewma'), loadbalancing.EWMABalancer)
+        self.assertIsInstance(loadbalancing.get_balancer('lymph.core.loadbalancing:RoundRobinBalancer'), loadbalancing.RoundRobinBalancer)
+        balancer = loadbalancing.RandomBalancer()
+        self.assertIs(loadbalancing.get_balancer(balancer), balancer)
+        self.assertRaises(ConfigurationError, loadbalancing.get_balancer, 'unknown')
+
+
+class Upper(Interface):
+    pass
+
+
+class BalancedRequestTest(RPCServiceTestCase):
+    service_class = Upper
+    service_name = 'upper'
+
+    def test_pending_requests_are_tracked(self):
+        channel = self.container.send_request('upper', 'lymph.ping', {'payload': 1}, balancer=loadbalancing.LeastOutstandingBalancer())
+        connection = self.container.server.connections[self.container.endpoint]
+        self.assertEqual(connection.pending_requests, 1)
+        channel.get()
+        self.assertEqual(connection.pending_requests, 0)
+        self.assertIsNotNone(connection.latency.value)
+
+    def test_proxy_balancer(self):
+        proxy = self.get_proxy(namespace='lymph', balancer='round_robin')
+        self.assertEqual(proxy.ping(payload=42), 42)
@@ -0,0 +1,51 @@
+import unittest
+
+import mock
+
+from lymph.core import messages
+from lymph.core.messages import Message
+from lymph.serializers import msgpack_serializer
+
+
+class MessageTest(unittest.TestCase):
+    def pack(self, **kwargs):
+        msg = Message(Message.REQ, 'upper.upper', **kwargs)
+        return [b'tcp://127.0.0.1:1234'] + msg.pack_frames()
+
+    def test_unpack_frames_decodes_headers_only(self):
+        frames = self.pack(body={'text': 'foo'}, headers={'trace_id': 'abc'})
+        with mock.patch.object(msgpack_serializer, 'loads', wraps=msgpack_serializer.loads) as loads:
+            msg = Message.unpack_frames(frames)
+            self.assertEqual(msg.headers, {'trace_id': 'abc'})
+            self.assertEqual(loads.call_count, 1)
+            self.assertEqual(msg.body, {'text': 'foo'})
+            self.assertEqual(loads.call_count, 2)
+
+    def test_packed_body_is_released_after_decoding(self):
+        msg = Message.unpack_frames(self.pack(body={'text': 'foo'}))
+        self.assertIsNotNone(msg._packed_body)
+        self.assertEqual(msg.body, {'text': 'foo'})
+        self.assertIsNone(msg._packed_body)
+        self.assertEqual(msgpack_serializer.loads(msg.packed_body), {'text': 'foo'})
+
+    def test_body_can_be_decoded_from_buffer(self):
+        frames = self.pack(body={'text': 'foo'})
+        frames[-1] = memoryview(frames[-1])
+        self.assertEqual(Message.unpack_frames(frames).body, {'text': 'foo'})
+
+    def test_request_subjects_are_cached(self):
+        msg = Message.unpack_frames(self.pack(body=None))
+        self.assertIs(msg.subject, Message.unpack_frames(self.pack(body=None)).subject)
+        self.assertIn(b'upper.upper', messages._decoded_names)
+        self.assertIs(msg.pack_frames()[2], messages.encode_name('upper.upper'))
+
+    def test_subject_cache_is_bounded(self):
+        with mock.patch.object(messages, 'NAME_CACHE_SIZE', 3):
+            for i in range(10):
+                messages.decode_name(('subject.%s' % i).encode('utf-8'))
+                self.assertLessEqual(len(messages._decoded_names), 3)
+
+    def test_str_tells_messages_apart(self):
+        first, second = Message(Message.REQ, 'upper.upper', body=None), Message(Message.REQ, 'upper.upper', body=None)
+        self.assertNotEqual(str(first), str(second))
+        self.assertIn(first.id, str(first))
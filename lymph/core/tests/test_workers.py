@@ -0,0 +1,32 @@
+import unittest
+
+from lymph.core.messages import Message
+from lymph.core.workers import RPCFrontend, WorkerRPCServer
+
+
+class RPCFrontendRoutingTest(unittest.TestCase):
+    def setUp(self):
+        self.frontend = RPCFrontend('tcp://127.0.0.1:5000', 'inproc://workers', 4)
+
+    def get_request_id(self, index):
+        server = WorkerRPCServer(frontend=self.frontend.endpoint, index=index)
+        return server._make_request_id().encode('utf-8')
+
+    def test_replies_are_routed_to_the_requesting_worker(self):
+        for index in range(4):
+            subject = self.get_request_id(index)
+            self.assertEqual(self.frontend.pick_worker(b'x', Message.REP, subject), index)
+            self.assertEqual(self.frontend.pick_worker(b'x', Message.NACK, subject), index)
+
+    def test_stream_control_follows_the_request(self):
+        request_id = b'a5e1f0c2b9d84e7f8a6b3c2d1e0f9a8b'
+        index = self.frontend.pick_worker(request_id, Message.REQ, b'echo.echo')
+        self.assertEqual(self.frontend.pick_worker(b'x', Message.ACK, request_id), index)
+
+    def test_requests_are_spread(self):
+        server = WorkerRPCServer(frontend='tcp://127.0.0.1:6000', index=0)
+        indexes = set(
+            self.frontend.pick_worker(server._make_request_id().encode('utf-8'), Message.REQ, b'echo.echo')
+            for i in range(100)
+        )
+        self.assertEqual(indexes, {0, 1, 2, 3})
@@ -1,9 +1,10 @@
 import logging
+import time
 import uuid
 
 import gevent
 
-from lymph.utils.gpool import NonBlockingPool
+from lymph.utils.gpool import NonBlockingPool, AdaptiveLimitPool
 
 
 logger = logging.getLogger(__name__)
@@ -26,6 +27,10 @@ class Group(NonBlockingPool):
     greenlet_class = GreenletWithTrace
 
 
+class AdaptiveGroup(AdaptiveLimitPool):
+    greenlet_class = GreenletWithTrace
+
+
 def trace(**kwargs):
     get_trace().update(kwargs)
 
@@ -42,6 +47,25 @@ def get_id():
     return get_trace().get('lymph_trace_id')
 
 
+def set_deadline(deadline=None):
+    trace(lymph_deadline=deadline)
+
+
+def get_deadline():
+    return get_trace().get('lymph_deadline')
+
+
+def get_remaining_time():
+    """
+    Returns the number of seconds left until the deadline of the current
+    request, or None if there is no deadline.
+    """
+    deadline = get_deadline()
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+
 class TraceFormatter(logging.Formatter):
     def format(self, record):
         record.trace_id = get_id()
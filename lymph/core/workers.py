@@ -0,0 +1,233 @@
+import collections
+import logging
+import os
+import zlib
+
+import gevent
+import gevent.event
+import zmq.green as zmq
+from zmq.utils.monitor import recv_monitor_message
+
+from lymph.core.connection import Connection
+from lymph.core.messages import Message
+from lymph.core.rpc import ZmqRPCServer, CONNECTED_EVENT
+from lymph.utils import hash_id, make_sequential_id
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_request_id_prefix(endpoint):
+    """
+    Returns the prefix of the ids of requests that are sent by the workers
+    behind `endpoint`. Replies to these requests carry their id as subject,
+    which lets the frontend route them back to the worker that waits for
+    them.
+    """
+    return '%s.' % hash_id(endpoint)[:8]
+
+
+def get_worker_identity(index):
+    return str(index).encode('utf-8')
+
+
+class RPCFrontend(object):
+    """
+    Owns the public `endpoint` of an instance that is served by `workers`
+    worker processes, which connect to `backend` with a
+    :class:`WorkerRPCServer`.
+
+    Requests are spread over the workers by their id, replies to requests
+    sent by a worker are routed back by the worker index in their subject.
+    Everything else that is addressed to a request (e.g. stream credit) uses
+    the request id and therefore ends up at the worker that handles it.
+    Outgoing messages of all workers are sent from the public endpoint, so
+    the workers share one identity.
+    """
+
+    def __init__(self, endpoint, backend, workers, connect_timeout=1):
+        self.endpoint = endpoint
+        self.backend = backend
+        self.workers = workers
+        self.connect_timeout = connect_timeout
+        self.prefix = get_request_id_prefix(endpoint).encode('utf-8')
+        self.zctx = zmq.Context.instance()
+        self.recv_sock = None
+        self.send_sock = None
+        self.backend_sock = None
+        self.monitor_sock = None
+        self.peers = {}
+        self.pending = {}
+        self.greenlets = []
+
+    def start(self):
+        identity = self.endpoint.encode('utf-8')
+        self.recv_sock = self.zctx.socket(zmq.ROUTER)
+        self.recv_sock.setsockopt(zmq.IDENTITY, identity)
+        self.send_sock = self.zctx.socket(zmq.ROUTER)
+        self.send_sock.setsockopt(zmq.IDENTITY, identity)
+        self.monitor_sock = self.send_sock.get_monitor_socket(CONNECTED_EVENT | zmq.EVENT_DISCONNECTED)
+        self.backend_sock = self.zctx.socket(zmq.ROUTER)
+        self.backend_sock.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.backend_sock.bind(self.backend)
+        self.recv_sock.bind(self.endpoint)
+        self.greenlets = [
+            gevent.spawn(self._inbound_loop),
+            gevent.spawn(self._outbound_loop),
+            gevent.spawn(self._monitor_loop),
+        ]
+        logger.info('serving %s with %s workers (backend=%s)', self.endpoint, self.workers, self.backend)
+
+    def stop(self):
+        gevent.killall(self.greenlets)
+        for sock in (self.recv_sock, self.backend_sock):
+            if sock:
+                sock.close()
+        if self.monitor_sock:
+            self.send_sock.disable_monitor()
+            self.monitor_sock.close()
+        if self.send_sock:
+            self.send_sock.close()
+        if self.backend.startswith('ipc://'):
+            try:
+                os.remove(self.backend[len('ipc://'):])
+            except OSError:
+                pass
+
+    def pick_worker(self, msg_id, msg_type, subject):
+        if msg_type == Message.REQ:
+            key = msg_id
+        else:
+            key = subject
+            if subject.startswith(self.prefix):
+                index = subject[len(self.prefix):].split(b'.', 1)[0]
+                if index.isdigit() and int(index) < self.workers:
+                    return int(index)
+        return zlib.crc32(key) % self.workers
+
+    def _inbound_loop(self):
+        while True:
+            frames = self.recv_sock.recv_multipart()
+            if len(frames) < 6 or (len(frames) - 1) % 5:
+                logger.warning('bad message frame count: %s', len(frames))
+                continue
+            source = frames[0]
+            batches = collections.OrderedDict()
+            for i in range(1, len(frames), 5):
+                msg_id, msg_type, subject = frames[i:i + 3]
+                index = self.pick_worker(msg_id, msg_type, subject)
+                key = (index, msg_type == Message.REQ)
+                batches.setdefault(key, [source]).extend(frames[i:i + 5])
+            for (index, requests), batch in batches.items():
+                self._forward(index, batch, reroute=requests)
+
+    def _forward(self, index, frames, reroute=False):
+        # Requests may be handled by any worker, so they are passed on to
+        # the next one if a worker isn't connected (yet). Everything else
+        # only makes sense to a single worker.
+        attempts = self.workers if reroute else 1
+        for i in range(attempts):
+            try:
+                self.backend_sock.send(get_worker_identity(index), flags=zmq.SNDMORE)
+                self.backend_sock.send_multipart(frames)
+                return
+            except zmq.ZMQError as e:
+                if e.errno != zmq.EHOSTUNREACH:
+                    raise
+            index = (index + 1) % self.workers
+        logger.warning('dropping %s messages from %s: worker not connected', (len(frames) - 1) // 5, frames[0])
+
+    def _outbound_loop(self):
+        while True:
+            frames = self.backend_sock.recv_multipart()
+            self._send(frames[1], frames[2:])
+
+    def connect(self, endpoint):
+        try:
+            return self.peers[endpoint]
+        except KeyError:
+            ready = self.peers[endpoint] = gevent.event.Event()
+            self.send_sock.connect(endpoint.decode('utf-8'))
+            return ready
+
+    def _send(self, endpoint, frames):
+        ready = self.connect(endpoint)
+        if endpoint in self.pending:
+            self.pending[endpoint].append(frames)
+        elif not ready.is_set():
+            self.pending[endpoint] = [frames]
+            gevent.spawn(self._send_pending, endpoint, ready)
+        else:
+            self.send_sock.send(endpoint, flags=zmq.SNDMORE)
+            self.send_sock.send_multipart(frames)
+
+    def _send_pending(self, endpoint, ready):
+        ready.wait(self.connect_timeout)
+        for frames in self.pending.pop(endpoint):
+            self.send_sock.send(endpoint, flags=zmq.SNDMORE)
+            self.send_sock.send_multipart(frames)
+
+    def _monitor_loop(self):
+        while True:
+            event = recv_monitor_message(self.monitor_sock)
+            ready = self.peers.get(event['endpoint'])
+            if ready is None:
+                continue
+            if event['event'] == CONNECTED_EVENT:
+                ready.set()
+            elif event['event'] == zmq.EVENT_DISCONNECTED:
+                ready.clear()
+
+
+class WorkerRPCServer(ZmqRPCServer):
+    """
+    Serves the `frontend` endpoint of an :class:`RPCFrontend` as worker
+    number `index`. All messages are exchanged with the frontend through
+    a single socket connected to `backend`.
+    """
+
+    def __init__(self, frontend=None, backend=None, index=0, **kwargs):
+        super(WorkerRPCServer, self).__init__(**kwargs)
+        self.frontend = frontend
+        self.backend = backend
+        self.index = index
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        server = super(WorkerRPCServer, cls).from_config(config, **kwargs)
+        server.frontend = config.get('frontend')
+        server.backend = config.get('backend')
+        server.index = config.get('index', 0)
+        return server
+
+    def _bind(self, max_retries=2, retry_delay=0):
+        assert not self.bound, 'already bound (endpoint=%s)' % self.endpoint
+        self.endpoint = self.frontend
+        self.port = int(self.frontend.rsplit(':', 1)[1])
+        sock = self.zctx.socket(zmq.DEALER)
+        sock.setsockopt(zmq.IDENTITY, get_worker_identity(self.index))
+        sock.connect(self.backend)
+        self.recv_sock = self.send_sock = sock
+        self.bound = True
+
+    def _close_sockets(self):
+        if self.recv_sock:
+            self.recv_sock.close()
+
+    def _monitor_loop(self):
+        # The frontend owns the connections to other instances.
+        pass
+
+    def _create_connection(self, endpoint):
+        # Peers see a single instance, pinging them from every worker would
+        # multiply the heartbeats. Liveness is left to the frontend's socket.
+        config = dict(self.connection_config, heartbeat_interval=0)
+        connection = Connection(self, endpoint, **config)
+        connection.ready.set()
+        return connection
+
+    def disconnect(self, endpoint, socket=False):
+        super(WorkerRPCServer, self).disconnect(endpoint)
+
+    def _make_request_id(self):
+        return '%s%s.%s' % (get_request_id_prefix(self.frontend), self.index, make_sequential_id())
@@ -14,6 +14,7 @@ from lymph.core.connection import Connection
 from lymph.core.interfaces import Interface
 from lymph.core.rpc import ZmqRPCServer
 from lymph.core.messages import Message
+from lymph.core import trace
 from lymph.core.monitoring.aggregator import Aggregator
 from lymph.core.versioning import parse_versioned_name
 from lymph.discovery.static import StaticServiceRegistryHub
@@ -73,24 +74,36 @@ class MockRPCServer(ZmqRPCServer):
     def _close_sockets(self):
         pass
 
-    def connect(self, endpoint):
-        if endpoint not in self.connections:
-            self.connections[endpoint] = Connection(self, endpoint)
-        return self.connections[endpoint]
+    def _create_connection(self, endpoint):
+        connection = Connection(self, endpoint, **self.connection_config)
+        connection.ready.set()
+        return connection
 
-    def _send_message(self, endpoint, msg):
+    def _send_messages(self, endpoint, msgs, wait=True):
+        if self.is_local(endpoint):
+            return super(MockRPCServer, self)._send_messages(endpoint, msgs, wait=wait)
         dst = self.__mock_network.service_containers[endpoint]
+        self._compress_messages(self.connections.get(endpoint), msgs)
 
         # Exercise the msgpack packing and unpacking.
-        frames = msg.pack_frames()
+        frames = Message.pack_batch(msgs)
         frames.insert(0, self.endpoint.encode('utf-8'))
-        msg = Message.unpack_frames(frames)
-
-        dst.server.recv_message(msg)
+        # Messages are received in the sending greenlet, which must not
+        # inherit their trace id and deadline.
+        sender_trace = dict(trace.get_trace())
+        try:
+            for msg in Message.unpack_batch(frames):
+                dst.server.recv_message(msg)
+        finally:
+            trace.get_trace().clear()
+            trace.get_trace().update(sender_trace)
 
     def _recv_loop(self):
         pass
 
+    def _monitor_loop(self):
+        pass
+
 
 class MockServiceContainer(ServiceContainer):
     def __init__(self, *args, **kwargs):
@@ -197,6 +210,7 @@ class MultiServiceRPCTestCase(unittest.TestCase):
         for interfaces in self.containers:
             container = self.network.add_service()
             for name, config in interfaces.items():
+                config = dict(config)
                 cls = config.pop('class')
                 name, version = parse_versioned_name(name)
                 interface = container.install_interface(cls, name=name, version=version)
@@ -135,14 +135,14 @@ def _get_rpc_mock(rpc_mocks=None, original=ServiceContainer.send_request):
     class RequestSender(mock.MagicMock):
         rpc_functions = rpc_mocks or {}
 
-        def __call__(self, container, address, subject, body, version=None):
+        def __call__(self, container, address, subject, body, version=None, **kwargs):
             # XXX (Mouad): We need to call MagicMock __call__ here else calls
             # will not be tracked, and we do it for all calls mocked or not.
             super(RequestSender, self).__call__(subject, **body)
             try:
                 result = self.rpc_functions[subject]
             except KeyError:
-                return original(container, address, subject, body)
+                return original(container, address, subject, body, **kwargs)
             return FakeChannel(result, body)
 
         def __get__(self, obj, type=None):
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+
+import gevent
+import mock
+from kazoo.client import KazooClient
+from kazoo.handlers.gevent import SequentialGeventHandler
+
+import lymph
+from lymph.aio import AsyncClient
+from lymph.aio import client as aio_client
+from lymph.core.interfaces import Interface
+from lymph.discovery.static import StaticServiceRegistryHub
+from lymph.discovery.zookeeper import ZookeeperServiceRegistry
+from lymph.events.null import NullEventSystem
+from lymph.exceptions import Nack, RemoteError
+from lymph.testing import LymphIntegrationTestCase
+
+
+class Upper(Interface):
+    @lymph.rpc()
+    def upper(self, text=None):
+        return text.upper()
+
+    @lymph.rpc(raises=(ValueError,))
+    def fail(self):
+        raise ValueError('foo')
+
+
+class AsyncClientTest(LymphIntegrationTestCase):
+    def setUp(self):
+        super(AsyncClientTest, self).setUp()
+        self.hub = StaticServiceRegistryHub()
+        self.events = NullEventSystem()
+        self.upper_container, interface = self.create_container(Upper, 'upper')
+
+    def create_registry(self, **kwargs):
+        return self.hub.create_registry()
+
+    def create_async_client(self):
+        return AsyncClient(self.hub.create_registry())
+
+    def run_client(self, func):
+        # The event loop runs in a thread of its own while the services
+        # keep running in the gevent hub of this thread.
+        result = {}
+
+        async def main():
+            async with self.create_async_client() as client:
+                return await func(client)
+
+        def target():
+            loop = asyncio.new_event_loop()
+            try:
+                result['value'] = loop.run_until_complete(main())
+            except Exception as e:
+                result['error'] = e
+            finally:
+                loop.close()
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        while thread.is_alive():
+            gevent.sleep(0.01)
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+    def test_call(self):
+        async def call(client):
+            return await client.proxy('upper').upper(text='foo')
+        self.assertEqual(self.run_client(call), 'FOO')
+
+    def test_fan_out(self):
+        texts = ['foo%s' % i for i in range(20)]
+
+        async def fan_out(client):
+            proxy = client.proxy('upper')
+            return await asyncio.gather(*[proxy.upper(text=text) for text in texts])
+        self.assertEqual(self.run_client(fan_out), [text.upper() for text in texts])
+
+    def test_remote_error(self):
+        async def fail(client):
+            return await client.proxy('upper').fail()
+        self.assertRaises(RemoteError.ValueError, self.run_client, fail)
+
+    def test_nack(self):
+        async def missing(client):
+            return await client.proxy('upper').missing()
+        self.assertRaises(Nack, self.run_client, missing)
+
+    def test_pings_are_answered(self):
+        async def call(client):
+            await client.proxy('upper').upper(text='foo')
+            connection = self.upper_container.server.connections[client.endpoint]
+            for i in range(200):
+                if connection.explicit_heartbeat_count:
+                    break
+                await asyncio.sleep(0.01)
+            return connection.explicit_heartbeat_count
+
+        with mock.patch.object(aio_client.logger, 'warning') as warning:
+            self.assertTrue(self.run_client(call))
+        self.assertFalse(warning.called)
+
+    def test_registry_greenlets_keep_running(self):
+        registry_thread = aio_client.RegistryThread()
+        ran = threading.Event()
+        registry_thread.call(gevent.spawn_later, 0.01, ran.set)
+        self.assertTrue(ran.wait(1))
+        registry_thread.stop()
+
+
+class ZookeeperAsyncClientTest(AsyncClientTest):
+    use_zookeeper = True
+
+    def create_registry(self, **kwargs):
+        zkclient = KazooClient(self.hosts, handler=SequentialGeventHandler())
+        return ZookeeperServiceRegistry(zkclient)
+
+    def create_async_client(self):
+        # The kazoo handler belongs to the hub of the thread it's created in.
+        registry_thread = aio_client.RegistryThread()
+        return AsyncClient(registry_thread.call(self.create_registry), registry_thread=registry_thread)
+
+    def test_lookups_follow_registry_changes(self):
+        looked_up = threading.Event()
+
+        async def lookup(client):
+            service = await client.lookup('upper')
+            looked_up.set()
+            for i in range(200):
+                if not len(service):
+                    break
+                await asyncio.sleep(0.01)
+            return len(service)
+
+        def stop_upper():
+            while not looked_up.is_set():
+                gevent.sleep(0.01)
+            self.upper_container.stop()
+
+        gevent.spawn(stop_upper)
+        self.assertEqual(self.run_client(lookup), 0)
@@ -0,0 +1,8 @@
+import sys
+import unittest
+
+if sys.version_info < (3, 5):
+    raise unittest.SkipTest('lymph.aio requires Python 3.5+')
+
+# The tests use async/await, which older versions cannot even parse.
+from lymph.tests.integration.aio_cases import AsyncClientTest  # noqa
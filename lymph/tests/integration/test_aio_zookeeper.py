@@ -0,0 +1,7 @@
+import sys
+import unittest
+
+if sys.version_info < (3, 5):
+    raise unittest.SkipTest('lymph.aio requires Python 3.5+')
+
+from lymph.tests.integration.aio_cases import ZookeeperAsyncClientTest  # noqa
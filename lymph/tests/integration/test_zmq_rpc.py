@@ -0,0 +1,195 @@
+import mock
+
+from lymph.core import connection
+from lymph.core.container import ServiceContainer
+from lymph.core.decorators import rpc
+from lymph.core.interfaces import Interface
+from lymph.core.messages import Message
+from lymph.core.monitoring.aggregator import Aggregator
+from lymph.core.rpc import ZmqRPCServer
+from lymph.core.workers import RPCFrontend, WorkerRPCServer
+from lymph.discovery.static import StaticServiceRegistryHub
+from lymph.events.null import NullEventSystem
+from lymph.testing import LymphIntegrationTestCase, AsyncTestsMixin
+from lymph.utils.gpool import RejectExcecutionError
+from lymph.utils.sockets import get_unused_port
+
+
+class Echo(Interface):
+    @rpc()
+    def echo(self, payload=None):
+        return payload
+
+    @rpc()
+    def relay(self, payload=None):
+        return self.proxy('echo').echo(payload=payload)
+
+    @rpc()
+    def whoami(self):
+        return self.container.server.index
+
+    @rpc()
+    def repeat(self, payload=None, n=1):
+        for i in range(n):
+            yield payload
+
+
+class ZmqRPCTestCase(LymphIntegrationTestCase):
+    rpc_config = {}
+
+    def setUp(self):
+        super(ZmqRPCTestCase, self).setUp()
+        self.hub = StaticServiceRegistryHub()
+        self.events = NullEventSystem()
+        self.echo_container, interface = self.create_container(Echo, 'echo')
+        self.client_container, self.client = self.create_container()
+
+    def create_registry(self, **kwargs):
+        return self.hub.create_registry()
+
+    def create_container(self, interface_cls=None, interface_name=None, rpc=None, register=True, **kwargs):
+        container = ServiceContainer(
+            events=self.events,
+            registry=self.create_registry(),
+            rpc=rpc or ZmqRPCServer(**self.rpc_config),
+            metrics=Aggregator(),
+            **kwargs)
+        interface = container.install_interface(interface_cls or Interface, name=interface_name)
+        container.start(register=register)
+        self._containers.append(container)
+        return container, interface
+
+
+class ZmqRPCTest(ZmqRPCTestCase):
+    def test_request(self):
+        reply = self.client.request('echo', 'echo.echo', {'payload': 'foo'})
+        self.assertEqual(reply.body, 'foo')
+
+    def test_stream(self):
+        proxy = self.client.proxy('echo', stream_credit=8)
+        self.assertEqual(list(proxy.repeat.stream(payload='foo', n=50)), ['foo'] * 50)
+
+    def test_nacks_do_not_wait_for_connections(self):
+        server = self.echo_container.server
+        # Nothing listens on the source endpoint, the connection is never established.
+        source = 'tcp://127.0.0.1:%s' % get_unused_port()
+        request = Message(Message.REQ, 'echo.echo', body={}, source=source)
+        with mock.patch.object(connection.Connection, 'wait_ready', side_effect=AssertionError):
+            with mock.patch.object(server, '_get_request_pool', side_effect=RejectExcecutionError('full')):
+                server.recv_message(request)
+        self.assertEqual(list(server.rejected_counts), [('rpc.rejected', 1, {'subject': 'echo.echo'})])
+
+    def test_ping_replies_do_not_wait_for_connections(self):
+        server = self.echo_container.server
+        source = 'tcp://127.0.0.1:%s' % get_unused_port()
+        ping = Message(Message.REQ, '_ping', body=None, source=source)
+        with mock.patch.object(connection.Connection, 'wait_ready', side_effect=AssertionError):
+            server.recv_message(ping)
+
+
+class LocalDispatchTest(ZmqRPCTest):
+    rpc_config = {'local_dispatch': True}
+
+    def test_relay(self):
+        reply = self.client.request('echo', 'echo.relay', {'payload': 'foo'})
+        self.assertEqual(reply.body, 'foo')
+        self.assertIn(('rpc.local', 1, {'subject': 'echo.echo'}), list(self.echo_container.server.local_counts))
+
+
+class IPCTest(ZmqRPCTest):
+    rpc_config = {'ipc': True}
+
+    def test_same_host_peers_use_ipc(self):
+        reply = self.client.request('echo', 'echo.echo', {'payload': 'foo'})
+        self.assertEqual(reply.body, 'foo')
+        echo_server, client_server = self.echo_container.server, self.client_container.server
+        self.assertTrue(echo_server.ipc_endpoint.startswith('ipc://'))
+        self.assertEqual(list(self.client_container.lookup('echo'))[0].ipc_endpoint, echo_server.ipc_endpoint)
+        self.assertEqual(client_server.connections[echo_server.endpoint].address, echo_server.ipc_endpoint)
+        self.assertEqual(echo_server.connections[client_server.endpoint].address, client_server.ipc_endpoint)
+
+
+class PrewarmTest(ZmqRPCTestCase, AsyncTestsMixin):
+    def get_connections(self):
+        return self.client_container.server.connections
+
+    def test_first_request_waits_for_connection(self):
+        reply = self.client.request('echo', 'echo.echo', {'payload': 'foo'})
+        self.assertEqual(reply.body, 'foo')
+        self.assertTrue(self.get_connections()[self.echo_container.endpoint].ready.is_set())
+
+    def test_proxies_connect_to_all_instances(self):
+        self.client.proxy('echo')
+        self.assert_eventually_true(lambda: self.echo_container.endpoint in self.get_connections())
+        conn = self.get_connections()[self.echo_container.endpoint]
+        self.assert_eventually_true(lambda: conn.status == connection.RESPONSIVE)
+        container, interface = self.create_container(Echo, 'echo')
+        # the static registry doesn't push updates, look the service up again
+        self.client_container.service_registry.lookup(self.client_container.lookup('echo'))
+        self.assertIn(container.endpoint, self.get_connections())
+
+    def test_prewarmed_connections_are_not_reaped_when_idle(self):
+        self.client_container.server.connection_config = {'idle_disconnect': 0}
+        self.client.proxy('echo')
+        self.assert_eventually_true(lambda: self.echo_container.endpoint in self.get_connections())
+        conn = self.get_connections()[self.echo_container.endpoint]
+        self.assertIsNone(conn.should_disconnect())
+
+
+class ZeroCopyTest(ZmqRPCTestCase):
+    rpc_config = {'zero_copy': True}
+
+    def test_large_body(self):
+        payload = b'x' * 500000
+        reply = self.client.request('echo', 'echo.echo', {'payload': payload})
+        self.assertEqual(reply.body, payload)
+
+    def test_relayed_body(self):
+        payload = b'y' * 500000
+        reply = self.client.request('echo', 'echo.relay', {'payload': payload})
+        self.assertEqual(reply.body, payload)
+
+
+class WorkersTest(ZmqRPCTestCase, AsyncTestsMixin):
+    def setUp(self):
+        super(WorkersTest, self).setUp()
+        endpoint = 'tcp://127.0.0.1:%s' % get_unused_port()
+        self.frontend = RPCFrontend(endpoint, 'inproc://lymph-workers', 2)
+        self.frontend.start()
+        self.workers = []
+        for index in range(2):
+            container, interface = self.create_container(
+                Echo, 'workers', rpc=WorkerRPCServer(frontend=endpoint, backend='inproc://lymph-workers', index=index), register=not index)
+            self.workers.append(container)
+
+    def tearDown(self):
+        super(WorkersTest, self).tearDown()
+        self.frontend.stop()
+
+    def test_workers_share_endpoint_and_identity(self):
+        self.assertEqual(len(self.client_container.lookup('workers')), 1)
+        self.assertEqual(self.workers[0].identity, self.workers[1].identity)
+
+    def test_requests_are_spread_over_workers(self):
+        proxy = self.client.proxy('workers')
+        served = set(proxy.whoami() for i in range(20))
+        self.assertEqual(served, {0, 1})
+
+    def test_worker_requests(self):
+        proxy = self.client.proxy('workers')
+        for i in range(10):
+            self.assertEqual(proxy.relay(payload=i), i)
+
+    def test_workers_dont_send_heartbeats(self):
+        proxy = self.client.proxy('workers')
+        for i in range(4):
+            proxy.relay(payload=i)
+        for worker in self.workers:
+            for conn in worker.server.connections.values():
+                self.assertEqual(conn.heartbeat_interval, 0)
+            self.assertEqual(len(worker.server.heartbeats), 0)
+
+    def test_stream(self):
+        proxy = self.client.proxy('workers', stream_credit=4)
+        for i in range(4):
+            self.assertEqual(list(proxy.repeat.stream(payload=i, n=20)), [i] * 20)
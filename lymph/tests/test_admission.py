@@ -0,0 +1,92 @@
+import gevent
+
+import lymph
+from lymph.core.interfaces import Interface
+from lymph.core.trace import AdaptiveGroup, Group
+from lymph.exceptions import Nack
+from lymph.testing import MultiServiceRPCTestCase
+
+
+class Sleepy(Interface):
+    @lymph.rpc()
+    def sleep(self, seconds=0):
+        gevent.sleep(seconds)
+        return seconds
+
+
+class AdmissionTestCase(MultiServiceRPCTestCase):
+    containers = [
+        {'sleepy': {'class': Sleepy}},
+    ]
+
+    def setUp(self):
+        super(AdmissionTestCase, self).setUp()
+        container = list(self.network.service_containers.values())[0]
+        self.server = container.server
+        self.server.request_pool = AdaptiveGroup(initial_limit=1, max_limit=1)
+
+
+class AdmissionControlTest(AdmissionTestCase):
+
+    def test_requests_over_limit_are_nacked(self):
+        proxy = self.client.proxy('sleepy')
+        slow = gevent.spawn(proxy.sleep, seconds=0.1)
+        gevent.sleep(0)
+        with self.assertRaises(Nack):
+            proxy.sleep()
+        self.assertEqual(slow.get(), 0.1)
+        self.assertEqual(proxy.sleep(), 0)
+        self.assertEqual(dict(
+            (name, value) for name, value, tags in self.server.rejected_counts
+        ), {'rpc.rejected': 1})
+
+    def test_queue_time_is_recorded(self):
+        self.client.proxy('sleepy').sleep()
+        self.assertIsNotNone(self.server.queue_time.value)
+
+
+class PriorityTest(AdmissionTestCase):
+    def start_slow_request(self):
+        slow = gevent.spawn(self.client.proxy('sleepy').sleep, seconds=0.1)
+        gevent.sleep(0)
+        return slow
+
+    def test_critical_requests_skip_admission_control(self):
+        slow = self.start_slow_request()
+        self.assertEqual(self.client.proxy('sleepy', priority='critical').sleep(), 0)
+        self.assertEqual(slow.get(), 0.1)
+
+    def test_pings_skip_admission_control(self):
+        slow = self.start_slow_request()
+        channel = self.client.container.server.ping(self.server.endpoint)
+        self.assertEqual(channel.get().body, '')
+        self.assertEqual(slow.get(), 0.1)
+
+    def test_batch_requests_are_shed_first(self):
+        self.server.request_pool = AdaptiveGroup(initial_limit=2, max_limit=2)
+        self.server.batch_limit = 0.5
+        slow = self.start_slow_request()
+        with self.assertRaises(Nack):
+            self.client.proxy('sleepy', priority='batch').sleep()
+        self.assertEqual(self.client.proxy('sleepy').sleep(), 0)
+        self.assertEqual(slow.get(), 0.1)
+        self.assertEqual(self.client.proxy('sleepy', priority='batch').sleep(), 0)
+
+    def test_control_priority_is_only_honored_for_pings(self):
+        slow = self.start_slow_request()
+        channel = self.client.container.send_request('sleepy', 'sleepy.sleep', {}, headers={'priority': 'control'})
+        self.assertRaises(Nack, channel.get)
+        self.assertEqual(slow.get(), 0.1)
+
+    def test_proxies_reject_unknown_priorities(self):
+        self.assertRaises(ValueError, self.client.proxy, 'sleepy', priority='control')
+
+    def test_critical_limit(self):
+        self.server.critical_pool = Group(size=1)
+        proxy = self.client.proxy('sleepy', priority='critical')
+        slow = gevent.spawn(proxy.sleep, seconds=0.1)
+        gevent.sleep(0)
+        with self.assertRaises(Nack):
+            proxy.sleep()
+        self.assertEqual(slow.get(), 0.1)
+        self.assertEqual(proxy.sleep(), 0)
@@ -0,0 +1,71 @@
+import time
+
+import lymph
+from lymph.core import trace
+from lymph.core.interfaces import Interface
+from lymph.exceptions import Timeout
+from lymph.testing import MultiServiceRPCTestCase
+
+
+class Inner(Interface):
+    calls = 0
+
+    @lymph.rpc()
+    def deadline(self):
+        Inner.calls += 1
+        return trace.get_deadline()
+
+
+class Outer(Interface):
+    inner = lymph.proxy('inner', timeout=10)
+
+    @lymph.rpc()
+    def deadline(self):
+        return trace.get_deadline(), self.inner.deadline()
+
+    @lymph.rpc()
+    def raw_deadline(self):
+        channel = self.container.send_request('inner', 'inner.deadline', {})
+        return trace.get_deadline(), channel.get().body
+
+
+class DeadlinePropagationTest(MultiServiceRPCTestCase):
+    containers = [
+        {'inner': {'class': Inner}},
+        {'outer': {'class': Outer}},
+    ]
+
+    def setUp(self):
+        super(DeadlinePropagationTest, self).setUp()
+        Inner.calls = 0
+
+    def tearDown(self):
+        trace.set_deadline(None)
+        super(DeadlinePropagationTest, self).tearDown()
+
+    def test_nested_calls_inherit_the_deadline(self):
+        start = time.time()
+        outer, inner = self.client.proxy('outer', timeout=2).deadline()
+        self.assertAlmostEqual(outer, start + 2, delta=0.5)
+        self.assertEqual(inner, outer)
+
+    def test_raw_requests_inherit_the_deadline(self):
+        outer, inner = self.client.proxy('outer').raw_deadline()
+        self.assertEqual(inner, outer)
+
+    def test_expired_requests_are_dropped(self):
+        channel = self.client.container.send_request('inner', 'inner.deadline', {}, headers={'deadline': time.time() - 1})
+        with self.assertRaises(Timeout):
+            channel.get(timeout=0.1)
+        self.assertEqual(Inner.calls, 0)
+        instance = list(self.client.container.lookup('inner'))[0]
+        server = self.network.service_containers[instance.endpoint].server
+        self.assertEqual(dict(
+            (name, value) for name, value, tags in server.expired_counts
+        ), {'rpc.expired': 1})
+
+    def test_no_request_is_sent_after_the_deadline(self):
+        trace.set_deadline(time.time() - 1)
+        with self.assertRaises(Timeout):
+            self.client.proxy('inner').deadline()
+        self.assertEqual(Inner.calls, 0)
@@ -0,0 +1,59 @@
+import time
+
+import gevent
+
+import lymph
+from lymph.core.hedging import HedgingPolicy
+from lymph.core.interfaces import Interface
+from lymph.testing import MultiServiceRPCTestCase
+
+
+class Echo(Interface):
+    @lymph.rpc()
+    def echo(self, text=None):
+        gevent.sleep(self.config.get('delay', 0))
+        return text
+
+
+class HedgingPolicyTest(MultiServiceRPCTestCase):
+    containers = [
+        {'echo': {'class': Echo, 'delay': 0.5}},
+        {'echo': {'class': Echo, 'delay': 0}},
+    ]
+
+    def create_policy(self, **kwargs):
+        policy = HedgingPolicy(min_samples=5, percentile=50, **kwargs)
+        for i in range(5):
+            policy.add_sample('echo.echo', 0.01)
+        return policy
+
+    def test_slow_instances_are_hedged(self):
+        policy = self.create_policy(budget=1)
+        proxy = self.client.proxy('echo', balancer='round_robin', hedging=policy)
+        for i in range(4):
+            start = time.monotonic()
+            self.assertEqual(proxy.echo(text='foo'), 'foo')
+            self.assertLess(time.monotonic() - start, 0.3)
+        self.assertGreater(policy.hedged_total, 0)
+
+    def test_hedge_budget(self):
+        policy = self.create_policy(budget=0)
+        proxy = self.client.proxy('echo', balancer='round_robin', hedging=policy)
+        for i in range(2):
+            self.assertEqual(proxy.echo(text='foo'), 'foo')
+        self.assertEqual(policy.hedged_total, 0)
+
+    def test_no_hedging_without_samples(self):
+        policy = HedgingPolicy(budget=1)
+        self.assertIsNone(policy.get_delay('echo.echo'))
+        proxy = self.client.proxy('echo', hedging=policy)
+        self.assertEqual(proxy.echo(text='foo'), 'foo')
+        self.assertEqual(policy.hedged_total, 0)
+
+    def test_request_hedging_options(self):
+        for hedging in (True, True, {'min_samples': 5}):
+            reply = self.client.request('echo', 'echo.echo', {'text': 'foo'}, hedging=hedging)
+            self.assertEqual(reply.body, 'foo')
+        policy = self.client._get_hedging_policy(True)
+        self.assertEqual(len(policy.samples['echo.echo']), 2)
+        self.assertEqual(self.client._get_hedging_policy({'min_samples': 5}).min_samples, 5)
@@ -0,0 +1,67 @@
+import mock
+
+import lymph
+from lymph.core.interfaces import Interface
+from lymph.core.messages import Message
+from lymph.exceptions import Nack, RemoteError
+from lymph.testing import RPCServiceTestCase
+
+
+class Local(Interface):
+    items = None
+
+    @lymph.rpc()
+    def echo(self, items):
+        Local.items = items
+        return items
+
+    @lymph.rpc(raises=(KeyError,))
+    def fail(self):
+        raise KeyError('foo')
+
+
+class LocalDispatchTest(RPCServiceTestCase):
+    service_class = Local
+    service_name = 'local'
+
+    def setUp(self):
+        super(LocalDispatchTest, self).setUp()
+        self.container.server.local_dispatch = {}
+
+    def test_requests_skip_serialization(self):
+        with mock.patch.object(Message, 'pack_frames', side_effect=AssertionError):
+            self.assertEqual(self.client.echo(items=[1, 2]), [1, 2])
+        self.assertIn(('rpc.local', 1, {'subject': 'local.echo'}), list(self.container.server.local_counts))
+
+    def test_bodies_are_shared(self):
+        items = [1, 2]
+        self.assertIs(self.client.echo(items=items), items)
+        self.assertIs(Local.items, items)
+
+    def test_bodies_are_copied(self):
+        self.container.server.local_dispatch['copy'] = True
+        items = [1, 2]
+        reply = self.client.echo(items=items)
+        self.assertEqual(reply, items)
+        self.assertIsNot(reply, items)
+        self.assertIsNot(Local.items, items)
+
+    def test_requests_are_spawned_once(self):
+        server = self.container.server
+        with mock.patch.object(server, '_spawn_in', wraps=server._spawn_in) as spawn_in:
+            self.assertEqual(self.client.echo(items=[1]), [1])
+        self.assertEqual(
+            [c[0][1] for c in spawn_in.call_args_list if c[0][0] is server.pool],
+            [server._dispatch_local_request],
+        )
+
+    def test_errors(self):
+        with self.assertRaises(RemoteError.KeyError):
+            self.client.fail()
+        with self.assertRaises(Nack):
+            self.request('local.missing', {})
+
+    def test_disabled_by_default(self):
+        self.container.server.local_dispatch = None
+        with mock.patch.object(Message, 'pack_frames', side_effect=AssertionError):
+            self.assertRaises(AssertionError, self.client.echo, items=[1])
@@ -85,6 +85,16 @@ class BasicMockTest(RPCServiceTestCase):
         with self.assertRaises(Nack):
             self.client.auto_nack()
 
+    def test_routes_are_cached(self):
+        self.client.upper(text='foo')
+        self.assertEqual(self.container.routes[('upper.upper', None)], (self.service, 'upper'))
+        routes = set(self.container.routes)
+        with self.assertRaises(Nack):
+            self.request('upper.missing', {})
+        with self.assertRaises(Nack):
+            self.request('missing.upper', {})
+        self.assertEqual(set(self.container.routes), routes)
+
     def test_events(self):
         log = self.service.eventlog
         self.assertEqual(log, [])
@@ -0,0 +1,66 @@
+import mock
+
+import lymph
+from lymph.core.interfaces import Interface
+from lymph.testing import MultiServiceRPCTestCase
+
+
+class Users(Interface):
+    calls = 0
+
+    @lymph.rpc()
+    def get(self, user_id):
+        Users.calls += 1
+        return {'id': user_id, 'tags': ['a']}
+
+
+class ProxyCacheTest(MultiServiceRPCTestCase):
+    containers = [
+        {'users': {'class': Users}},
+    ]
+
+    def setUp(self):
+        super(ProxyCacheTest, self).setUp()
+        Users.calls = 0
+
+    def test_replies_are_cached(self):
+        proxy = self.client.proxy('users', cache={'max_entries': 10})
+        user = proxy.get(user_id=1)
+        user['tags'].append('b')
+        self.assertEqual(proxy.get(user_id=1), {'id': 1, 'tags': ['a']})
+        self.assertEqual(Users.calls, 1)
+        proxy.get(user_id=2)
+        self.assertEqual(Users.calls, 2)
+
+    def test_ttl(self):
+        proxy = self.client.proxy('users', cache={'ttl': -1})
+        proxy.get(user_id=1)
+        proxy.get(user_id=1)
+        self.assertEqual(Users.calls, 2)
+
+    def test_invalidation_by_event(self):
+        proxy = self.client.proxy('users', cache={'invalidate_on': ['user_changed']})
+        proxy.get(user_id=1)
+        proxy.get(user_id=1)
+        self.assertEqual(Users.calls, 1)
+        self.client.emit('user_changed', {'id': 1})
+        proxy.get(user_id=1)
+        self.assertEqual(Users.calls, 2)
+
+    def test_uncached_proxy(self):
+        proxy = self.client.proxy('users')
+        proxy.get(user_id=1)
+        proxy.get(user_id=1)
+        self.assertEqual(Users.calls, 2)
+
+    def test_invalidation_handlers_are_shared(self):
+        with mock.patch.object(self.client.container, 'subscribe', wraps=self.client.container.subscribe) as subscribe:
+            proxies = [self.client.proxy('users', cache={'invalidate_on': ['user_changed']}) for i in range(3)]
+        self.assertEqual(subscribe.call_count, 1)
+        for proxy in proxies:
+            proxy.get(user_id=1)
+        self.assertEqual(Users.calls, 3)
+        self.client.emit('user_changed', {'id': 1})
+        for proxy in proxies:
+            proxy.get(user_id=1)
+        self.assertEqual(Users.calls, 6)
@@ -0,0 +1,102 @@
+import time
+import unittest
+
+import gevent
+
+import lymph
+from lymph.core import trace
+from lymph.core.decorators import _Batcher
+from lymph.core.interfaces import Interface
+from lymph.exceptions import RemoteError, Timeout
+from lymph.testing import RPCServiceTestCase
+
+
+class Users(Interface):
+    batches = []
+
+    @lymph.rpc(batch=True, max_batch=4, max_wait_ms=20, raises=(KeyError,))
+    def get(self, calls):
+        Users.batches.append(calls)
+        return [
+            KeyError(call['user_id']) if call['user_id'] < 0 else {'id': call['user_id']}
+            for call in calls
+        ]
+
+
+class RPCBatchTest(RPCServiceTestCase):
+    service_class = Users
+
+    def setUp(self):
+        super(RPCBatchTest, self).setUp()
+        Users.batches = []
+
+    def get_metrics(self):
+        return dict(
+            (name, value) for name, value, tags in self.container.metrics
+            if name.startswith('rpc.batch.')
+        )
+
+    def call_concurrently(self, user_ids):
+        proxy = self.get_proxy()
+        greenlets = [gevent.spawn(proxy.get, user_id=user_id) for user_id in user_ids]
+        gevent.joinall(greenlets)
+        return greenlets
+
+    def test_concurrent_calls_are_batched(self):
+        greenlets = self.call_concurrently([1, 2, 3])
+        self.assertEqual([g.value for g in greenlets], [{'id': 1}, {'id': 2}, {'id': 3}])
+        self.assertEqual(Users.batches, [[{'user_id': 1}, {'user_id': 2}, {'user_id': 3}]])
+        self.assertEqual(self.get_metrics(), {'rpc.batch.count': 1, 'rpc.batch.calls': 3})
+
+    def test_max_batch(self):
+        greenlets = self.call_concurrently(range(10))
+        self.assertEqual([g.value for g in greenlets], [{'id': i} for i in range(10)])
+        self.assertEqual([len(calls) for calls in Users.batches], [4, 4, 2])
+
+    def test_single_call(self):
+        self.assertEqual(self.get_proxy().get(user_id=7), {'id': 7})
+        self.assertEqual(Users.batches, [[{'user_id': 7}]])
+
+    def test_failed_call(self):
+        greenlets = self.call_concurrently([1, -1])
+        self.assertEqual(greenlets[0].value, {'id': 1})
+        self.assertIsInstance(greenlets[1].exception, RemoteError.KeyError)
+
+
+class BatcherTest(unittest.TestCase):
+    def create_batcher(self, func=None, max_wait=0.05):
+        return _Batcher(func or (lambda interface, calls: [call['x'] for call in calls]), max_batch=10, max_wait=max_wait)
+
+    def test_killed_first_caller(self):
+        batcher = self.create_batcher(max_wait=1)
+        first = gevent.spawn(batcher.call, None, {'x': 1})
+        gevent.sleep(0)
+        follower = gevent.spawn(batcher.call, None, {'x': 2})
+        gevent.sleep(0)
+        first.kill()
+        follower.join(0.1)
+        self.assertIsInstance(follower.exception, Timeout)
+        self.assertIsNone(batcher.pending)
+
+    def test_cancelled_batch(self):
+        def cancel(interface, calls):
+            raise gevent.GreenletExit()
+        batcher = self.create_batcher(cancel)
+        greenlets = [gevent.spawn(batcher.call, None, {'x': x}) for x in range(2)]
+        gevent.joinall(greenlets, timeout=1)
+        self.assertIsInstance(greenlets[1].exception, Timeout)
+
+    def test_followers_wait_until_their_deadline(self):
+        def slow(interface, calls):
+            gevent.sleep(1)
+            return [None] * len(calls)
+        batcher = self.create_batcher(slow, max_wait=0.01)
+
+        def follow():
+            trace.set_deadline(time.time() + 0.05)
+            return batcher.call(None, {'x': 2})
+        gevent.spawn(batcher.call, None, {'x': 1})
+        gevent.sleep(0)
+        follower = gevent.spawn(follow)
+        follower.join(0.5)
+        self.assertIsInstance(follower.exception, Timeout)
@@ -0,0 +1,69 @@
+import gevent
+
+import lymph
+from lymph.core.interfaces import Interface, RequestBatch
+from lymph.core.messages import Message
+from lymph.testing import RPCServiceTestCase
+from lymph.exceptions import RemoteError
+
+
+class Upper(Interface):
+    @lymph.rpc()
+    def upper(self, text=None):
+        return text.upper()
+
+    @lymph.rpc(raises=(ValueError,))
+    def fail(self):
+        raise ValueError('foobar')
+
+
+class BatchingTest(RPCServiceTestCase):
+    service_class = Upper
+    service_name = 'upper'
+
+    def setUp(self):
+        super(BatchingTest, self).setUp()
+        self.sent_batches = []
+        send_messages = self.container.server._send_messages
+
+        def recording_send_messages(endpoint, msgs, **kwargs):
+            self.sent_batches.append([msg.subject for msg in msgs if msg.is_request()])
+            return send_messages(endpoint, msgs, **kwargs)
+        self.container.server._send_messages = recording_send_messages
+
+    def test_pack_and_unpack_batch(self):
+        msgs = [Message(Message.REQ, 'upper.upper', body={'text': text}) for text in 'abc']
+        frames = [b'mock://127.0.0.1:1'] + Message.pack_batch(msgs)
+        unpacked = Message.unpack_batch(frames)
+        self.assertEqual([msg.id for msg in unpacked], [msg.id for msg in msgs])
+        self.assertEqual([msg.body for msg in unpacked], [{'text': 'a'}, {'text': 'b'}, {'text': 'c'}])
+        self.assertRaises(ValueError, Message.unpack_batch, frames[:-1])
+
+    def test_explicit_batch(self):
+        with RequestBatch(self.client) as batch:
+            calls = [batch.upper(text=text) for text in ('foo', 'bar', 'baz')]
+        self.assertEqual([call.get() for call in calls], ['FOO', 'BAR', 'BAZ'])
+        self.assertIn(['upper.upper'] * 3, self.sent_batches)
+
+    def test_batch_errors_are_raised_per_call(self):
+        with RequestBatch(self.client) as batch:
+            ok = batch.upper(text='foo')
+            fail = batch.fail()
+        self.assertRaises(RemoteError.ValueError, fail.get)
+        self.assertEqual(ok.get(), 'FOO')
+
+    def test_batch_window(self):
+        proxy = self.get_proxy(batch_window=0.01)
+        greenlets = [gevent.spawn(proxy.upper, text=text) for text in ('foo', 'bar')]
+        gevent.joinall(greenlets, raise_error=True)
+        self.assertEqual([g.value for g in greenlets], ['FOO', 'BAR'])
+        self.assertIn(['upper.upper'] * 2, self.sent_batches)
+
+    def test_no_batches_for_instances_without_batching(self):
+        for instance in self.container.lookup('upper'):
+            del instance.info['batching']
+        with RequestBatch(self.client) as batch:
+            calls = [batch.upper(text=text) for text in ('foo', 'bar')]
+        self.assertEqual([call.get() for call in calls], ['FOO', 'BAR'])
+        self.assertIn(['upper.upper'], self.sent_batches)
+        self.assertNotIn(['upper.upper'] * 2, self.sent_batches)
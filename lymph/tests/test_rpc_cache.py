@@ -0,0 +1,55 @@
+import lymph
+from lymph.core.interfaces import Interface
+from lymph.testing import RPCServiceTestCase
+
+
+class Lookup(Interface):
+    calls = 0
+
+    @lymph.rpc(cache=60, max_entries=2)
+    def get(self, key, options=None):
+        Lookup.calls += 1
+        return {'key': key, 'options': options}
+
+
+class RPCCacheTest(RPCServiceTestCase):
+    service_class = Lookup
+
+    def setUp(self):
+        super(RPCCacheTest, self).setUp()
+        Lookup.calls = 0
+
+    def get_metrics(self):
+        return dict(
+            (name, value) for name, value, tags in self.container.metrics
+            if name.startswith('rpc.cache.')
+        )
+
+    def test_repeated_calls_are_cached(self):
+        proxy = self.get_proxy()
+        for i in range(3):
+            self.assertEqual(proxy.get(key='a', options={'x': 1, 'y': [1, 2]}), {'key': 'a', 'options': {'x': 1, 'y': [1, 2]}})
+        self.assertEqual(Lookup.calls, 1)
+        self.assertEqual(proxy.get(key='b'), {'key': 'b', 'options': None})
+        self.assertEqual(Lookup.calls, 2)
+        self.assertEqual(self.get_metrics(), {
+            'rpc.cache.hits': 2,
+            'rpc.cache.misses': 2,
+            'rpc.cache.evictions': 0,
+            'rpc.cache.size': 2,
+        })
+
+    def test_eviction(self):
+        proxy = self.get_proxy()
+        for key in 'abca':
+            proxy.get(key=key)
+        self.assertEqual(Lookup.calls, 4)
+        self.assertEqual(self.get_metrics()['rpc.cache.evictions'], 2)
+
+    def test_arguments_of_different_types_are_cached_separately(self):
+        proxy = self.get_proxy()
+        self.assertEqual(proxy.get(key='a', options=1), {'key': 'a', 'options': 1})
+        self.assertIs(proxy.get(key='a', options=True)['options'], True)
+        self.assertEqual(proxy.get(key='a', options={'x': 1}), {'key': 'a', 'options': {'x': 1}})
+        self.assertEqual(proxy.get(key='a', options=[['x', 1]]), {'key': 'a', 'options': [['x', 1]]})
+        self.assertEqual(Lookup.calls, 4)
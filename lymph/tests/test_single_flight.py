@@ -0,0 +1,70 @@
+import gevent
+
+import lymph
+from lymph.core.interfaces import Interface
+from lymph.exceptions import RemoteError, Timeout
+from lymph.testing import MultiServiceRPCTestCase
+
+
+class Backend(Interface):
+    calls = 0
+
+    @lymph.rpc(raises=(KeyError,))
+    def get(self, key):
+        Backend.calls += 1
+        gevent.sleep(0.05)
+        if key == 'missing':
+            raise KeyError(key)
+        return {'key': key}
+
+
+class SingleFlightTest(MultiServiceRPCTestCase):
+    containers = [
+        {'backend': {'class': Backend}},
+    ]
+
+    def setUp(self):
+        super(SingleFlightTest, self).setUp()
+        Backend.calls = 0
+
+    def test_concurrent_calls_are_coalesced(self):
+        proxy = self.client.proxy('backend', single_flight=True)
+        calls = [gevent.spawn(proxy.get, key='a') for i in range(5)]
+        calls.append(gevent.spawn(proxy.get, key='b'))
+        gevent.joinall(calls)
+        self.assertEqual([call.value for call in calls], [{'key': 'a'}] * 5 + [{'key': 'b'}])
+        self.assertEqual(Backend.calls, 2)
+        self.assertEqual(list(proxy.coalesced_counts), [('rpc.coalesced_count', 4, {'address': 'backend'})])
+        proxy.get(key='a')
+        self.assertEqual(Backend.calls, 3)
+
+    def test_errors_are_shared(self):
+        proxy = self.client.proxy('backend', single_flight=True)
+        calls = [gevent.spawn(proxy.get, key='missing') for i in range(3)]
+        gevent.joinall(calls)
+        for call in calls:
+            self.assertIsInstance(call.exception, RemoteError.KeyError)
+        self.assertEqual(Backend.calls, 1)
+
+    def test_cancelled_calls_release_followers(self):
+        proxy = self.client.proxy('backend', single_flight=True)
+        leader = gevent.spawn(gevent.with_timeout, 0.01, proxy.get, key='a', timeout_value='cancelled')
+        gevent.sleep(0)
+        follower = gevent.spawn(proxy.get, key='a')
+        gevent.joinall([leader, follower], timeout=1)
+        self.assertEqual(leader.value, 'cancelled')
+        self.assertIsInstance(follower.exception, Timeout)
+
+    def test_followers_wait_until_their_deadline(self):
+        proxy = self.client.proxy('backend', single_flight=True)
+        leader = gevent.spawn(proxy.get, key='a')
+        gevent.sleep(0)
+        proxy._timeout = 0.01
+        self.assertRaises(Timeout, proxy.get, key='a')
+        leader.join()
+        self.assertEqual(leader.value, {'key': 'a'})
+
+    def test_calls_are_not_coalesced_by_default(self):
+        proxy = self.client.proxy('backend')
+        gevent.joinall([gevent.spawn(proxy.get, key='a') for i in range(3)])
+        self.assertEqual(Backend.calls, 3)
@@ -0,0 +1,81 @@
+import gevent
+
+import lymph
+from lymph.core.interfaces import Interface
+from lymph.exceptions import RemoteError
+from lymph.testing import MultiServiceRPCTestCase
+
+
+class Export(Interface):
+    produced = 0
+    closed = False
+
+    @lymph.rpc()
+    def numbers(self, n):
+        try:
+            for i in range(n):
+                Export.produced += 1
+                yield i
+        finally:
+            Export.closed = True
+
+    @lymph.rpc(raises=(ValueError,))
+    def broken(self):
+        yield 1
+        raise ValueError('broken')
+
+    @lymph.rpc()
+    def whole(self):
+        return [1, 2, 3]
+
+
+class StreamingTest(MultiServiceRPCTestCase):
+    containers = [
+        {'export': {'class': Export}},
+    ]
+
+    def setUp(self):
+        super(StreamingTest, self).setUp()
+        Export.produced = 0
+        Export.closed = False
+
+    def test_stream(self):
+        proxy = self.client.proxy('export', stream_credit=4)
+        self.assertEqual(list(proxy.numbers.stream(n=100)), list(range(100)))
+        self.assertTrue(Export.closed)
+
+    def test_plain_call_to_streaming_method(self):
+        proxy = self.client.proxy('export')
+        self.assertEqual(proxy.numbers(n=3), [0, 1, 2])
+
+    def test_stream_of_plain_method(self):
+        proxy = self.client.proxy('export')
+        self.assertEqual(list(proxy.whole.stream()), [1, 2, 3])
+
+    def test_producer_waits_for_credit(self):
+        proxy = self.client.proxy('export', stream_credit=4)
+        stream = proxy.numbers.stream(n=100)
+        self.assertEqual(next(stream), 0)
+        gevent.sleep(0.01)
+        self.assertEqual(Export.produced, 5)
+        self.assertEqual(next(stream), 1)
+        self.assertEqual(next(stream), 2)
+        gevent.sleep(0.01)
+        self.assertEqual(Export.produced, 7)
+
+    def test_cancel(self):
+        proxy = self.client.proxy('export', stream_credit=4)
+        stream = proxy.numbers.stream(n=100)
+        self.assertEqual(next(stream), 0)
+        stream.close()
+        gevent.sleep(0.01)
+        self.assertTrue(Export.closed)
+        self.assertLess(Export.produced, 100)
+        self.assertFalse(self.client.container.server.channels)
+
+    def test_error_ends_stream(self):
+        proxy = self.client.proxy('export')
+        stream = proxy.broken.stream()
+        self.assertEqual(next(stream), 1)
+        with self.assertRaises(RemoteError.ValueError):
+            next(stream)
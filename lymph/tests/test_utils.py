@@ -34,3 +34,32 @@ class NonBlockingPoolTestCase(unittest.TestCase):
         gevent.wait(self.pool)
 
         self.assertEqual(self.pool.free_count(), 2)
+
+
+class AdaptiveLimitPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = gpool.AdaptiveLimitPool(initial_limit=2, min_limit=1, max_limit=3, latency_threshold=0.1, backoff=0.5)
+
+    def test_spawn_over_limit_should_fail(self):
+        self.pool.spawn(gevent.sleep, 0.01)
+        self.pool.spawn(gevent.sleep, 0.01)
+
+        self.assertTrue(self.pool.full())
+        with self.assertRaises(gpool.RejectExcecutionError):
+            self.pool.spawn(some_work)
+        self.assertEqual(self.pool.rejected_count, 1)
+
+    def test_fast_work_should_increase_limit(self):
+        for i in range(10):
+            self.pool.spawn(some_work)
+            gevent.wait(self.pool)
+
+        self.assertEqual(self.pool.limit, 3)
+
+    def test_slow_work_should_decrease_limit(self):
+        self.pool.spawn(gevent.sleep, 0.2)
+        gevent.wait(self.pool)
+
+        self.assertEqual(self.pool.limit, 1)
+        self.assertEqual(self.pool.free_count(), 1)
@@ -2,6 +2,7 @@ from __future__ import absolute_import, division, print_function
 
 import collections
 import importlib
+import itertools
 import gc
 import gevent
 import hashlib
@@ -45,6 +46,30 @@ def make_id():
     return uuid.uuid4().hex
 
 
+class IdGenerator(object):
+    """
+    Generates ids that are unique across processes but much cheaper than
+    random UUIDs: a random per process prefix followed by a counter. Forked
+    processes get a new prefix.
+    """
+
+    def __init__(self):
+        self.pid = None
+        self.prefix = None
+        self.counter = None
+
+    def __call__(self):
+        pid = os.getpid()
+        if pid != self.pid:
+            self.pid = pid
+            self.prefix = make_id()[:16]
+            self.counter = itertools.count()
+        return '%s%x' % (self.prefix, next(self.counter))
+
+
+make_sequential_id = IdGenerator()
+
+
 def hash_id(*bits):
     return hashlib.md5(six.text_type(bits).encode('utf-8')).hexdigest()
 
@@ -96,6 +121,23 @@ class Accumulator(object):
         return {'mean': self.mean, 'stddev': self.stddev, 'n': self.n}
 
 
+class MovingAverage(object):
+    """
+    An exponentially weighted moving average. `alpha` is the weight of
+    each new sample.
+    """
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.value = None
+
+    def add(self, value):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+
+
 class SampleWindow(Accumulator):
     def __init__(self, n=100, factor=1):
         super(SampleWindow, self).__init__()
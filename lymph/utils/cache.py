@@ -0,0 +1,74 @@
+import collections
+import time
+
+import six
+
+
+def freeze(value):
+    """
+    Returns a hashable equivalent of `value`, which may be composed of
+    dicts, lists, tuples and sets. Equal dicts are frozen to equal values
+    regardless of their item order. Containers and scalars are tagged with
+    their type, so that e.g. ``{'a': 1}``, ``{'a': 1.0}`` and ``{'a': True}``
+    are frozen to different values. Lists and tuples are frozen alike, they
+    are the same on the wire.
+    """
+    if isinstance(value, dict):
+        return ('d', tuple(sorted(
+            ((freeze(key), freeze(item)) for key, item in six.iteritems(value)),
+            key=lambda pair: repr(pair[0]),
+        )))
+    if isinstance(value, (list, tuple)):
+        return ('l', tuple(freeze(item) for item in value))
+    if isinstance(value, (set, frozenset)):
+        return ('s', frozenset(freeze(item) for item in value))
+    return (type(value), value)
+
+
+class LRUCache(object):
+    """
+    Holds up to `max_entries` values, each for at most `ttl` seconds (or
+    until evicted if `ttl` is None). When the cache is full, the least
+    recently used entry is evicted.
+    """
+
+    def __init__(self, max_entries=1000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        try:
+            expires, value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        if expires is not None and expires <= time.monotonic():
+            self.misses += 1
+            return default
+        self.entries[key] = (expires, value)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.entries.pop(key, None)
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        self.entries[key] = (expires, value)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
@@ -1,3 +1,5 @@
+import time
+
 from gevent.pool import Pool, Group
 
 from lymph.exceptions import ResourceExhausted
@@ -34,3 +36,56 @@ class NonBlockingPool(Pool):
         except:
             self._semaphore.release()
             raise
+
+
+class AdaptiveLimitPool(NonBlockingPool):
+    """A non-blocking pool with an adaptive limit on the number of
+    concurrently running greenlets. Once the limit is reached new jobs are
+    rejected by raising exc:``RejectExcecutionError``.
+
+    The limit is adjusted AIMD style: it grows by one for every ``limit``
+    greenlets that finish within ``latency_threshold`` seconds of being
+    added, and is multiplied by ``backoff`` when a greenlet takes longer
+    (at most once per ``latency_threshold`` seconds). It always stays within
+    ``min_limit`` and ``max_limit``.
+
+    """
+
+    def __init__(self, initial_limit=100, min_limit=1, max_limit=1000, latency_threshold=1, backoff=0.9, **kwargs):
+        kwargs['size'] = None
+        super(AdaptiveLimitPool, self).__init__(**kwargs)
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_threshold = latency_threshold
+        self.backoff = backoff
+        self.rejected_count = 0
+        self._started = {}
+        self._last_decrease = 0
+
+    def full(self):
+        return len(self) >= int(self.limit)
+
+    def free_count(self):
+        return max(0, int(self.limit) - len(self))
+
+    def add(self, greenlet):
+        if self.full():
+            self.rejected_count += 1
+            raise RejectExcecutionError('concurrency limit (%d) reached, cannot run %r' % (self.limit, greenlet))
+        super(AdaptiveLimitPool, self).add(greenlet)
+        self._started[greenlet] = time.monotonic()
+
+    def _discard(self, greenlet):
+        super(AdaptiveLimitPool, self)._discard(greenlet)
+        started = self._started.pop(greenlet, None)
+        if started is not None:
+            self.update_limit(time.monotonic() - started)
+
+    def update_limit(self, took):
+        now = time.monotonic()
+        if took <= self.latency_threshold:
+            self.limit = min(self.max_limit, self.limit + 1. / self.limit)
+        elif now - self._last_decrease >= self.latency_threshold:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            self._last_decrease = now
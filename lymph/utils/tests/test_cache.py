@@ -0,0 +1,37 @@
+import unittest
+
+import mock
+
+from lymph.utils.cache import LRUCache, freeze
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_ttl(self):
+        cache = LRUCache(ttl=10)
+        with mock.patch('time.monotonic', return_value=100):
+            cache.set('a', 1)
+        with mock.patch('time.monotonic', return_value=105):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('time.monotonic', return_value=110):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_freeze(self):
+        self.assertEqual(freeze({'a': [1, {'b': 2, 'c': 3}]}), freeze({'a': (1, {'c': 3, 'b': 2})}))
+        hash(freeze({'a': [1, {'b': set([2])}]}))
+
+    def test_freeze_distinguishes_types(self):
+        self.assertNotEqual(freeze({'a': {'x': 1}}), freeze({'a': [('x', 1)]}))
+        self.assertNotEqual(freeze({'a': True}), freeze({'a': 1}))
+        self.assertNotEqual(freeze({'a': 1}), freeze({'a': 1.0}))
+        self.assertNotEqual(freeze({'a': [1]}), freeze({'a': set([1])}))
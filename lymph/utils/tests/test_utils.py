@@ -1,6 +1,8 @@
 from unittest import TestCase
 
-from lymph.utils import import_object, Undefined
+import mock
+
+from lymph.utils import import_object, Undefined, IdGenerator
 
 
 class ImportTests(TestCase):
@@ -21,3 +23,16 @@ class UndefinedTests(TestCase):
         self.assertNotEqual(Undefined, False)
         self.assertFalse(bool(Undefined))
         self.assertEqual(str(Undefined), 'Undefined')
+
+
+class IdGeneratorTests(TestCase):
+    def test_ids_are_unique(self):
+        make_id = IdGenerator()
+        ids = set(make_id() for i in range(1000))
+        self.assertEqual(len(ids), 1000)
+
+    def test_forked_processes_use_a_new_prefix(self):
+        make_id = IdGenerator()
+        first_id = make_id()
+        with mock.patch('os.getpid', return_value=make_id.pid + 1):
+            self.assertNotEqual(make_id()[:16], first_id[:16])